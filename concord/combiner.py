@@ -0,0 +1,53 @@
+"""Output combiner for Concord
+.. module:: combiner
+    :synopsis: Pre-aggregate produced values per (stream, key)
+"""
+
+from collections import OrderedDict
+
+# Number of distinct (stream, key) pairs held before the combiner is flushed.
+kDefaultCombinerMaxEntries = 10000
+
+class Combiner:
+    """Merges values produced on the same stream and key until flushed.
+    """
+
+    def __init__(self, max_entries=kDefaultCombinerMaxEntries):
+        """
+        :param max_entries: Number of pending (stream, key) pairs after which
+            `combine` asks for a flush.
+        :type max_entries: int.
+        """
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+
+    def combine(self, stream, key, value, fn):
+        """Merge `value` into the pending value for (stream, key).
+        :param fn: Binary function merging the pending value with `value`.
+        :type fn: function.
+        :returns: bool. Whether the combiner is full and should be flushed.
+        """
+        entry = (stream, key)
+        if entry in self.entries:
+            self.entries[entry] = fn(self.entries[entry], value)
+        else:
+            self.entries[entry] = value
+        return len(self.entries) >= self.max_entries
+
+    def drain(self):
+        """Remove and return all pending values.
+        :returns: list((str, str, str)). (stream, key, data) triples, in the
+            order their (stream, key) pair was first combined.
+        """
+        drained = [(stream, key, encode(value))
+                   for (stream, key), value in self.entries.iteritems()]
+        self.entries.clear()
+        return drained
+
+    def __len__(self):
+        return len(self.entries)
+
+def encode(value):
+    if isinstance(value, basestring):
+        return value
+    return str(value)
@@ -6,18 +6,19 @@
 import sys
 import os
 import types
+import traceback
 import threading
 from thrift import Thrift
+from thrift.Thrift import TMessageType, TType
 from thrift.transport import (
     TSocket, TTransport
 )
 from thrift.server import TServer
 from thrift.protocol import TBinaryProtocol
-from concord.internal.thrift import (
-    ComputationService,
-    BoltProxyService
-)
+from concord.internal.thrift import ComputationService, BoltProxyService
 from concord.internal.thrift.ttypes import (
+    BackPressure,
+    BoltError,
     Record,
     ComputationTx,
     ComputationMetadata,
@@ -28,8 +29,26 @@ from concord.internal.thrift.ttypes import (
 
 from concord.internal.thrift.constants import (
     kConcordEnvKeyClientListenAddr,
-    kConcordEnvKeyClientProxyAddr
+    kConcordEnvKeyClientProxyAddr,
+    kMessageQueueWatermarkTopic
+)
+from concord import envelope
+from concord.streams import StreamTable
+from concord.combiner import Combiner, encode as encode_value
+from concord.timers import TimerWheel, kTimerWheelKey, now_ms
+from concord.watermarks import WatermarkTracker, is_watermark_record
+from concord.errors import ErrorPolicy, ErrorAction, dead_letter_payload
+from concord.proxy import (
+    ProxyClientPool,
+    PipelinedStateWriter,
+    FailedStateWrites
 )
+from concord.output import OutputBuffer
+from concord import spill
+from concord.spill import Spiller
+from concord.dedupe import is_traced, record_id, timer_id
+from concord import partition
+from concord.topology import TopologyView
 import logging
 import logging.handlers
 
@@ -52,7 +71,11 @@ class Metadata:
     """High-level wrapper for `ComputationMetadata`
     """
 
-    def __init__(self, name=None, istreams=[], ostreams=[]):
+    def __init__(self, name=None, istreams=[], ostreams=[], envelopes=False,
+                 stream_ids=False, timer_wheel=False, max_out_of_orderness=0,
+                 error_policy=None, proxy_pool_size=1, async_state=False,
+                 output_limits=None, spill_threshold=None, dedupe=None,
+                 hot_keys=None, direct_dispatch=None):
         """Create a new Metadata object
 
         :param name: The globally unique identifier of the computation.
@@ -62,21 +85,128 @@ class Metadata:
             is a pair, use the grouping passed as the second item.
         :type istreams: list(str), (str, StreamGrouping).
         :param ostreams: The list of streams this computation may produce on.
-        :type ostreams: list(str).
+            If an item is a pair, the second item partitions the records
+            produced on the stream: it is called as `fn(key, data)` and the
+            partition it returns is stamped on the record key (see
+            `concord.partition`).
+        :type ostreams: list(str), (str, function).
+        :param envelopes: Pack the records of a transaction that share a
+            stream and key into envelopes (see `concord.envelope`). Incoming
+            envelopes are always unpacked, malformed ones are passed through.
+        :type envelopes: bool.
+        :param stream_ids: Send the numeric id of an ostream in place of its
+            name once the id is known (see `concord.streams`). Ids are
+            learned from incoming records; a dict gives the ids of the
+            ostreams, which incoming records never carry, up front.
+        :type stream_ids: bool, dict(str, int).
+        :param timer_wheel: Keep timers set via `set_timer` in a local timer
+            wheel driven by a single framework timer (see `concord.timers`).
+        :type timer_wheel: bool.
+        :param max_out_of_orderness: How far behind the latest event time
+            records of an istream may arrive, in ms. Used to derive
+            watermarks (see `concord.watermarks`).
+        :type max_out_of_orderness: int.
+        :param error_policy: How exceptions raised by `process_record` and
+            `process_timer` are handled. Defaults to exiting the process.
+        :type error_policy: ErrorPolicy.
+        :param proxy_pool_size: The maximum number of connections opened to
+            the proxy, for computations calling `set_state` / `get_state` from
+            several threads.
+        :type proxy_pool_size: int.
+        :param async_state: Pipeline `set_state` calls instead of waiting for
+            each reply. Writes are still flushed, in order, before the
+            transaction they belong to is returned to the framework. Writes
+            the proxy keeps rejecting are handled by the `error_policy`.
+        :type async_state: bool.
+        :param output_limits: Bounds on the records produced per batch on
+            some ostreams, with the `BackPressure` policy applied past them
+            (see `concord.output`). `BackPressure.BLOCK_SENDER` limits need a
+            `spill_threshold`.
+        :type output_limits: dict(str, OutputLimit).
+        :param spill_threshold: The number of records a transaction holds in
+            memory before they are spilled to a temporary file and streamed
+            into the reply (see `concord.spill`). Disabled when None.
+        :type spill_threshold: int.
+        :param dedupe: Skips incoming records whose id, derived from their
+            trace and span ids, stream, time, key, payload and position in
+            their batch, was seen before (see `concord.dedupe`). Records the
+            framework did not stamp with their span are never skipped.
+        :type dedupe: Deduplicator, RotatingBloomFilter.
+        :param hot_keys: Tracks the frequency of produced keys per ostream,
+            optionally salting hot keys (see `concord.hotkeys`).
+        :type hot_keys: HotKeys.
+        :param direct_dispatch: Sends the records of some ostreams straight
+            to co-located downstream instances (see `concord.pipe`).
+        :type direct_dispatch: DirectDispatch.
         """
         self.name = name
         self.istreams = istreams
-        self.ostreams = ostreams
+        self.ostreams = [s if isinstance(s, basestring) else s[0]
+                         for s in ostreams]
+        self.partitioners = dict(s for s in ostreams
+                                 if not isinstance(s, basestring))
+        self.envelopes = envelopes
+        self.stream_ids = stream_ids
+        self.timer_wheel = timer_wheel
+        self.max_out_of_orderness = max_out_of_orderness
+        self.error_policy = error_policy or ErrorPolicy()
+        self.proxy_pool_size = proxy_pool_size
+        self.async_state = async_state
+        self.output_limits = output_limits or {}
+        self.spill_threshold = spill_threshold
+        self.dedupe = dedupe
+        self.hot_keys = hot_keys
+        self.direct_dispatch = direct_dispatch
         if len(self.istreams) == 0 and len(self.ostreams) == 0:
             raise Exception("Both input and output streams are empty")
-
-def new_computation_context(tcp_proxy):
+        if not spill_threshold and any(
+                limit.policy == BackPressure.BLOCK_SENDER
+                for limit in self.output_limits.itervalues()):
+            raise Exception("BLOCK_SENDER output limits need a spill_threshold")
+
+def new_computation_context(tcp_proxy, streams=None, combiner=None,
+                            timer_wheel=None, watermarks=None, output=None,
+                            spiller=None, hot_keys=None, partitioners=None,
+                            topology=None, transaction=None, deferred=None):
     """Creates a context object wrapping a transaction.
+    :param streams: Table used to intern the names of produced streams.
+    :type streams: StreamTable.
+    :param combiner: Combiner backing `ComputationContext.combine`.
+    :type combiner: Combiner.
+    :param timer_wheel: Wheel holding the timers set via `set_timer`. When
+        None, timers are set on the transaction directly.
+    :type timer_wheel: TimerWheel.
+    :param watermarks: Tracker backing `ComputationContext.watermark`.
+    :type watermarks: WatermarkTracker.
+    :param output: Buffer enforcing the output limits of produced records.
+    :type output: OutputBuffer.
+    :param spiller: Spills the records of the transaction once too many are
+        held in memory.
+    :type spiller: Spiller.
+    :param hot_keys: Tracks, and possibly salts, the keys of produced records.
+    :type hot_keys: HotKeys.
+    :param partitioners: The partition function of some streams.
+    :type partitioners: dict(str, function).
+    :param topology: The view backing `ComputationContext.topology`.
+    :type topology: TopologyView.
+    :param transaction: The transaction to wrap, a new one by default.
+    :type transaction: ComputationTx.
+    :param deferred: When set, the combined values and timer wheel timers
+        are not applied right away but appended to this list as (function,
+        args) pairs, for the caller to apply once the handler succeeds.
+    :type deferred: list.
     :returns: (ComputationContext, ComputationTx)
     """
-    transaction = ComputationTx()
-    transaction.records = []
-    transaction.timers = {}
+    if transaction is None:
+        transaction = ComputationTx()
+        transaction.records = []
+        transaction.timers = {}
+
+    def apply(fn, *args):
+        if deferred is None:
+            fn(*args)
+        else:
+            deferred.append((fn, args))
 
     class ComputationContext:
         """Wrapper class exposing a convenient API for computation to proxy
@@ -93,11 +223,46 @@ def new_computation_context(tcp_proxy):
             :param data: The binary blob to emit down stream.
             :type data: str.
             """
+            if hot_keys is not None:
+                key = hot_keys.route(stream, key)
+            if partitioners and stream in partitioners:
+                key = partition.stamp(partitioners[stream](key, data), key)
             r = Record()
             r.key = key
             r.data = data
-            r.userStream = stream
-            transaction.records.append(r)
+            r.userStream = streams.intern(stream) if streams else stream
+            if output is not None:
+                output.append(transaction, r)
+            else:
+                transaction.records.append(r)
+            if spiller is not None:
+                spiller.check(transaction)
+
+        def combine(self, stream, key, value, fn):
+            """Merge a value into the pending output for (stream, key). The
+            combined value is emitted once, when the current batch is returned
+            to the framework or when too many pairs are pending.
+
+            :param stream: The stream to emit the combined record on.
+            :type stream: str.
+            :param key: The key to route the combined record by.
+            :type key: str.
+            :param value: The value to merge. Values which are not strings are
+                emitted using `str`.
+            :type value: object.
+            :param fn: Merges the pending value with a new one, e.g.
+                `operator.add`.
+            :type fn: function.
+            """
+            if combiner is None:
+                self.produce_record(stream, key, encode_value(value))
+            else:
+                apply(self.combine_value, stream, key, value, fn)
+
+        def combine_value(self, stream, key, value, fn):
+            if combiner.combine(stream, key, value, fn):
+                for s, k, data in combiner.drain():
+                    self.produce_record(s, k, data)
 
         def set_timer(self, key, time):
             """Set a timer callback for some point in the future.
@@ -106,7 +271,26 @@ def new_computation_context(tcp_proxy):
             :name time: The time (in ms) at which the callback should trigger.
             :type time: int.
             """
-            transaction.timers[key] = time
+            if timer_wheel is not None:
+                apply(timer_wheel.add, key, time)
+            else:
+                transaction.timers[key] = time
+
+        def watermark(self):
+            """The low watermark of the computation's `istreams`: records
+            with an earlier event time are not expected anymore.
+            :returns: int. The watermark in ms, or None if unknown.
+            """
+            if watermarks is None:
+                return None
+            return watermarks.watermark()
+
+        def topology(self):
+            """The latest layout of the topology pushed by the framework,
+            e.g. `ctx.topology().parallelism(stream)`.
+            :returns: TopologyView.
+            """
+            return topology
 
         def set_state(self, key, value):
             tcp_proxy.setState(key, value)
@@ -120,7 +304,7 @@ class Computation:
     """Abstract class for users to extend when making computations.
     """
 
-    def init(ctx):
+    def init(self, ctx):
         """Called when the framework has registered the computation
             successfully. Gives users a first opportunity to schedule
             timer callbacks and produce records.
@@ -129,7 +313,7 @@ class Computation:
         """
         pass
 
-    def destroy():
+    def destroy(self):
         """Called right before the concord proxy is ready to shutdown.
         Gives users an opportunity to perform some cleanup before the
         process is killed."""
@@ -137,6 +321,8 @@ class Computation:
 
     def process_record(ctx, record):
         """Process an incoming record on one of the computation's `istreams`.
+            May be a generator yielding (stream, key, data) tuples, which are
+            produced as if passed to `produce_record`.
         :param ctx: The computation context object provided by the system.
         :type ctx: ComputationContext.
         :param record: The `Record` to emit downstream.
@@ -145,7 +331,8 @@ class Computation:
         raise Exception('process_record not implemented')
 
     def process_timer(ctx, key, time):
-        """Process a timer callback previously set via `set_timer`.
+        """Process a timer callback previously set via `set_timer`. May be a
+            generator, like `process_record`.
         :param ctx: The computation context object provided by the system.
         :type ctx: ComputationContext.
         :param key: The name of the timer.
@@ -155,6 +342,16 @@ class Computation:
         """
         raise Exception('process_timer not implemented')
 
+    def process_watermark(self, ctx, watermark):
+        """Called when the low watermark of the computation's `istreams`
+            advances.
+        :param ctx: The computation context object provided by the system.
+        :type ctx: ComputationContext.
+        :param watermark: The new watermark, in ms.
+        :type watermark: int.
+        """
+        pass
+
     def metadata():
         """The metadata defining this computation.
         :returns: Metadata.
@@ -165,9 +362,108 @@ class ComputationServiceWrapper(ComputationService.Iface):
     def __init__(self, handler):
         self.handler = handler
         self.proxy_client = None
+        self.proxy_lock = threading.Lock()
+        self.state_writer = None
+        self.handler_metadata = None
+        self.streams = StreamTable()
+        self.combiner = Combiner()
+        self.timer_wheel = TimerWheel()
+        self.timer_wheel_armed = None
+        self.watermarks = None
+        self.output = None
+        self.spiller = None
+        self.topology = TopologyView()
+        self.error_counts = {'errors': 0, 'retries': 0, 'skipped': 0,
+                             'dead_lettered': 0}
+
+    def new_context(self, transaction=None, deferred=None):
+        md = self.computation_metadata()
+        if self.watermarks is None:
+            self.watermarks = WatermarkTracker(
+                [s if isinstance(s, basestring) else s[0] for s in md.istreams],
+                md.max_out_of_orderness)
+        if self.output is None:
+            self.output = OutputBuffer(md.output_limits,
+                                       release=self.spill_transactions)
+        if self.spiller is None and md.spill_threshold:
+            self.spiller = Spiller(md.spill_threshold,
+                                   self.streams if md.stream_ids else None,
+                                   self.output)
+        return new_computation_context(
+            self.state_proxy(), streams=self.streams, combiner=self.combiner,
+            timer_wheel=self.timer_wheel if md.timer_wheel else None,
+            watermarks=self.watermarks, output=self.output,
+            spiller=self.spiller, hot_keys=md.hot_keys,
+            partitioners=md.partitioners, topology=self.topology,
+            transaction=transaction, deferred=deferred)
+
+    def complete(self, transactions):
+        """Applies the wire-level encodings enabled in the metadata to the
+            transactions about to be returned to the proxy.
+        """
+        md = self.computation_metadata()
+        if self.state_writer is not None:
+            try:
+                self.state_writer.flush()
+            except FailedStateWrites as e:
+                self.state_writes_failed(e, transactions)
+        if len(self.combiner) > 0 and transactions:
+            self.flush_combiner(transactions[-1])
+        if self.output is not None:
+            drops = self.output.end_batch()
+            if drops:
+                ccord_logger.warning("Dropped %d records over output limits: %s",
+                                     drops, self.output.stats)
+        if md.direct_dispatch is not None:
+            md.direct_dispatch.dispatch(transactions, self.topology)
+        if md.envelopes:
+            self.pack_transactions(transactions)
+        if md.stream_ids:
+            for transaction in transactions:
+                self.streams.compact(transaction.records)
+        if md.timer_wheel and transactions:
+            self.arm_timer_wheel(transactions[-1])
+        return transactions
+
+    def state_writes_failed(self, error, transactions):
+        """Applies the error policy of the computation to the pipelined state
+            writes the proxy kept rejecting, dead lettering them on the last
+            transaction of the batch.
+        """
+        policy = self.computation_metadata().error_policy
+        self.error_counts['errors'] += len(error.writes)
+        if policy.action == ErrorAction.FAIL:
+            ccord_logger.critical("Exception in set_state: %s", error)
+            sys.exit(1)
+        skipped = error.writes
+        if policy.action == ErrorAction.DEAD_LETTER and transactions:
+            ctx = self.new_context(transactions[-1])[0]
+            skipped = [(key, value, reason)
+                       for key, value, reason in error.writes
+                       if not self.dead_letter(ctx, 'set_state', None, key,
+                                               value, str(reason))]
+            self.error_counts['dead_lettered'] += \
+                len(error.writes) - len(skipped)
+            ccord_logger.error("Dead lettering failed state writes: %s",
+                               error)
+        if skipped:
+            self.error_counts['skipped'] += len(skipped)
+            ccord_logger.error("Skipping %d failed state writes: %s",
+                               len(skipped), error)
+
+    def arm_timer_wheel(self, transaction):
+        """Makes sure a framework timer fires no later than the next timer
+            pending in the wheel.
+        """
+        deadline = self.timer_wheel.next_deadline()
+        if deadline is None:
+            return
+        if self.timer_wheel_armed is None or deadline < self.timer_wheel_armed:
+            transaction.timers[kTimerWheelKey] = deadline
+            self.timer_wheel_armed = deadline
 
     def init(self):
-        ctx, transaction = new_computation_context(self.proxy())
+        ctx, transaction = self.new_context()
         try:
             self.handler.init(ctx)
         except Exception as e:
@@ -175,6 +471,7 @@ class ComputationServiceWrapper(ComputationService.Iface):
             ccord_logger.critical("Exception in client init")
             sys.exit(1)
 
+        self.complete([transaction])
         return transaction
 
     def destroy(self):
@@ -185,29 +482,217 @@ class ComputationServiceWrapper(ComputationService.Iface):
             ccord_logger.critical("Exception in client destroy")
             sys.exit(1)
 
-    def boltProcessRecords(self, records):
-        def txfn(record):
-            ctx, transaction = new_computation_context(self.proxy())
+    def run_handler(self, name, fn, stream=None, key=None, data=None):
+        """Runs `fn(ctx)` on a fresh transaction, applying the error policy of
+            the computation if it raises. If `fn` returns a generator, the
+            records it yields are produced on the transaction. Values combined
+            and timer wheel timers set by `fn` only take effect once it
+            succeeds, so that a failed attempt leaves no trace.
+        :param name: The name of the handler, for logging.
+        :type name: str.
+        :param stream: The stream of the input, for dead lettering.
+        :param key: The key of the input, for dead lettering.
+        :param data: The payload of the input, for dead lettering.
+        :returns: ComputationTx.
+        """
+        policy = self.computation_metadata().error_policy
+        attempt = 0
+        while True:
+            deferred = []
+            ctx, transaction = self.new_context(deferred=deferred)
             try:
-                self.handler.process_record(ctx, record)
+                outputs = fn(ctx)
+                if isinstance(outputs, types.GeneratorType):
+                    self.produce_outputs(ctx, outputs)
+                for effect, args in deferred:
+                    effect(*args)
+                return transaction
             except Exception as e:
                 ccord_logger.exception(e)
-                ccord_logger.critical("Exception in process_record")
-                sys.exit(1)
-            return transaction
-        return map(txfn, records)
+                self.output.discard(transaction)
+                spill.discard(transaction)
+                self.error_counts['errors'] += 1
+                if attempt < policy.retries:
+                    attempt += 1
+                    self.error_counts['retries'] += 1
+                    ccord_logger.warning("Retrying %s (%d/%d)", name, attempt,
+                                         policy.retries)
+                    continue
+                error = traceback.format_exc()
+                break
+
+        if policy.action == ErrorAction.SKIP:
+            self.error_counts['skipped'] += 1
+            ccord_logger.error("Skipping input of failed %s, errors: %s",
+                               name, self.error_counts)
+            return self.new_context()[1]
+        if policy.action == ErrorAction.DEAD_LETTER:
+            ctx, transaction = self.new_context()
+            if self.dead_letter(ctx, name, stream, key, data, error):
+                self.error_counts['dead_lettered'] += 1
+                ccord_logger.error("Dead lettering input of failed %s, "
+                                   "errors: %s", name, self.error_counts)
+                return transaction
+            self.output.discard(transaction)
+            spill.discard(transaction)
+            self.error_counts['skipped'] += 1
+            ccord_logger.error("Skipping input of failed %s, errors: %s",
+                               name, self.error_counts)
+            return self.new_context()[1]
+        ccord_logger.critical("Exception in %s", name)
+        sys.exit(1)
 
-    def boltProcessTimer(self, key, time):
-        ctx, transaction = new_computation_context(self.proxy())
+    def dead_letter(self, ctx, name, stream, key, data, error):
+        """Produces a failing input on the dead letter stream.
+        :returns: bool. Whether it could be produced.
+        """
+        policy = self.computation_metadata().error_policy
         try:
-            self.handler.process_timer(ctx, key, time)
+            ctx.produce_record(policy.dead_letter_stream, key,
+                               dead_letter_payload(name, stream, key, data,
+                                                   error))
+            return True
         except Exception as e:
             ccord_logger.exception(e)
-            ccord_logger.critical("Exception in process_timer")
-            sys.exit(1)
+            return False
+
+    def produce_outputs(self, ctx, outputs):
+        """Produces the (stream, key, data) tuples yielded by a generator
+            handler as they come, so that output limits and spilling apply
+            while it runs. The generator is closed if producing fails.
+        """
+        try:
+            for stream, key, data in outputs:
+                ctx.produce_record(stream, key, data)
+        finally:
+            outputs.close()
+
+    def spill_transactions(self, transactions):
+        for transaction in transactions:
+            self.spiller.spill(transaction)
+
+    def merge_transaction(self, transaction, other):
+        self.output.merge(transaction, other)
+        if self.spiller is not None:
+            self.spiller.merge(transaction, other)
+        transaction.records.extend(other.records)
+        transaction.timers.update(other.timers)
 
+    def boltProcessRecords(self, records):
+        """Runs `process_record` on every record. The logical records of an
+            envelope run on the single transaction of their wire record, with
+            the id of the wire record, so that the proxy gets one transaction
+            per record it sent.
+        :returns: list(ComputationTx).
+        """
+        dedupe = self.computation_metadata().dedupe
+        def txfn(indexed):
+            position, record = indexed
+            tx_id = record_id(record, position)
+            if is_watermark_record(record):
+                transaction = self.new_context()[1]
+            elif (dedupe is not None and is_traced(record)
+                  and dedupe.seen(tx_id)):
+                transaction = self.new_context()[1]
+            else:
+                logical = envelope.unpack_record(record)
+                self.strip_partitions(logical)
+                transactions = map(self.record_transaction, logical)
+                transaction = transactions[0]
+                for other in transactions[1:]:
+                    self.merge_transaction(transaction, other)
+            process_watermark = getattr(self.handler, 'process_watermark', None)
+            if self.watermarks.observe(record) and process_watermark:
+                watermark = self.watermarks.watermark()
+                self.merge_transaction(transaction, self.run_handler(
+                    'process_watermark',
+                    lambda ctx: process_watermark(ctx, watermark),
+                    None, kMessageQueueWatermarkTopic, str(watermark)))
+            transaction.id = tx_id
+            return transaction
+        self.streams.resolve(records)
+        return self.complete(map(txfn, enumerate(records)))
+
+    def record_transaction(self, record):
+        return self.run_handler(
+            'process_record',
+            lambda ctx: self.handler.process_record(ctx, record),
+            record.userStream, record.key, record.data)
+
+    def strip_partitions(self, records):
+        """Removes the partition stamped by upstream partitioners from the
+            keys of records on `StreamGrouping.CUSTOM` istreams.
+        """
+        custom = set(s[0] for s in self.computation_metadata().istreams
+                     if not isinstance(s, basestring)
+                     and s[1] == StreamGrouping.CUSTOM)
+        if not custom:
+            return
+        for record in records:
+            if record.userStream in custom:
+                record.key = partition.split(record.key)[1]
+
+    def flush_combiner(self, transaction):
+        """Produces the pending combined values on `transaction`, like
+            `ComputationContext.produce_record` would.
+        """
+        ctx = self.new_context(transaction)[0]
+        for stream, key, data in self.combiner.drain():
+            ctx.produce_record(stream, key, data)
+
+    def pack_transactions(self, transactions):
+        """Packs the records of each transaction into envelopes, so that
+            every transaction keeps its own outputs.
+        """
+        for transaction in transactions:
+            transaction.records = envelope.pack_records(transaction.records)
+
+    def boltProcessTimer(self, key, time):
+        return self.complete([self.timer_transaction(key, time)])[0]
+
+    def boltProcessTimers(self, timers):
+        """Batched variant of `boltProcessTimer`.
+        :param timers: The (key, time) pairs of the timers that fired.
+        :type timers: list((str, int)).
+        :returns: list(ComputationTx). One transaction per timer.
+        """
+        def txfn(timer):
+            key, time = timer
+            return self.timer_transaction(key, time)
+        return self.complete(map(txfn, timers))
+
+    def timer_transaction(self, key, time):
+        if key != kTimerWheelKey:
+            return self.dispatch_timer(key, time)
+        self.timer_wheel_armed = None
+        transaction = self.new_context()[1]
+        transaction.id = timer_id(kTimerWheelKey, time)
+        for key, deadline in self.timer_wheel.advance(max(time, now_ms())):
+            self.merge_transaction(transaction,
+                                   self.dispatch_timer(key, deadline))
         return transaction
 
+    def dispatch_timer(self, key, time):
+        transaction = self.run_handler(
+            'process_timer',
+            lambda ctx: self.handler.process_timer(ctx, key, time),
+            None, key, str(time))
+        transaction.id = timer_id(key, time)
+        return transaction
+
+    def updateTopology(self, topology):
+        """Applies a `TopologyMetadata` to the cached view, resizing the
+            hash rings partitioning the ostreams to their consumers.
+        """
+        if not self.topology.update(topology):
+            return
+        ccord_logger.info("Topology updated to version %d",
+                          self.topology.version)
+        for stream, fn in self.computation_metadata().partitioners.iteritems():
+            parallelism = self.topology.parallelism(stream)
+            if getattr(fn, 'auto_size', False) and parallelism:
+                fn.resize(parallelism)
+
     def boltMetadata(self):
         def enrich_stream(stream):
             defaultGrouping = StreamGrouping.SHUFFLE
@@ -221,14 +706,7 @@ class ComputationServiceWrapper(ComputationService.Iface):
                 sm.grouping = defaultGrouping
             return sm
 
-        try:
-            ccord_logger.info("Getting client metadata")
-            md = self.handler.metadata()
-        except Exception as e:
-            ccord_logger.exception(e)
-            ccord_logger.critical("Exception in metadata")
-            sys.exit(1)
-
+        md = self.computation_metadata()
         metadata = ComputationMetadata()
         metadata.name = md.name
         metadata.istreams = list(map(enrich_stream, md.istreams))
@@ -236,19 +714,40 @@ class ComputationServiceWrapper(ComputationService.Iface):
         ccord_logger.info("Got metadata: %s", metadata)
         return metadata
 
+    def computation_metadata(self):
+        if not self.handler_metadata:
+            try:
+                ccord_logger.info("Getting client metadata")
+                self.handler_metadata = self.handler.metadata()
+                if isinstance(self.handler_metadata.stream_ids, dict):
+                    for name, stream_id in \
+                            self.handler_metadata.stream_ids.iteritems():
+                        self.streams.register(name, stream_id)
+            except Exception as e:
+                ccord_logger.exception(e)
+                ccord_logger.critical("Exception in metadata")
+                sys.exit(1)
+        return self.handler_metadata
+
     def proxy(self):
         if not self.proxy_client:
-            self.proxy_client = self.new_proxy_client()
+            with self.proxy_lock:
+                if not self.proxy_client:
+                    self.proxy_client = self.new_proxy_client()
         return self.proxy_client
 
+    def state_proxy(self):
+        """The client backing `set_state` / `get_state`."""
+        if not self.computation_metadata().async_state:
+            return self.proxy()
+        if self.state_writer is None:
+            self.state_writer = PipelinedStateWriter(self.proxy())
+        return self.state_writer
+
     def new_proxy_client(self):
         host, port = self.proxy_address
-        socket = TSocket.TSocket(host, port)
-        transport = TTransport.TFramedTransport(socket)
-        protocol = TBinaryProtocol.TBinaryProtocolAccelerated(transport)
-        client = BoltProxyService.Client(protocol)
-        transport.open()
-        return client
+        return ProxyClientPool(
+            host, port, size=self.computation_metadata().proxy_pool_size)
 
     def set_proxy_address(self, host, port):
         md = self.boltMetadata()
@@ -260,6 +759,175 @@ class ComputationServiceWrapper(ComputationService.Iface):
         proxy = self.proxy()
         proxy.registerWithScheduler(md)
 
+class boltProcessTimers_args:
+    """Arguments of the `boltProcessTimers` call, which is not part of the
+        generated `ComputationService`.
+
+    Attributes:
+     - timers: The (key, time) pairs of the timers that fired, sent as a
+       list of structs.
+    """
+
+    timer_spec = (
+        None,
+        (1, TType.STRING, 'key', None, None),
+        (2, TType.I64, 'time', None, None),
+    )
+    thrift_spec = (
+        None,
+        (1, TType.LIST, 'timers', (TType.STRUCT, (None, timer_spec)), None),
+    )
+
+    def __init__(self, timers=None):
+        self.timers = timers
+
+    def read(self, iprot):
+        iprot.readStructBegin()
+        while True:
+            _, ftype, fid = iprot.readFieldBegin()
+            if ftype == TType.STOP:
+                break
+            if fid == 1 and ftype == TType.LIST:
+                self.timers = []
+                _, size = iprot.readListBegin()
+                for _ in xrange(size):
+                    self.timers.append(self.read_timer(iprot))
+                iprot.readListEnd()
+            else:
+                iprot.skip(ftype)
+            iprot.readFieldEnd()
+        iprot.readStructEnd()
+
+    def read_timer(self, iprot):
+        key = time = None
+        iprot.readStructBegin()
+        while True:
+            _, ftype, fid = iprot.readFieldBegin()
+            if ftype == TType.STOP:
+                break
+            if fid == 1 and ftype == TType.STRING:
+                key = iprot.readString()
+            elif fid == 2 and ftype == TType.I64:
+                time = iprot.readI64()
+            else:
+                iprot.skip(ftype)
+            iprot.readFieldEnd()
+        iprot.readStructEnd()
+        return (key, time)
+
+    def write(self, oprot):
+        oprot.writeStructBegin('boltProcessTimers_args')
+        if self.timers is not None:
+            oprot.writeFieldBegin('timers', TType.LIST, 1)
+            oprot.writeListBegin(TType.STRUCT, len(self.timers))
+            for key, time in self.timers:
+                oprot.writeStructBegin('Timer')
+                oprot.writeFieldBegin('key', TType.STRING, 1)
+                oprot.writeString(key)
+                oprot.writeFieldEnd()
+                oprot.writeFieldBegin('time', TType.I64, 2)
+                oprot.writeI64(time)
+                oprot.writeFieldEnd()
+                oprot.writeFieldStop()
+                oprot.writeStructEnd()
+            oprot.writeListEnd()
+            oprot.writeFieldEnd()
+        oprot.writeFieldStop()
+        oprot.writeStructEnd()
+
+    def validate(self):
+        return
+
+class boltProcessTimers_result(ComputationService.boltProcessRecords_result):
+    """Result of the `boltProcessTimers` call: a list of transactions, like
+        the result of `boltProcessRecords`.
+    """
+    pass
+
+class ComputationProcessor(ComputationService.Processor):
+    """Processor writing the transactions returned to the framework with
+        `spill.write_reply` when some of their records were spilled, instead
+        of encoding the whole reply in memory. It also accepts the
+        `BoltProxyService.updateTopology` call, so that the topology can be
+        pushed to the computation, and `boltProcessTimers`, firing a batch of
+        timers in one call.
+    """
+
+    def __init__(self, handler):
+        ComputationService.Processor.__init__(self, handler)
+        self._processMap["init"] = ComputationProcessor.process_init
+        self._processMap["boltProcessRecords"] = \
+            ComputationProcessor.process_boltProcessRecords
+        self._processMap["boltProcessTimer"] = \
+            ComputationProcessor.process_boltProcessTimer
+        self._processMap["boltProcessTimers"] = \
+            ComputationProcessor.process_boltProcessTimers
+        self._processMap["updateTopology"] = \
+            ComputationProcessor.process_updateTopology
+
+    def process_init(self, seqid, iprot, oprot):
+        args = ComputationService.init_args()
+        args.read(iprot)
+        iprot.readMessageEnd()
+        self.reply('init', seqid, ComputationService.init_result(),
+                   self._handler.init, oprot)
+
+    def process_boltProcessRecords(self, seqid, iprot, oprot):
+        args = ComputationService.boltProcessRecords_args()
+        args.read(iprot)
+        iprot.readMessageEnd()
+        self.reply('boltProcessRecords', seqid,
+                   ComputationService.boltProcessRecords_result(),
+                   lambda: self._handler.boltProcessRecords(args.records),
+                   oprot)
+
+    def process_boltProcessTimer(self, seqid, iprot, oprot):
+        args = ComputationService.boltProcessTimer_args()
+        args.read(iprot)
+        iprot.readMessageEnd()
+        self.reply('boltProcessTimer', seqid,
+                   ComputationService.boltProcessTimer_result(),
+                   lambda: self._handler.boltProcessTimer(args.key, args.time),
+                   oprot)
+
+    def process_boltProcessTimers(self, seqid, iprot, oprot):
+        args = boltProcessTimers_args()
+        args.read(iprot)
+        iprot.readMessageEnd()
+        self.reply('boltProcessTimers', seqid, boltProcessTimers_result(),
+                   lambda: self._handler.boltProcessTimers(args.timers or []),
+                   oprot)
+
+    def process_updateTopology(self, seqid, iprot, oprot):
+        args = BoltProxyService.updateTopology_args()
+        args.read(iprot)
+        iprot.readMessageEnd()
+        result = BoltProxyService.updateTopology_result()
+        try:
+            self._handler.updateTopology(args.topology)
+        except BoltError as e:
+            result.e = e
+        oprot.writeMessageBegin("updateTopology", TMessageType.REPLY, seqid)
+        result.write(oprot)
+        oprot.writeMessageEnd()
+        oprot.trans.flush()
+
+    def reply(self, name, seqid, result, call, oprot):
+        try:
+            result.success = call()
+        except BoltError as e:
+            result.e = e
+        transactions = result.success
+        if not isinstance(transactions, list):
+            transactions = [transactions] if transactions else []
+        if any(spill.spilled(transaction) for transaction in transactions):
+            spill.write_reply(name, seqid, result, oprot.trans)
+            return
+        oprot.writeMessageBegin(name, TMessageType.REPLY, seqid)
+        result.write(oprot)
+        oprot.writeMessageEnd()
+        oprot.trans.flush()
+
 def serve_computation(handler):
     """Helper function. Parses environment variables and starts a thrift service
         wrapping the user-defined computation.
@@ -281,9 +949,9 @@ def serve_computation(handler):
     proxy_host, proxy_port = address_str(
         os.environ[kConcordEnvKeyClientProxyAddr])
 
-    processor = ComputationService.Processor(comp)
+    processor = ComputationProcessor(comp)
     transport = TSocket.TServerSocket(host="127.0.0.1", port=listen_port)
-    tfactory = TTransport.TFramedTransportFactory()
+    tfactory = spill.SpillingFramedTransportFactory()
     pfactory = TBinaryProtocol.TBinaryProtocolAcceleratedFactory()
 
     try:
@@ -0,0 +1,297 @@
+"""Deduplication for Concord
+.. module:: dedupe
+    :synopsis: Deterministic transaction ids and duplicate filtering
+"""
+
+import math
+import struct
+import hashlib
+from collections import OrderedDict
+from concord.timers import now_ms
+
+_ids = struct.Struct('>qq')
+
+# Number of recent ids remembered exactly.
+kDefaultDedupeLruSize = 100000
+# Number of ids the bloom filter holds before it is cleared.
+kDefaultDedupeCapacity = 10000000
+kDefaultDedupeErrorRate = 0.0001
+# Number of bloom filters a `RotatingBloomFilter` keeps.
+kDefaultDedupeGenerations = 4
+# State key `RotatingBloomFilter` checkpoints to.
+kDedupeStateKey = '__concord_dedupe'
+
+def identity(*parts):
+    """Hash `parts` to a signed 64 bit id. Unicode parts are hashed as
+    UTF-8.
+    """
+    digest = hashlib.md5('\0'.join(
+        part.encode('utf-8') if isinstance(part, unicode) else str(part)
+        for part in parts)).digest()
+    return _ids.unpack(digest)[0]
+
+def is_traced(record):
+    """Whether the framework stamped `record` with the span that produced
+    it. Only then does `record_id` tell a redelivered record from a distinct
+    record with the same contents.
+    :returns: bool.
+    """
+    return record.meta is not None and bool(record.meta.sourceSpanId)
+
+def record_id(record, position=0):
+    """The id of an incoming record: derived from its trace and span ids,
+    when the framework set them, its stream, time, key and payload, and its
+    position within the batch it was received in. Identical records of one
+    span delivered in the same batch thus get distinct ids, while a batch
+    redelivered as is gets the same ones.
+    :param position: The position of the record within its batch.
+    :type position: int.
+    :returns: int.
+    """
+    meta = record.meta
+    trace = span = 0
+    if meta is not None:
+        trace, span = meta.traceId, meta.sourceSpanId
+    stream = record.userStream
+    if stream is None and meta is not None:
+        stream = meta.stream
+    return identity('r', trace, span, stream, record.time, position,
+                    record.key, hashlib.md5(record.data or '').hexdigest())
+
+def timer_id(key, time):
+    """The id of a timer firing.
+    :returns: int.
+    """
+    return identity('t', key, time)
+
+class BloomFilter:
+    """Set membership in bounded memory, with false positives.
+    """
+    tag = 'BLM1'
+    _header = struct.Struct('<4sIdI')
+
+    def __init__(self, capacity=kDefaultDedupeCapacity,
+                 error_rate=kDefaultDedupeErrorRate):
+        """
+        :param capacity: The number of ids held at `error_rate`.
+        :type capacity: int.
+        :param error_rate: The false positive rate at capacity.
+        :type error_rate: float.
+        """
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.bits = int(math.ceil(-capacity * math.log(error_rate)
+                                  / (math.log(2) ** 2)))
+        self.hashes = max(1, int(round(self.bits * math.log(2) / capacity)))
+        self.array = bytearray((self.bits + 7) // 8)
+        self.count = 0
+
+    def positions(self, item):
+        digest = hashlib.md5(struct.pack('>q', item)).digest()
+        h1, h2 = _ids.unpack(digest)
+        for i in xrange(self.hashes):
+            yield (h1 + i * h2) % self.bits
+
+    def add(self, item):
+        """Add the 64 bit id `item`.
+        :returns: bool. Whether `item` was possibly present already.
+        """
+        present = True
+        for position in self.positions(item):
+            mask = 1 << (position & 7)
+            if not self.array[position >> 3] & mask:
+                present = False
+                self.array[position >> 3] |= mask
+        if not present:
+            self.count += 1
+        return present
+
+    def __contains__(self, item):
+        for position in self.positions(item):
+            if not self.array[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+    def full(self):
+        return self.count >= self.capacity
+
+    def clear(self):
+        self.array = bytearray(len(self.array))
+        self.count = 0
+
+    def dumps(self):
+        return (self._header.pack(self.tag, self.capacity, self.error_rate,
+                                  self.count) + str(self.array))
+
+    @classmethod
+    def loads(cls, data):
+        _, capacity, error_rate, count = cls._header.unpack_from(data)
+        bloom = cls(capacity, error_rate)
+        bloom.count = count
+        bloom.array = bytearray(data[cls._header.size:])
+        return bloom
+
+class Deduplicator:
+    """Recognizes ids seen before, in bounded memory.
+
+    The last `lru_size` ids are remembered exactly. With `exact`, the
+    default, only those are reported as duplicates, so that no input is ever
+    suppressed by mistake. Without `exact`, older ids are also looked up in a
+    bloom filter, and reported as duplicates when found there, which is
+    wrong for a fraction `error_rate` of new ids. The filter is cleared
+    whenever it holds `capacity` ids.
+    """
+
+    def __init__(self, lru_size=kDefaultDedupeLruSize,
+                 capacity=kDefaultDedupeCapacity,
+                 error_rate=kDefaultDedupeErrorRate, exact=True):
+        """
+        :param lru_size: The number of recent ids remembered exactly.
+        :type lru_size: int.
+        :param capacity: The number of ids held by the bloom filter.
+        :type capacity: int.
+        :param error_rate: The false positive rate of the bloom filter.
+        :type error_rate: float.
+        :param exact: Only report ids found in the LRU as duplicates, and keep
+            no bloom filter.
+        :type exact: bool.
+        """
+        self.lru_size = lru_size
+        self.exact = exact
+        self.recent = OrderedDict()
+        self.filter = None
+        if not exact:
+            self.filter = BloomFilter(capacity, error_rate)
+        self.stats = {'seen': 0, 'duplicates': 0, 'probable': 0}
+
+    def seen(self, item):
+        """Record `item`.
+        :returns: bool. Whether `item` is a duplicate.
+        """
+        self.stats['seen'] += 1
+        if item in self.recent:
+            self.stats['duplicates'] += 1
+            return True
+        self.recent[item] = True
+        if len(self.recent) > self.lru_size:
+            self.recent.popitem(last=False)
+        if self.filter is None:
+            return False
+        if self.filter.full():
+            self.filter.clear()
+        if self.filter.add(item):
+            self.stats['probable'] += 1
+            self.stats['duplicates'] += 1
+            return True
+        return False
+
+class RotatingBloomFilter:
+    """Duplicate filter over a sliding time horizon, in bounded memory.
+
+    Ids go to the newest of up to `generations` bloom filters, and are looked
+    up in all of them. A new filter is started every `period_ms`, or as soon
+    as the newest one holds `capacity` ids, dropping the oldest one: ids are
+    remembered for at least `period_ms * (generations - 1)` ms unless more
+    than `capacity` ids arrive per period. Memory is bounded by `generations`
+    filters of `capacity` ids at `error_rate`.
+
+    It can be passed as `Metadata(dedupe=...)`, or used by a computation on
+    any value, e.g. `dedupe.seen(record.key)` or `dedupe.seen(record.data)`.
+    `checkpoint` and `restore` persist it through the state API.
+    """
+    tag = 'RBF1'
+    _header = struct.Struct('<4sqIdI')
+    _generation = struct.Struct('<qI')
+
+    def __init__(self, period_ms, generations=kDefaultDedupeGenerations,
+                 capacity=kDefaultDedupeCapacity // kDefaultDedupeGenerations,
+                 error_rate=kDefaultDedupeErrorRate):
+        """
+        :param period_ms: How long a filter receives new ids, in ms.
+        :type period_ms: int.
+        :param generations: The number of filters kept.
+        :type generations: int.
+        :param capacity: The number of ids each filter holds.
+        :type capacity: int.
+        :param error_rate: The false positive rate of each filter.
+        :type error_rate: float.
+        """
+        self.period_ms = period_ms
+        self.generations = generations
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.filters = []
+        self.stats = {'seen': 0, 'duplicates': 0, 'rotations': 0}
+
+    def rotate(self, time):
+        if self.filters:
+            start, newest = self.filters[-1]
+            if time < start + self.period_ms and not newest.full():
+                return
+            self.stats['rotations'] += 1
+        self.filters.append((time, BloomFilter(self.capacity,
+                                               self.error_rate)))
+        if len(self.filters) > self.generations:
+            del self.filters[0]
+
+    def add(self, item, time=None):
+        """Add the 64 bit id `item`.
+        :param time: The current time in ms, defaults to the wall clock.
+        :type time: int.
+        :returns: bool. Whether `item` was possibly present already.
+        """
+        self.rotate(now_ms() if time is None else time)
+        present = any(item in bloom for _, bloom in self.filters[:-1])
+        return self.filters[-1][1].add(item) or present
+
+    def __contains__(self, item):
+        return any(item in bloom for _, bloom in self.filters)
+
+    def seen(self, value, time=None):
+        """Record `value`, a 64 bit id or a string.
+        :returns: bool. Whether `value` is a duplicate.
+        """
+        if isinstance(value, basestring):
+            value = identity(value)
+        self.stats['seen'] += 1
+        if self.add(value, time):
+            self.stats['duplicates'] += 1
+            return True
+        return False
+
+    def dumps(self):
+        parts = [self._header.pack(self.tag, self.period_ms, self.generations,
+                                   self.error_rate, self.capacity)]
+        for start, bloom in self.filters:
+            data = bloom.dumps()
+            parts.append(self._generation.pack(start, len(data)))
+            parts.append(data)
+        return ''.join(parts)
+
+    @classmethod
+    def loads(cls, data):
+        _, period_ms, generations, error_rate, capacity = \
+            cls._header.unpack_from(data)
+        rotating = cls(period_ms, generations, capacity, error_rate)
+        offset = cls._header.size
+        while offset < len(data):
+            start, size = cls._generation.unpack_from(data, offset)
+            offset += cls._generation.size
+            rotating.filters.append(
+                (start, BloomFilter.loads(data[offset:offset + size])))
+            offset += size
+        return rotating
+
+    def checkpoint(self, ctx, key=kDedupeStateKey):
+        """Save the filters with `ctx.set_state`."""
+        ctx.set_state(key, self.dumps())
+
+    def restore(self, ctx, key=kDedupeStateKey):
+        """Load the filters saved by `checkpoint`, if any.
+        :returns: bool. Whether a checkpoint was found.
+        """
+        data = ctx.get_state(key)
+        if not data:
+            return False
+        self.filters = self.loads(data).filters
+        return True
@@ -0,0 +1,141 @@
+"""Record envelopes for Concord
+.. module:: envelope
+    :synopsis: Pack many small logical records into a single wire `Record`
+"""
+
+import struct
+import logging
+from concord.internal.thrift.ttypes import Record
+
+ccord_logger = logging.getLogger('concord.computation')
+
+# Envelopes are tagged so that receivers can tell them apart from plain
+# payloads. Layout: MAGIC | count (u32) | (length (u32) | payload) * count
+ENVELOPE_MAGIC = '\xc0\xcdENV1'
+_header = struct.Struct('>I')
+
+# Upper bound on the packed payload size of a single envelope, in bytes.
+kDefaultEnvelopeMaxBytes = 64 * 1024
+
+class MalformedEnvelope(Exception):
+    """Raised by `unpack` for payloads tagged as envelopes which cannot be
+    decoded.
+    """
+    pass
+
+def is_envelope(data):
+    """Whether `data` is a packed envelope.
+    :param data: A record payload.
+    :type data: str.
+    :returns: bool.
+    """
+    return data is not None and data.startswith(ENVELOPE_MAGIC)
+
+def pack(payloads):
+    """Pack a list of payloads into one envelope.
+    :param payloads: The logical record payloads.
+    :type payloads: list(str).
+    :returns: str.
+    """
+    parts = [ENVELOPE_MAGIC, _header.pack(len(payloads))]
+    for payload in payloads:
+        parts.append(_header.pack(len(payload)))
+        parts.append(payload)
+    return ''.join(parts)
+
+def unpack(data):
+    """Split an envelope back into its payloads.
+    :param data: A payload previously built by `pack`.
+    :type data: str.
+    :returns: list(str).
+    :raises: MalformedEnvelope.
+    """
+    offset = len(ENVELOPE_MAGIC)
+    try:
+        (count,) = _header.unpack_from(data, offset)
+        offset += _header.size
+        payloads = []
+        for _ in xrange(count):
+            (length,) = _header.unpack_from(data, offset)
+            offset += _header.size
+            if offset + length > len(data):
+                raise MalformedEnvelope("Malformed envelope: truncated payload")
+            payloads.append(data[offset:offset + length])
+            offset += length
+    except struct.error as e:
+        raise MalformedEnvelope("Malformed envelope: %s" % e)
+    if offset != len(data):
+        raise MalformedEnvelope("Malformed envelope: %d trailing bytes"
+                                % (len(data) - offset))
+    return payloads
+
+def pack_records(records, max_bytes=kDefaultEnvelopeMaxBytes):
+    """Pack records bound for the same stream and key into envelopes.
+
+    Records keep their relative order within a (stream, key) pair. Groups
+    holding a single record are emitted untouched.
+
+    :param records: The records produced by a computation.
+    :type records: list(Record).
+    :param max_bytes: Maximum packed payload size per envelope.
+    :type max_bytes: int.
+    :returns: list(Record).
+    """
+    groups = {}
+    order = []
+    for record in records:
+        group_key = (record.userStream, record.key)
+        group = groups.get(group_key)
+        if group is None:
+            group = groups[group_key] = {'batches': [[]], 'size': 0}
+            order.append(group_key)
+        size = len(record.data) + _header.size
+        if group['size'] > 0 and group['size'] + size > max_bytes:
+            group['batches'].append([])
+            group['size'] = 0
+        group['batches'][-1].append(record.data)
+        group['size'] += size
+
+    packed = []
+    for stream, key in order:
+        for batch in groups[(stream, key)]['batches']:
+            r = Record()
+            r.key = key
+            r.userStream = stream
+            if len(batch) == 1 and not is_envelope(batch[0]):
+                r.data = batch[0]
+            else:
+                r.data = pack(batch)
+            packed.append(r)
+    return packed
+
+def unpack_records(records):
+    """Expand envelopes into the logical records they carry.
+
+    Records that are not envelopes, or whose envelope cannot be decoded, are
+    passed through unchanged; unpacked records share the metadata of their
+    envelope.
+
+    :param records: Records received from the proxy.
+    :type records: list(Record).
+    :returns: list(Record).
+    """
+    return [logical for record in records for logical in unpack_record(record)]
+
+def unpack_record(record):
+    """The logical records carried by one wire record, like
+    `unpack_records`.
+    :param record: A record received from the proxy.
+    :type record: Record.
+    :returns: list(Record).
+    """
+    if not is_envelope(record.data):
+        return [record]
+    try:
+        payloads = unpack(record.data)
+    except MalformedEnvelope as e:
+        ccord_logger.warning("Passing record through unchanged: %s", e)
+        return [record]
+    return [Record(meta=record.meta, time=record.time, key=record.key,
+                   data=payload, userStream=record.userStream)
+            for payload in payloads]
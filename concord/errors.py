@@ -0,0 +1,85 @@
+"""Error policies for Concord
+.. module:: errors
+    :synopsis: What to do when a computation handler raises
+"""
+
+import struct
+
+_length = struct.Struct('>I')
+_dead_letter_fields = ('handler', 'stream', 'key', 'data', 'error')
+
+class ErrorAction:
+    """What to do with a record or timer once its handler failed and all
+    retries are exhausted.
+    """
+    FAIL = 0
+    SKIP = 1
+    DEAD_LETTER = 2
+
+class ErrorPolicy:
+    """How `process_record`, `process_timer` and `process_watermark`
+    failures are handled.
+
+    A failing call is retried up to `retries` times on a fresh transaction,
+    discarding the records and timers of the failed attempt; values merged
+    through `combine` only take effect once a call succeeds. State written
+    through `set_state` is not rolled back. Once retries are exhausted,
+    `action` decides whether the process exits (the default), the input is
+    skipped, or it is routed with its traceback to `dead_letter_stream`.
+    Pipelined state writes the proxy keeps rejecting are handled the same
+    way.
+    """
+
+    def __init__(self, action=ErrorAction.FAIL, retries=0,
+                 dead_letter_stream=None):
+        """
+        :param action: What to do once retries are exhausted.
+        :type action: ErrorAction.
+        :param retries: Number of times a failing call is retried.
+        :type retries: int.
+        :param dead_letter_stream: The stream failing inputs are routed to
+            with `ErrorAction.DEAD_LETTER`. It must be one of the ostreams.
+        :type dead_letter_stream: str.
+        """
+        if action == ErrorAction.DEAD_LETTER and not dead_letter_stream:
+            raise Exception("Dead letter policy needs a dead_letter_stream")
+        self.action = action
+        self.retries = retries
+        self.dead_letter_stream = dead_letter_stream
+
+def dead_letter_payload(handler, stream, key, data, error):
+    """Serialize a failing input for the dead letter stream.
+    :param handler: The failing handler, e.g. 'process_record'.
+    :type handler: str.
+    :param stream: The stream of the failing record, if any.
+    :type stream: str.
+    :param key: The key of the failing record or timer.
+    :type key: str.
+    :param data: The payload of the failing record, or the timer time.
+    :type data: str.
+    :param error: The formatted traceback.
+    :type error: str.
+    :returns: str.
+    """
+    parts = []
+    for field in (handler, stream, key, data, error):
+        field = field or ''
+        if isinstance(field, unicode):
+            field = field.encode('utf-8')
+        parts.append(_length.pack(len(field)))
+        parts.append(field)
+    return ''.join(parts)
+
+def parse_dead_letter(data):
+    """Deserialize a record produced on a dead letter stream.
+    :returns: dict. With the `handler`, `stream`, `key`, `data` and `error`
+        passed to `dead_letter_payload`.
+    """
+    fields = {}
+    offset = 0
+    for name in _dead_letter_fields:
+        (length,) = _length.unpack_from(data, offset)
+        offset += _length.size
+        fields[name] = data[offset:offset + length]
+        offset += length
+    return fields
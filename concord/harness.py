@@ -0,0 +1,297 @@
+"""Test harness for Concord
+.. module:: harness
+    :synopsis: Local proxy server and computation driver over real sockets
+"""
+
+import os
+import sys
+import time
+import random
+import socket
+import threading
+import subprocess
+from thrift.Thrift import TMessageType
+from thrift.transport import TSocket, TTransport
+from thrift.server import TServer
+from thrift.protocol import TBinaryProtocol
+from concord.internal.thrift import BoltProxyService, ComputationService
+from concord.internal.thrift.ttypes import BoltError
+from concord.internal.thrift.constants import (
+    kConcordEnvKeyClientListenAddr,
+    kConcordEnvKeyClientProxyAddr
+)
+
+# How long to wait for a computation to start listening, in ms.
+kDefaultStartTimeoutMs = 10000
+
+class InjectedFault(Exception):
+    """Raised by `Faults` to drop the connection of a call."""
+    pass
+
+class Faults:
+    """Latency and failures injected into the calls of a `LocalProxy`.
+
+    Every call is delayed by `latency_ms` plus up to `jitter_ms`, then fails
+    with probability `failure_rate`: by raising a `BoltError` to the caller,
+    or with `disconnect`, by dropping its connection.
+    """
+
+    def __init__(self, latency_ms=0, jitter_ms=0, failure_rate=0.0,
+                 disconnect=False, methods=None, seed=None):
+        """
+        :param methods: The calls faults apply to, all of them by default.
+        :type methods: list(str).
+        """
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.failure_rate = failure_rate
+        self.disconnect = disconnect
+        self.methods = set(methods) if methods else None
+        self.random = random.Random(seed)
+        self.injected = 0
+
+    def apply(self, method):
+        if self.methods is not None and method not in self.methods:
+            return
+        delay = self.latency_ms + self.random.uniform(0, self.jitter_ms)
+        if delay > 0:
+            time.sleep(delay / 1000.0)
+        if self.failure_rate and self.random.random() < self.failure_rate:
+            self.injected += 1
+            if self.disconnect:
+                raise InjectedFault("Injected failure of %s" % method)
+            raise BoltError(reason="Injected failure of %s" % method,
+                            time=int(time.time() * 1000))
+
+class LocalProxy(BoltProxyService.Iface):
+    """In-memory stand-in for the proxy of a computation: keeps its state,
+    its registrations and the latest topology it was sent.
+    """
+
+    def __init__(self, faults=None):
+        self.faults = faults or Faults()
+        self.lock = threading.Lock()
+        self.state = {}
+        self.registrations = []
+        self.registered = threading.Event()
+        self.topology = None
+        self.scheduler = None
+        self.stats = {}
+
+    def call(self, method):
+        with self.lock:
+            self.stats[method] = self.stats.get(method, 0) + 1
+        self.faults.apply(method)
+
+    def setState(self, key, value):
+        self.call('setState')
+        with self.lock:
+            self.state[key] = value
+
+    def getState(self, key):
+        self.call('getState')
+        with self.lock:
+            return self.state.get(key, '')
+
+    def registerWithScheduler(self, meta):
+        self.call('registerWithScheduler')
+        with self.lock:
+            self.registrations.append(meta)
+        self.registered.set()
+
+    def updateTopology(self, topology):
+        self.call('updateTopology')
+        self.topology = topology
+
+    def updateSchedulerAddress(self, e):
+        self.call('updateSchedulerAddress')
+        self.scheduler = e
+
+def free_port(host='127.0.0.1'):
+    """A port nobody listens on right now."""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    try:
+        sock.bind((host, 0))
+        return sock.getsockname()[1]
+    finally:
+        sock.close()
+
+class LocalProxyServer:
+    """Serves a `LocalProxy` over framed binary thrift, one thread per
+    connection, like the proxy a computation registers with.
+    """
+
+    def __init__(self, proxy=None, host='127.0.0.1', port=None):
+        """
+        :param proxy: The handler to serve, a new `LocalProxy` by default.
+        :type proxy: LocalProxy.
+        :param port: The port to listen on, a free one by default.
+        :type port: int.
+        """
+        self.proxy = proxy or LocalProxy()
+        self.host = host
+        self.port = port or free_port(host)
+        self.transport = TSocket.TServerSocket(host=host, port=self.port)
+        self.server = TServer.TThreadedServer(
+            BoltProxyService.Processor(self.proxy), self.transport,
+            TTransport.TFramedTransportFactory(),
+            TBinaryProtocol.TBinaryProtocolAcceleratedFactory(), daemon=True)
+        self.thread = None
+        self.running = False
+
+    def start(self):
+        """Start serving in a background thread.
+        :returns: (str, int). The address of the server.
+        """
+        self.transport.listen()
+        self.running = True
+        self.thread = threading.Thread(target=self.serve)
+        self.thread.daemon = True
+        self.thread.start()
+        return (self.host, self.port)
+
+    def serve(self):
+        while self.running:
+            try:
+                client = self.transport.accept()
+            except (socket.error, AttributeError):
+                break
+            thread = threading.Thread(target=self.server.handle,
+                                      args=(client,))
+            thread.daemon = True
+            thread.start()
+
+    def stop(self):
+        self.running = False
+        self.transport.close()
+
+def computation_env(listen_port, proxy_address, env=None):
+    """The environment `serve_computation` reads its addresses from."""
+    env = dict(os.environ if env is None else env)
+    env[kConcordEnvKeyClientListenAddr] = '127.0.0.1:%d' % listen_port
+    env[kConcordEnvKeyClientProxyAddr] = '%s:%d' % proxy_address
+    return env
+
+def spawn_computation(script, proxy_address, listen_port=None, args=()):
+    """Run a script calling `serve_computation` in a subprocess.
+    :returns: (subprocess.Popen, int). The process and its listen port.
+    """
+    listen_port = listen_port or free_port()
+    process = subprocess.Popen(
+        [sys.executable, script] + list(args),
+        env=computation_env(listen_port, proxy_address))
+    return process, listen_port
+
+def serve_thread(handler, proxy_address, listen_port=None):
+    """Run `serve_computation(handler)` in a background thread of this
+    process, e.g. to profile it.
+    :returns: (threading.Thread, int). The thread and its listen port.
+    """
+    from concord.computation import serve_computation
+    listen_port = listen_port or free_port()
+    os.environ.update(computation_env(listen_port, proxy_address, env={}))
+    thread = threading.Thread(target=serve_computation, args=(handler,))
+    thread.daemon = True
+    thread.start()
+    return thread, listen_port
+
+class ComputationClient(ComputationService.Client):
+    """`ComputationService` client which can also call `boltProcessTimers`,
+    see `ComputationProcessor`.
+    """
+
+    def boltProcessTimers(self, timers):
+        self.send_boltProcessTimers(timers)
+        return self.recv_boltProcessRecords()
+
+    def send_boltProcessTimers(self, timers):
+        from concord.computation import boltProcessTimers_args
+        self._oprot.writeMessageBegin('boltProcessTimers', TMessageType.CALL,
+                                      self._seqid)
+        boltProcessTimers_args(timers=timers).write(self._oprot)
+        self._oprot.writeMessageEnd()
+        self._oprot.trans.flush()
+
+class ComputationDriver:
+    """Plays the proxy's side of `ComputationService` against a computation
+    listening on a socket, timing every call.
+    """
+
+    def __init__(self, host, port, start_timeout_ms=kDefaultStartTimeoutMs):
+        """
+        :param start_timeout_ms: How long to retry connecting while the
+            computation starts.
+        :type start_timeout_ms: int.
+        """
+        self.host = host
+        self.port = port
+        self.start_timeout_ms = start_timeout_ms
+        self.transport = None
+        self.client = None
+        self.stats = {}
+
+    def connect(self):
+        deadline = time.time() + self.start_timeout_ms / 1000.0
+        while True:
+            transport = TTransport.TFramedTransport(
+                TSocket.TSocket(self.host, self.port))
+            try:
+                transport.open()
+                break
+            except TTransport.TTransportException:
+                if time.time() > deadline:
+                    raise
+                time.sleep(0.05)
+        self.transport = transport
+        self.client = ComputationClient(
+            TBinaryProtocol.TBinaryProtocolAccelerated(transport))
+
+    def close(self):
+        if self.transport is not None:
+            self.transport.close()
+        self.transport = None
+        self.client = None
+
+    def call(self, method, *args):
+        if self.client is None:
+            self.connect()
+        start = time.time()
+        try:
+            return getattr(self.client, method)(*args)
+        finally:
+            elapsed = (time.time() - start) * 1000
+            stats = self.stats.setdefault(
+                method, {'calls': 0, 'total_ms': 0.0, 'max_ms': 0.0})
+            stats['calls'] += 1
+            stats['total_ms'] += elapsed
+            stats['max_ms'] = max(stats['max_ms'], elapsed)
+
+    def init(self):
+        return self.call('init')
+
+    def metadata(self):
+        return self.call('boltMetadata')
+
+    def process_records(self, records):
+        return self.call('boltProcessRecords', records)
+
+    def process_timer(self, key, time):
+        return self.call('boltProcessTimer', key, time)
+
+    def process_timers(self, timers):
+        """Fire a batch of timers in one `boltProcessTimers` call.
+        :param timers: The (key, time) pairs of the timers, in the order
+            their transactions are returned in.
+        :type timers: list((str, int)).
+        """
+        return self.call('boltProcessTimers', timers)
+
+    def update_topology(self, topology):
+        """Push a `TopologyMetadata`, see `ComputationProcessor`."""
+        if self.client is None:
+            self.connect()
+        client = BoltProxyService.Client(self.client._iprot)
+        return client.updateTopology(topology)
+
+    def destroy(self):
+        return self.call('destroy')
@@ -0,0 +1,163 @@
+"""Hot key detection for Concord
+.. module:: hotkeys
+    :synopsis: Track frequent output keys and salt them across sub-keys
+"""
+
+import heapq
+import logging
+
+ccord_logger = logging.getLogger('concord.computation')
+
+# Number of keys tracked per stream.
+kDefaultHotKeysCapacity = 128
+# Share of the records of a stream above which a key is hot.
+kDefaultHotKeyThreshold = 0.05
+# Number of records produced on a stream before keys may be reported hot.
+kDefaultHotKeysMinRecords = 1000
+# Separates a key from its salt.
+kSaltSeparator = '\x00#'
+
+class SpaceSaving:
+    """The most frequent keys of a stream, counting at most `capacity` keys.
+
+    A new key replaces the least counted one and inherits its count, so that
+    counts are over-estimated by at most `error(key)`, and every key occurring
+    more than `total / capacity` times is tracked.
+    """
+
+    def __init__(self, capacity=kDefaultHotKeysCapacity):
+        self.capacity = capacity
+        self.counts = {}
+        self.errors = {}
+        self.heap = []
+        self.total = 0
+
+    def add(self, key, count=1):
+        """Count `key`.
+        :returns: int. The estimated count of `key`.
+        """
+        self.total += count
+        if key in self.counts:
+            self.counts[key] += count
+        elif len(self.counts) < self.capacity:
+            self.counts[key] = count
+            self.errors[key] = 0
+        else:
+            evicted, floor = self.pop_min()
+            del self.counts[evicted]
+            del self.errors[evicted]
+            self.counts[key] = floor + count
+            self.errors[key] = floor
+        estimate = self.counts[key]
+        heapq.heappush(self.heap, (estimate, key))
+        if len(self.heap) > 4 * self.capacity:
+            self.heap = [(c, k) for k, c in self.counts.iteritems()]
+            heapq.heapify(self.heap)
+        return estimate
+
+    def pop_min(self):
+        # Heap entries are stale once their key was counted again.
+        while True:
+            count, key = heapq.heappop(self.heap)
+            if self.counts.get(key) == count:
+                return key, count
+
+    def estimate(self, key):
+        return self.counts.get(key, 0)
+
+    def error(self, key):
+        return self.errors.get(key, 0)
+
+    def top(self, n):
+        """The `n` most frequent keys.
+        :returns: list((str, int)). (key, estimated count) pairs.
+        """
+        return heapq.nlargest(n, self.counts.iteritems(),
+                              key=lambda entry: entry[1])
+
+class HotKeys:
+    """Tracks the keys produced on each ostream and spreads hot ones.
+
+    A key is hot once it accounts for more than `threshold` of the records
+    produced on its stream. With `salts` > 1, the records of a hot key on one
+    of `salt_streams` (every stream by default) are routed round-robin over
+    `salts` sub-keys, so that a `GROUP_BY` grouping spreads them over several
+    instances. The downstream computation reduces the salted keys with
+    `merge_salted`, or recovers the original key with `unsalt`.
+    """
+
+    def __init__(self, threshold=kDefaultHotKeyThreshold, salts=1,
+                 salt_streams=None, capacity=kDefaultHotKeysCapacity,
+                 min_records=kDefaultHotKeysMinRecords):
+        """
+        :param threshold: The share of the records of a stream above which
+            a key is hot.
+        :type threshold: float.
+        :param salts: The number of sub-keys hot keys are spread over.
+        :type salts: int.
+        :param salt_streams: The streams whose hot keys are salted.
+        :type salt_streams: list(str).
+        :param capacity: The number of keys tracked per stream.
+        :type capacity: int.
+        :param min_records: The number of records produced on a stream before
+            keys may be hot.
+        :type min_records: int.
+        """
+        self.threshold = threshold
+        self.salts = salts
+        self.salt_streams = set(salt_streams) if salt_streams else None
+        self.capacity = capacity
+        self.min_records = min_records
+        self.sketches = {}
+        self.hot = set()
+        self.salted = 0
+
+    def is_hot(self, stream, key):
+        sketch = self.sketches.get(stream)
+        if sketch is None or sketch.total < self.min_records:
+            return False
+        return sketch.estimate(key) > self.threshold * sketch.total
+
+    def route(self, stream, key):
+        """Count a record produced on `stream`.
+        :returns: str. The key to produce the record with.
+        """
+        sketch = self.sketches.get(stream)
+        if sketch is None:
+            sketch = self.sketches[stream] = SpaceSaving(self.capacity)
+        count = sketch.add(key)
+        if (sketch.total < self.min_records
+                or count <= self.threshold * sketch.total):
+            return key
+        if (stream, key) not in self.hot:
+            self.hot.add((stream, key))
+            ccord_logger.warning("Hot key %r on stream %s: ~%d of %d records",
+                                 key, stream, count, sketch.total)
+        if self.salts <= 1 or (self.salt_streams is not None
+                               and stream not in self.salt_streams):
+            return key
+        self.salted += 1
+        return salt(key, self.salted % self.salts)
+
+    def top(self, stream, n=10):
+        """The `n` most frequent keys produced on `stream`."""
+        sketch = self.sketches.get(stream)
+        return sketch.top(n) if sketch is not None else []
+
+def salt(key, index):
+    """The `index`th sub-key of `key`."""
+    return '%s%s%d' % (key, kSaltSeparator, index)
+
+def unsalt(key):
+    """The key a possibly salted key was derived from."""
+    if key is None or kSaltSeparator not in key:
+        return key
+    return key.rsplit(kSaltSeparator, 1)[0]
+
+def merge_salted(ctx, stream, key, value, fn):
+    """Merge a partial result computed for a salted key into the result of
+    the original key, emitted on `stream` (see `ComputationContext.combine`).
+    The downstream computation of `stream` merges the partial results of the
+    instances which received the salted keys.
+    """
+    ctx.combine(stream, unsalt(key), value, fn)
@@ -0,0 +1,218 @@
+"""Windowed stream joins for Concord
+.. module:: join
+    :synopsis: Join the records of two istreams sharing a key
+"""
+
+import bisect
+import heapq
+from collections import deque
+from concord.watermarks import event_time
+from concord.timers import now_ms
+
+# Prefix of the timers used to evict buffered records.
+kJoinTimerPrefix = '__concord_join:'
+# Number of buffered records, across both sides, before the oldest ones are
+# evicted early.
+kDefaultJoinMaxBuffered = 100000
+# Eviction timers are rounded up to this interval, in ms.
+kDefaultJoinEvictionInterval = 1000
+
+class JoinBuffer:
+    """Records of one side of a join, indexed by key and ordered by event
+    time within a key.
+    """
+
+    def __init__(self):
+        self.times = {}
+        self.records = {}
+        self.size = 0
+
+    def add(self, key, time, record):
+        times = self.times.setdefault(key, [])
+        records = self.records.setdefault(key, [])
+        index = bisect.bisect_right(times, time)
+        times.insert(index, time)
+        records.insert(index, record)
+        self.size += 1
+
+    def between(self, key, start, end):
+        """The records of `key` with an event time within [start, end]."""
+        times = self.times.get(key)
+        if not times:
+            return []
+        lo = bisect.bisect_left(times, start)
+        hi = bisect.bisect_right(times, end)
+        return self.records[key][lo:hi]
+
+    def pop_oldest(self, key):
+        times = self.times[key]
+        del times[0]
+        del self.records[key][0]
+        self.size -= 1
+        if not times:
+            del self.times[key]
+            del self.records[key]
+
+class WindowedJoin:
+    """Joins the records of two streams which share a key and whose event
+    times are at most `window` ms apart.
+
+    Both sides are buffered until no record on the other side can match them
+    anymore: once the watermark passes their event time plus `window`. As a
+    backstop for inputs without a watermark, eviction timers set on
+    processing time keep at most the records which arrived within the last
+    `window` ms, evicting the oldest ones, while no watermark is known. When
+    more than `max_buffered` records are held, the oldest ones are evicted
+    early and counted in `evicted_early`.
+    """
+
+    def __init__(self, left, right, window, process_join,
+                 max_buffered=kDefaultJoinMaxBuffered,
+                 eviction_interval=kDefaultJoinEvictionInterval):
+        """
+        :param left: The name of the left istream.
+        :type left: str.
+        :param right: The name of the right istream.
+        :type right: str.
+        :param window: The maximum event time distance of joined records,
+            in ms.
+        :type window: int.
+        :param process_join: Called as `process_join(ctx, key, left_record,
+            right_record)` for every joined pair.
+        :type process_join: function.
+        """
+        self.left = left
+        self.right = right
+        self.window = window
+        self.process_join = process_join
+        self.max_buffered = max_buffered
+        self.eviction_interval = eviction_interval
+        self.buffers = {left: JoinBuffer(), right: JoinBuffer()}
+        self.expiry = []
+        self.arrivals = deque()
+        self.joined = 0
+        self.evicted = 0
+        self.evicted_early = 0
+        self.late_records = 0
+        self.evicted_until = None
+
+    def process_record(self, ctx, record):
+        """Buffer `record` and join it with the matching records of the other
+        side. Records of other streams are ignored.
+        """
+        side = record.userStream
+        if side == self.left:
+            other = self.right
+        elif side == self.right:
+            other = self.left
+        else:
+            return
+        key = record.key
+        time = event_time(record)
+        if self.evicted_until is not None and time + self.window < self.evicted_until:
+            self.late_records += 1
+            return
+
+        for match in self.buffers[other].between(key, time - self.window,
+                                                 time + self.window):
+            self.joined += 1
+            if side == self.left:
+                self.process_join(ctx, key, record, match)
+            else:
+                self.process_join(ctx, key, match, record)
+
+        self.buffers[side].add(key, time, record)
+        heapq.heappush(self.expiry, (time, side, key))
+        now = now_ms()
+        self.arrivals.append(now)
+        expire = now + self.window
+        expire += self.eviction_interval - expire % self.eviction_interval
+        ctx.set_timer(kJoinTimerPrefix + str(expire), expire)
+
+        while self.buffered() > self.max_buffered:
+            self.evicted_early += 1
+            self.evict_next()
+
+    def evict_next(self):
+        time, side, key = heapq.heappop(self.expiry)
+        self.buffers[side].pop_oldest(key)
+        self.evicted += 1
+        if self.evicted_until is None or time + self.window > self.evicted_until:
+            self.evicted_until = time + self.window
+
+    def evict(self, time):
+        """Drop the buffered records which cannot match any record with an
+        event time of at least `time` anymore.
+        """
+        while self.expiry and self.expiry[0][0] + self.window < time:
+            self.evict_next()
+
+    def expire(self, ctx, time):
+        """Handle an eviction timer due at the processing time `time`: unless
+        a watermark is known, evict the oldest records until no more are held
+        than arrived within the last `window` ms.
+        """
+        while self.arrivals and self.arrivals[0] + self.window <= time:
+            self.arrivals.popleft()
+        if ctx.watermark() is not None:
+            return
+        while self.expiry and self.buffered() > len(self.arrivals):
+            self.evict_next()
+
+    def owns_timer(self, key):
+        return key.startswith(kJoinTimerPrefix)
+
+    def buffered(self):
+        return self.buffers[self.left].size + self.buffers[self.right].size
+
+    def stats(self):
+        return {'left_buffered': self.buffers[self.left].size,
+                'right_buffered': self.buffers[self.right].size,
+                'joined': self.joined,
+                'evicted': self.evicted,
+                'evicted_early': self.evicted_early,
+                'late_records': self.late_records}
+
+class WindowedJoinComputation:
+    """Mixin turning a `Computation` subscribed to two streams into a
+    windowed join, e.g. `class Enrich(WindowedJoinComputation, Computation)`.
+
+    Subclasses set `left_stream`, `right_stream` and `join_window` and
+    implement `process_join`. Timers which do not evict join buffers are
+    handed to `process_user_timer`.
+    """
+    left_stream = None
+    right_stream = None
+    join_window = None
+    max_buffered = kDefaultJoinMaxBuffered
+
+    def stream_join(self):
+        if getattr(self, '_stream_join', None) is None:
+            self._stream_join = WindowedJoin(
+                self.left_stream, self.right_stream, self.join_window,
+                self.process_join, max_buffered=self.max_buffered)
+        return self._stream_join
+
+    def process_record(self, ctx, record):
+        self.stream_join().process_record(ctx, record)
+
+    def process_timer(self, ctx, key, time):
+        if self.stream_join().owns_timer(key):
+            self.stream_join().expire(ctx, time)
+        else:
+            self.process_user_timer(ctx, key, time)
+
+    def process_watermark(self, ctx, watermark):
+        self.stream_join().evict(watermark)
+
+    def process_join(self, ctx, key, left, right):
+        """Handle a pair of records joined on `key`.
+        :param left: The record of the left stream.
+        :type left: Record.
+        :param right: The record of the right stream.
+        :type right: Record.
+        """
+        raise Exception('process_join not implemented')
+
+    def process_user_timer(self, ctx, key, time):
+        raise Exception('process_timer not implemented')
@@ -0,0 +1,265 @@
+"""Local topologies for Concord
+.. module:: local
+    :synopsis: Run several computations in process, without a cluster
+"""
+
+import copy
+import heapq
+import random
+import time
+from collections import deque
+from concord.internal.thrift.ttypes import (
+    Record,
+    StreamGrouping,
+    StreamMetadata,
+    TopologyMetadata,
+    PhysicalComputationLayout,
+    PhysicalComputationMetadata
+)
+from concord.computation import ComputationServiceWrapper
+from concord.dedupe import identity
+from concord.timers import now_ms
+from concord import partition, spill
+
+# Number of records handed to an instance per `boltProcessRecords` call.
+kDefaultLocalBatchSize = 1024
+
+class LocalState:
+    """In-memory `MutableEphemeralStateService` of one instance, standing in
+    for its proxy connection, pool and pipelined writer alike.
+    """
+
+    def __init__(self):
+        self.values = {}
+        self.stats = {'sets': 0, 'gets': 0}
+
+    def setState(self, key, value):
+        self.stats['sets'] += 1
+        self.values[key] = value
+
+    def getState(self, key):
+        self.stats['gets'] += 1
+        return self.values.get(key, '')
+
+    def checkout(self):
+        return self
+
+    def checkin(self, client):
+        pass
+
+    def send(self, method, *args):
+        getattr(self, method)(*args)
+
+    def recv(self, method):
+        pass
+
+    def close(self):
+        pass
+
+class LocalInstance:
+    """One simulated instance of a computation."""
+
+    def __init__(self, name, index, handler):
+        self.name = name
+        self.index = index
+        self.wrapper = ComputationServiceWrapper(handler)
+        self.state = LocalState()
+        self.wrapper.proxy_client = self.state
+        self.queue = deque()
+        self.stats = {'records': 0, 'produced': 0, 'timers': 0, 'batches': 0,
+                      'seconds': 0.0}
+
+class LocalTopology:
+    """Runs computations in process, wired together by their `istreams` and
+    `ostreams`, e.g.::
+
+        topology = LocalTopology([Split(), Count()], instances={'count': 4})
+        topology.push('sentences', None, 'a b c')
+        topology.run()
+
+    Each computation runs as `instances` deep copies of its handler. Records
+    produced on a stream are queued to every computation subscribed to it,
+    choosing the instance according to the `StreamGrouping` of the
+    subscription: `GROUP_BY` and `CUSTOM` by key, `SHUFFLE` at random,
+    `ROUND_ROBIN` in turn and `LOCAL` on the instance with the producer's
+    index. Records on streams without subscribers are collected in `sinks`.
+    Timers fire on the wall clock and state is kept per instance, in memory.
+    """
+
+    def __init__(self, computations, instances=1,
+                 batch_size=kDefaultLocalBatchSize, seed=None):
+        """
+        :param computations: The computations to run.
+        :type computations: list(Computation).
+        :param instances: The number of instances of every computation, or of
+            each one by name.
+        :type instances: int, dict(str, int).
+        :param batch_size: The number of records processed per call.
+        :type batch_size: int.
+        :param seed: Seed of the `SHUFFLE` grouping.
+        :type seed: int.
+        """
+        self.batch_size = batch_size
+        self.random = random.Random(seed)
+        self.instances = {}
+        self.subscribers = {}
+        self.sinks = {}
+        self.timers = []
+        self.pending_timers = {}
+        self.round_robin = {}
+        for handler in computations:
+            md = handler.metadata()
+            count = instances if isinstance(instances, int) \
+                else instances.get(md.name, 1)
+            self.instances[md.name] = [
+                LocalInstance(md.name, i, copy.deepcopy(handler))
+                for i in xrange(count)]
+            for stream in md.istreams:
+                if isinstance(stream, basestring):
+                    stream, grouping = stream, StreamGrouping.SHUFFLE
+                else:
+                    stream, grouping = stream
+                self.subscribers.setdefault(stream, []).append(
+                    (md.name, grouping))
+        topology = self.topology_metadata()
+        for instance in self.all_instances():
+            instance.wrapper.updateTopology(topology)
+        for instance in self.all_instances():
+            self.apply(instance, [instance.wrapper.init()])
+
+    def all_instances(self):
+        for name in sorted(self.instances):
+            for instance in self.instances[name]:
+                yield instance
+
+    def topology_metadata(self):
+        computations = {}
+        for name, instances in self.instances.iteritems():
+            md = instances[0].wrapper.computation_metadata()
+            istreams = [StreamMetadata(name=stream, grouping=grouping)
+                        for stream, subscribers in self.subscribers.iteritems()
+                        for subscriber, grouping in subscribers
+                        if subscriber == name]
+            nodes = [PhysicalComputationMetadata(taskId='%s-%d' % (name, i),
+                                                 killed=False)
+                     for i in xrange(len(instances))]
+            computations[name] = PhysicalComputationLayout(
+                name=name, istreams=istreams, ostreams=md.ostreams,
+                nodes=nodes)
+        return TopologyMetadata(version=1, computations=computations,
+                                frameworkID='local')
+
+    def push(self, stream, key, data, time=None):
+        """Produce a record on `stream` from outside the topology."""
+        record = Record(key=key, data=data, userStream=stream,
+                        time=now_ms() if time is None else time)
+        self.route(record, 0)
+
+    def route(self, record, index):
+        subscribers = self.subscribers.get(record.userStream)
+        if not subscribers:
+            self.sinks.setdefault(record.userStream, []).append(record)
+            return
+        for i, (name, grouping) in enumerate(subscribers):
+            if i > 0:
+                record = copy.copy(record)
+            instances = self.instances[name]
+            count = len(instances)
+            if grouping == StreamGrouping.GROUP_BY:
+                target = identity(record.key) % count
+            elif grouping == StreamGrouping.CUSTOM:
+                stamped, key = partition.split(record.key)
+                if stamped is None:
+                    stamped = identity(key)
+                target = stamped % count
+            elif grouping == StreamGrouping.ROUND_ROBIN:
+                target = self.round_robin.get(name, 0) % count
+                self.round_robin[name] = target + 1
+            elif grouping == StreamGrouping.LOCAL:
+                target = index % count
+            else:
+                target = self.random.randrange(count)
+            instances[target].queue.append(record)
+
+    def apply(self, instance, transactions):
+        """Route the records and schedule the timers of the transactions
+        returned by an instance.
+        """
+        for transaction in transactions:
+            records = transaction.records or []
+            if spill.spilled(transaction):
+                records = transaction.spill.records() + records
+                spill.discard(transaction)
+            instance.wrapper.streams.resolve(records)
+            instance.stats['produced'] += len(records)
+            now = now_ms()
+            for record in records:
+                record.time = record.time or now
+                self.route(record, instance.index)
+            for key, deadline in (transaction.timers or {}).iteritems():
+                self.pending_timers[(instance.name, instance.index, key)] = \
+                    deadline
+                heapq.heappush(self.timers, (deadline, instance.name,
+                                             instance.index, key))
+
+    def fire_timers(self, now):
+        fired = 0
+        while self.timers and self.timers[0][0] <= now:
+            deadline, name, index, key = heapq.heappop(self.timers)
+            if self.pending_timers.get((name, index, key)) != deadline:
+                continue
+            del self.pending_timers[(name, index, key)]
+            instance = self.instances[name][index]
+            start = time.time()
+            transaction = instance.wrapper.boltProcessTimer(key, deadline)
+            instance.stats['seconds'] += time.time() - start
+            instance.stats['timers'] += 1
+            self.apply(instance, [transaction])
+            fired += 1
+        return fired
+
+    def step(self):
+        """Hand one batch to every instance with queued records, and fire the
+        timers that are due.
+        :returns: int. The number of records and timers processed.
+        """
+        processed = self.fire_timers(now_ms())
+        for instance in self.all_instances():
+            if not instance.queue:
+                continue
+            batch = [instance.queue.popleft() for _ in
+                     xrange(min(self.batch_size, len(instance.queue)))]
+            start = time.time()
+            transactions = instance.wrapper.boltProcessRecords(batch)
+            instance.stats['seconds'] += time.time() - start
+            instance.stats['records'] += len(batch)
+            instance.stats['batches'] += 1
+            self.apply(instance, transactions)
+            processed += len(batch)
+        return processed
+
+    def run(self, duration_ms=0):
+        """Process records until the queues are empty, then keep firing timers
+        for `duration_ms`.
+        """
+        end = now_ms() + duration_ms
+        while True:
+            if self.step():
+                continue
+            if not self.timers or self.timers[0][0] > end:
+                return
+            time.sleep(max(0, self.timers[0][0] - now_ms()) / 1000.0)
+
+    def destroy(self):
+        for instance in self.all_instances():
+            instance.wrapper.destroy()
+
+    def stats(self):
+        """Per computation totals of the instance statistics."""
+        totals = {}
+        for name, instances in self.instances.iteritems():
+            total = totals[name] = {'instances': len(instances)}
+            for instance in instances:
+                for stat, value in instance.stats.iteritems():
+                    total[stat] = total.get(stat, 0) + value
+        return totals
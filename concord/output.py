@@ -0,0 +1,149 @@
+"""Output buffering for Concord
+.. module:: output
+    :synopsis: Per-ostream limits on the records produced in a batch
+"""
+
+import time
+from collections import deque
+from concord.internal.thrift.ttypes import BackPressure
+
+class OutputLimit:
+    """Bounds the number of records a computation may hold in memory for a
+    stream while processing one batch.
+
+    Once `max_records` are buffered, `policy` decides what happens to new
+    records: `DROP_TAIL` drops them, `DROP_HEAD` drops the oldest buffered
+    record instead, `BLOCK_SENDER` blocks `produce_record` until the
+    buffered records are spilled to disk (see `concord.spill`), and
+    `ENQUEUE` / `NONE` keep buffering, only counting the overflow.
+    """
+
+    def __init__(self, max_records, policy=BackPressure.DROP_TAIL):
+        """
+        :param max_records: The number of records buffered per batch.
+        :type max_records: int.
+        :param policy: What to do with records over the limit.
+        :type policy: BackPressure.
+        """
+        self.max_records = max_records
+        self.policy = policy
+
+class OutputBuffer:
+    """Routes produced records to their transaction, enforcing the
+    `OutputLimit` of their stream.
+
+    The stats of every bounded stream count the records `produced` on it,
+    including the `dropped` ones, the records buffered past the limit
+    (`overflow`), and the number of times and ms `produce_record` was
+    `blocked`.
+    """
+
+    def __init__(self, limits=None, release=None):
+        """
+        :param limits: The limit of each bounded stream.
+        :type limits: dict(str, OutputLimit).
+        :param release: Called with the transactions holding the records
+            buffered on a full `BLOCK_SENDER` stream, to move them out of
+            memory. `produce_record` blocks until it returns.
+        :type release: function.
+        """
+        self.limits = limits or {}
+        self.release = release
+        self.buffered = {}
+        self.batch_drops = 0
+        self.stats = {}
+
+    def stream_stats(self, stream):
+        stats = self.stats.get(stream)
+        if stats is None:
+            stats = self.stats[stream] = {'produced': 0, 'dropped': 0,
+                                          'blocked': 0, 'blocked_ms': 0.0,
+                                          'overflow': 0}
+        return stats
+
+    def append(self, transaction, record):
+        """Add `record` to `transaction`, unless its stream is over limit.
+        :returns: bool. Whether the record was added.
+        """
+        limit = self.limits.get(record.userStream)
+        if limit is None:
+            transaction.records.append(record)
+            return True
+        stats = self.stream_stats(record.userStream)
+        stats['produced'] += 1
+        queue = self.buffered.setdefault(record.userStream, deque())
+        if len(queue) >= limit.max_records:
+            if limit.policy == BackPressure.DROP_TAIL:
+                stats['dropped'] += 1
+                self.batch_drops += 1
+                return False
+            elif limit.policy == BackPressure.DROP_HEAD:
+                stats['dropped'] += 1
+                self.batch_drops += 1
+                remove(*queue.popleft())
+            elif limit.policy == BackPressure.BLOCK_SENDER:
+                stats['blocked'] += 1
+                start = time.time()
+                self.release(unique(entry for entry, _ in queue))
+                queue.clear()
+                stats['blocked_ms'] += (time.time() - start) * 1000
+            else:
+                stats['overflow'] += 1
+        queue.append((transaction, record))
+        transaction.records.append(record)
+        return True
+
+    def held(self, transaction):
+        """The records of `transaction` which a `DROP_HEAD` limit may still
+        drop.
+        :returns: set(int). The ids of the records.
+        """
+        buffered = set()
+        for stream, queue in self.buffered.iteritems():
+            if self.limits[stream].policy != BackPressure.DROP_HEAD:
+                continue
+            buffered.update(id(record) for entry, record in queue
+                            if entry is transaction)
+        return buffered
+
+    def merge(self, transaction, other):
+        """Account the records of `other` to `transaction`, which they are
+        moved to.
+        """
+        for stream, queue in self.buffered.iteritems():
+            self.buffered[stream] = deque(
+                (transaction if entry is other else entry, record)
+                for entry, record in queue)
+
+    def discard(self, transaction):
+        """Forget the records of a transaction which is not returned to the
+        framework, so that they no longer count against the limits.
+        """
+        for stream, queue in self.buffered.iteritems():
+            self.buffered[stream] = deque(
+                entry for entry in queue if entry[0] is not transaction)
+
+    def end_batch(self):
+        """Reset the buffers for the next batch.
+        :returns: int. The number of records dropped during the batch.
+        """
+        self.buffered.clear()
+        drops, self.batch_drops = self.batch_drops, 0
+        return drops
+
+def remove(transaction, record):
+    """Remove `record` from the records of `transaction`."""
+    for i, other in enumerate(transaction.records):
+        if other is record:
+            del transaction.records[i]
+            return
+
+def unique(transactions):
+    """`transactions` without duplicates, in order."""
+    seen = set()
+    ordered = []
+    for transaction in transactions:
+        if id(transaction) not in seen:
+            seen.add(id(transaction))
+            ordered.append(transaction)
+    return ordered
@@ -0,0 +1,105 @@
+"""Custom partitioning for Concord
+.. module:: partition
+    :synopsis: Stamp the destination partition on produced records
+"""
+
+import bisect
+import struct
+import hashlib
+
+# Number of points each node of a `HashRing` has per unit of weight.
+kDefaultRingReplicas = 64
+# Separates the partition stamped on a key from the key.
+kPartitionSeparator = '\x00@'
+
+def stamp(partition, key):
+    """Prefix `key` with its destination partition."""
+    return '%d%s%s' % (partition, kPartitionSeparator, key or '')
+
+def split(key):
+    """Split a key stamped by `stamp`.
+    :returns: (int, str). The partition, or None if `key` is not stamped, and
+        the original key.
+    """
+    if key is None:
+        return None, key
+    partition, separator, rest = key.partition(kPartitionSeparator)
+    if not separator or not partition.isdigit():
+        return None, key
+    return int(partition), rest
+
+def _point(value):
+    return struct.unpack('>Q', hashlib.md5(value).digest()[:8])[0]
+
+class HashRing:
+    """Consistent hashing of keys onto weighted nodes.
+
+    Adding or removing a node only moves the keys of that node, and a node
+    receives a share of the keys proportional to its weight, so that
+    `set_weight` shifts load away from busy or remote instances. A ring over
+    partition numbers can be attached to an ostream as its partitioner; with
+    `auto_size`, it is then resized with `resize` to the number of instances
+    consuming the stream whenever the topology is pushed, and hashes over its
+    initial nodes until then.
+    """
+
+    def __init__(self, nodes, replicas=kDefaultRingReplicas, auto_size=False):
+        """
+        :param nodes: The initial nodes, with a weight of 1.
+        :type nodes: list.
+        :param replicas: The number of points per unit of weight.
+        :type replicas: int.
+        :param auto_size: Resize the ring to the parallelism of the stream it
+            partitions, see `resize`.
+        :type auto_size: bool.
+        """
+        if not nodes:
+            raise Exception("Hash ring needs at least one node")
+        self.replicas = replicas
+        self.auto_size = auto_size
+        self.weights = {}
+        self.points = []
+        self.owners = []
+        for node in nodes:
+            self.weights[node] = 1
+        self.build()
+
+    def build(self):
+        ring = []
+        for node, weight in self.weights.iteritems():
+            for i in xrange(int(round(weight * self.replicas))):
+                ring.append((_point('%s#%d' % (node, i)), node))
+        ring.sort()
+        self.points = [point for point, _ in ring]
+        self.owners = [node for _, node in ring]
+
+    def add(self, node, weight=1):
+        self.set_weight(node, weight)
+
+    def remove(self, node):
+        self.weights.pop(node, None)
+        self.build()
+
+    def set_weight(self, node, weight):
+        """Change the share of keys `node` receives, relative to the other
+        nodes.
+        """
+        self.weights[node] = weight
+        self.build()
+
+    def resize(self, count):
+        """Make the nodes of the ring the partitions 0 to `count` - 1,
+        keeping their weights.
+        """
+        self.weights = dict((node, self.weights.get(node, 1))
+                            for node in xrange(count))
+        self.build()
+
+    def node(self, key):
+        if not self.points:
+            raise Exception("Hash ring has no nodes")
+        index = bisect.bisect(self.points, _point(key or ''))
+        return self.owners[index % len(self.owners)]
+
+    def __call__(self, key, data):
+        return self.node(key)
@@ -0,0 +1,163 @@
+"""Direct dispatch for Concord
+.. module:: pipe
+    :synopsis: Send records straight to co-located downstream computations
+"""
+
+import socket
+import logging
+from thrift.Thrift import TApplicationException
+from thrift.transport import TTransport
+from concord.internal.thrift import BoltPipeService
+from concord.internal.thrift.ttypes import StreamGrouping, BoltError
+from concord.proxy import ReconnectingProxyClient
+from concord.timers import now_ms
+
+ccord_logger = logging.getLogger('concord.computation')
+
+# Number of records sent per `dispatchRecords` call.
+kDefaultPipeBatchSize = 1024
+
+# Groupings for which any instance of the consumer may receive a record.
+_any_instance = frozenset([StreamGrouping.ROUND_ROBIN, StreamGrouping.SHUFFLE,
+                           StreamGrouping.LOCAL])
+
+def local_hosts():
+    """The addresses of this host."""
+    hosts = set(['127.0.0.1', 'localhost'])
+    try:
+        hostname = socket.gethostname()
+        hosts.add(hostname)
+        hosts.update(socket.gethostbyname_ex(hostname)[2])
+    except socket.error:
+        pass
+    return hosts
+
+def proxy_endpoint(node):
+    """The pipe endpoint of an instance: the proxy it runs behind."""
+    if node.taskHelper is None:
+        return None
+    return node.taskHelper.proxy
+
+class DirectDispatch:
+    """Sends the records produced on some ostreams straight to the
+    `BoltPipeService` of a downstream instance on the same host, instead of
+    returning them to the proxy.
+
+    A stream is dispatched directly only when, according to the topology, a
+    single computation consumes it and either it has a single running
+    instance, on this host, or it has one on this host and uses a grouping
+    under which any instance may receive the record. Other records, and
+    every record while the topology is unknown, go through the proxy.
+    Records are sent in batches of
+    `batch_size` over one reused connection per endpoint; records of a batch
+    which fails to send, including to an endpoint which does not serve
+    `dispatchRecords`, are returned to the proxy instead.
+
+    Directly dispatched records are delivered before the transaction that
+    produced them is acknowledged, so they may be delivered again if the
+    transaction is replayed. Spilled records always go through the proxy.
+    """
+
+    def __init__(self, streams, batch_size=kDefaultPipeBatchSize,
+                 hosts=None, endpoint=proxy_endpoint):
+        """
+        :param streams: The ostreams to dispatch directly.
+        :type streams: list(str).
+        :param batch_size: The number of records per `dispatchRecords` call.
+        :type batch_size: int.
+        :param hosts: The addresses considered local. Defaults to the
+            addresses of this host.
+        :type hosts: set(str).
+        :param endpoint: Returns the pipe `Endpoint` of a
+            `PhysicalComputationMetadata`.
+        :type endpoint: function.
+        """
+        self.streams = set(streams)
+        self.batch_size = batch_size
+        self.hosts = hosts if hosts is not None else local_hosts()
+        self.endpoint = endpoint
+        self.clients = {}
+        self.routes = {}
+        self.routes_version = None
+        self.stats = {'dispatched': 0, 'batches': 0, 'failures': 0,
+                      'fallbacks': 0}
+
+    def route(self, stream, topology):
+        """The local endpoint receiving the records of `stream`, or None if
+        they must go through the proxy.
+        :returns: (str, int).
+        """
+        if self.routes_version != topology.version:
+            self.routes = {}
+            self.routes_version = topology.version
+        if stream not in self.routes:
+            self.routes[stream] = self.local_route(stream, topology)
+        return self.routes[stream]
+
+    def local_route(self, stream, topology):
+        consumers = topology.consumers(stream)
+        if len(consumers) != 1:
+            return None
+        layout = topology.computation(consumers[0])
+        grouping = [s.grouping for s in layout.istreams if s.name == stream][0]
+        nodes = [node for node in layout.nodes if not node.killed]
+        local = [self.endpoint(node) for node in nodes]
+        local = [e for e in local if e is not None and e.ip in self.hosts]
+        if not local or (len(nodes) > 1 and grouping not in _any_instance):
+            return None
+        return (local[0].ip, local[0].port)
+
+    def dispatch(self, transactions, topology):
+        """Send the records of `transactions` produced on the directly
+        dispatched streams, removing them from their transaction. Records
+        sent without a time are stamped with the current time, as the proxy
+        would.
+        """
+        if not topology.known() or not transactions:
+            return
+        now = now_ms()
+        batches = {}
+        failed = []
+        for transaction in transactions:
+            kept = []
+            for record in transaction.records:
+                address = None
+                if record.userStream in self.streams:
+                    address = self.route(record.userStream, topology)
+                if address is None:
+                    kept.append(record)
+                    continue
+                if not record.time:
+                    record.time = now
+                batch = batches.setdefault(address, [])
+                batch.append(record)
+                if len(batch) >= self.batch_size:
+                    failed.extend(self.send(address, batch))
+                    batches[address] = []
+            transaction.records = kept
+        for address, batch in batches.iteritems():
+            if batch:
+                failed.extend(self.send(address, batch))
+        transactions[-1].records.extend(failed)
+
+    def send(self, address, records):
+        """Send a batch of records.
+        :returns: list(Record). The records which could not be sent.
+        """
+        client = self.clients.get(address)
+        if client is None:
+            client = self.clients[address] = ReconnectingProxyClient(
+                address[0], address[1], service=BoltPipeService)
+        try:
+            client.call('dispatchRecords', records)
+            self.stats['dispatched'] += len(records)
+            self.stats['batches'] += 1
+            return []
+        except (TTransport.TTransportException, socket.error, BoltError,
+                TApplicationException) as e:
+            ccord_logger.warning("Direct dispatch to %s:%d failed (%s), "
+                                 "sending %d records through the proxy",
+                                 address[0], address[1], e, len(records))
+            self.stats['failures'] += 1
+            self.stats['fallbacks'] += len(records)
+            return records
@@ -0,0 +1,103 @@
+"""Fused stateless pipelines for Concord
+.. module:: pipeline
+    :synopsis: Chain map/filter/flat_map/key_by stages inside one computation
+"""
+
+from concord.combiner import encode
+
+class Pipeline:
+    """A chain of stateless stages applied to every incoming record, run
+    fused inside a single computation instead of one computation per stage.
+
+    Each element flowing through the pipeline is a value and the key it is
+    routed by. Elements start as the incoming `Record` keyed by `Record.key`,
+    and reach the stream passed to `to`, e.g.::
+
+        Pipeline().map(lambda r: r.data.lower()) \\
+                  .flat_map(lambda line: line.split()) \\
+                  .filter(lambda word: len(word) > 3) \\
+                  .key_by(lambda word: word) \\
+                  .to('words')
+    """
+
+    def __init__(self):
+        self.stages = []
+        self.stream = None
+        self.compiled = None
+
+    def map(self, fn):
+        """Replace each value with `fn(value)`."""
+        return self.stage('map', fn)
+
+    def filter(self, fn):
+        """Keep the values for which `fn(value)` is true."""
+        return self.stage('filter', fn)
+
+    def flat_map(self, fn):
+        """Replace each value with every item of `fn(value)`."""
+        return self.stage('flat_map', fn)
+
+    def key_by(self, fn):
+        """Route each value by `fn(value)` from now on."""
+        return self.stage('key_by', fn)
+
+    def to(self, stream):
+        """Emit the values reaching the end of the pipeline on `stream`.
+        Values which are not strings are emitted using `str`.
+        """
+        self.stream = stream
+        self.compiled = None
+        return self
+
+    def stage(self, kind, fn):
+        self.stages.append((kind, fn))
+        self.compiled = None
+        return self
+
+    def compile(self):
+        """Fold the stages into a single function of (key, value, emit)."""
+        def sink(key, value, emit):
+            emit(self.stream, key, encode(value))
+        run = sink
+        for kind, fn in reversed(self.stages):
+            run = _fuse(kind, fn, run)
+        return run
+
+    def run(self, ctx, record):
+        """Push `record` through the pipeline, producing the results on
+        `ctx`.
+        """
+        if self.stream is None:
+            raise Exception("Pipeline has no output stream, use `to`")
+        if self.compiled is None:
+            self.compiled = self.compile()
+        self.compiled(record.key, record, ctx.produce_record)
+
+def _fuse(kind, fn, downstream):
+    if kind == 'map':
+        def run(key, value, emit):
+            downstream(key, fn(value), emit)
+    elif kind == 'filter':
+        def run(key, value, emit):
+            if fn(value):
+                downstream(key, value, emit)
+    elif kind == 'flat_map':
+        def run(key, value, emit):
+            for item in fn(value):
+                downstream(key, item, emit)
+    elif kind == 'key_by':
+        def run(key, value, emit):
+            downstream(fn(value), value, emit)
+    else:
+        raise Exception("Unknown pipeline stage: %s" % kind)
+    return run
+
+class PipelineComputation:
+    """Mixin running a `Pipeline` on every incoming record, e.g.
+    `class Words(PipelineComputation, Computation)` with a `pipeline`
+    attribute.
+    """
+    pipeline = None
+
+    def process_record(self, ctx, record):
+        self.pipeline.run(ctx, record)
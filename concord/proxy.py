@@ -0,0 +1,350 @@
+"""Proxy clients for Concord
+.. module:: proxy
+    :synopsis: Reconnecting and pooled BoltProxyService clients
+"""
+
+import random
+import socket
+import time
+import threading
+import Queue
+import logging
+from collections import deque, OrderedDict
+from thrift.transport import TSocket, TTransport
+from thrift.protocol import TBinaryProtocol
+from concord.internal.thrift import BoltProxyService
+from concord.internal.thrift.ttypes import BoltError
+
+ccord_logger = logging.getLogger('concord.computation')
+
+kDefaultProxyRetries = 5
+kDefaultProxyBackoffMs = 50
+kDefaultProxyMaxBackoffMs = 5000
+kDefaultProxyPoolSize = 1
+# Number of unacknowledged pipelined writes after which replies are drained.
+kDefaultMaxPendingWrites = 1024
+
+# Calls which may be replayed after a connection failure.
+kIdempotentProxyCalls = frozenset([
+    'setState', 'getState', 'registerWithScheduler', 'updateTopology',
+    'updateSchedulerAddress'
+])
+
+class ReconnectingProxyClient:
+    """Wraps a `BoltProxyService.Client`, reconnecting with jittered
+    exponential backoff when the connection to the proxy fails.
+
+    A call failing at the transport level closes the connection. Idempotent
+    calls are then retried up to `retries` times on a new connection; other
+    calls re-raise the error, and the next call reconnects.
+    """
+
+    def __init__(self, host, port, retries=kDefaultProxyRetries,
+                 backoff_ms=kDefaultProxyBackoffMs,
+                 max_backoff_ms=kDefaultProxyMaxBackoffMs,
+                 service=BoltProxyService):
+        """
+        :param service: The generated module of the service to connect to.
+        :type service: module.
+        """
+        self.host = host
+        self.port = port
+        self.service = service
+        self.retries = retries
+        self.backoff_ms = backoff_ms
+        self.max_backoff_ms = max_backoff_ms
+        self.transport = None
+        self.client = None
+        self.stats = {'calls': 0, 'failures': 0, 'reconnects': 0}
+
+    def connect(self):
+        sock = TSocket.TSocket(self.host, self.port)
+        transport = TTransport.TFramedTransport(sock)
+        protocol = TBinaryProtocol.TBinaryProtocolAccelerated(transport)
+        transport.open()
+        self.transport = transport
+        self.client = self.service.Client(protocol)
+
+    def close(self):
+        if self.transport is not None:
+            try:
+                self.transport.close()
+            except Exception:
+                pass
+        self.transport = None
+        self.client = None
+
+    def healthy(self):
+        """Whether a connection to the proxy is currently open."""
+        return self.transport is not None and self.transport.isOpen()
+
+    def backoff(self, attempt):
+        """Sleep for a random time up to the exponential backoff of
+        `attempt`."""
+        limit = min(self.max_backoff_ms, self.backoff_ms * (2 ** attempt))
+        time.sleep(random.uniform(0, limit) / 1000.0)
+
+    def call(self, method, *args):
+        attempt = 0
+        while True:
+            try:
+                if not self.healthy():
+                    if self.stats['calls'] > 0:
+                        self.stats['reconnects'] += 1
+                        ccord_logger.info("Reconnecting to proxy at %s:%d",
+                                          self.host, self.port)
+                    self.connect()
+                self.stats['calls'] += 1
+                return getattr(self.client, method)(*args)
+            except (TTransport.TTransportException, socket.error) as e:
+                self.stats['failures'] += 1
+                self.close()
+                if method not in kIdempotentProxyCalls or attempt >= self.retries:
+                    raise
+                ccord_logger.warning("Proxy call %s failed (%s), retry %d/%d",
+                                     method, e, attempt + 1, self.retries)
+                self.backoff(attempt)
+                attempt += 1
+
+    def send(self, method, *args):
+        """Send a call without waiting for its reply, see `recv`."""
+        if not self.healthy():
+            self.connect()
+        self.stats['calls'] += 1
+        getattr(self.client, 'send_' + method)(*args)
+
+    def recv(self, method):
+        """Read the reply of the oldest call sent with `send`."""
+        return getattr(self.client, 'recv_' + method)()
+
+    def setState(self, key, value):
+        return self.call('setState', key, value)
+
+    def getState(self, key):
+        return self.call('getState', key)
+
+    def registerWithScheduler(self, meta):
+        return self.call('registerWithScheduler', meta)
+
+    def updateTopology(self, topology):
+        return self.call('updateTopology', topology)
+
+    def updateSchedulerAddress(self, e):
+        return self.call('updateSchedulerAddress', e)
+
+class ProxyClientPool:
+    """Thread-safe pool of proxy clients.
+
+    Thrift clients share one transport and sequence id, so a client must only
+    be used by one thread at a time. Every call checks a client out of the
+    pool for its duration, opening up to `size` connections on demand and
+    blocking while all of them are busy.
+    """
+
+    def __init__(self, host, port, size=kDefaultProxyPoolSize,
+                 factory=ReconnectingProxyClient):
+        """
+        :param size: The maximum number of connections to the proxy.
+        :type size: int.
+        :param factory: Called as `factory(host, port)` to open a client.
+        :type factory: function.
+        """
+        self.host = host
+        self.port = port
+        self.size = size
+        self.factory = factory
+        self.idle = Queue.LifoQueue()
+        self.lock = threading.Lock()
+        self.clients = []
+        self.stats = {'checkouts': 0, 'waits': 0, 'wait_ms': 0.0}
+
+    def checkout(self):
+        try:
+            client = self.idle.get_nowait()
+        except Queue.Empty:
+            client = None
+        with self.lock:
+            self.stats['checkouts'] += 1
+            if client is None and len(self.clients) < self.size:
+                client = self.factory(self.host, self.port)
+                self.clients.append(client)
+        if client is None:
+            start = time.time()
+            client = self.idle.get()
+            with self.lock:
+                self.stats['waits'] += 1
+                self.stats['wait_ms'] += (time.time() - start) * 1000
+        return client
+
+    def checkin(self, client):
+        self.idle.put(client)
+
+    def call(self, method, *args):
+        client = self.checkout()
+        try:
+            return getattr(client, method)(*args)
+        finally:
+            self.checkin(client)
+
+    def usage(self):
+        """Pool statistics, including the ones of the pooled clients."""
+        with self.lock:
+            usage = dict(self.stats, size=self.size, open=len(self.clients))
+            for client in self.clients:
+                for name, value in getattr(client, 'stats', {}).iteritems():
+                    usage[name] = usage.get(name, 0) + value
+        return usage
+
+    def setState(self, key, value):
+        return self.call('setState', key, value)
+
+    def getState(self, key):
+        return self.call('getState', key)
+
+    def registerWithScheduler(self, meta):
+        return self.call('registerWithScheduler', meta)
+
+    def updateTopology(self, topology):
+        return self.call('updateTopology', topology)
+
+    def updateSchedulerAddress(self, e):
+        return self.call('updateSchedulerAddress', e)
+
+class FailedStateWrites(Exception):
+    """Raised by `PipelinedStateWriter.flush` for the writes the proxy kept
+    rejecting.
+    """
+
+    def __init__(self, writes):
+        """
+        :param writes: The rejected writes.
+        :type writes: list((str, str, BoltError)).
+        """
+        Exception.__init__(self, "%d state writes failed" % len(writes))
+        self.writes = writes
+
+class PipelinedStateWriter:
+    """Sends `setState` calls without waiting for their replies.
+
+    Writes are pipelined on a single pooled connection, so the proxy applies
+    them in order. `flush` waits for every outstanding reply; `getState`
+    flushes first so that reads observe earlier writes. If the connection
+    fails, the unacknowledged writes are replayed in order on a new one.
+
+    Writes the proxy rejects with a `BoltError` are sent again by `flush`,
+    up to `retries` times, unless a later write to the same key superseded
+    them. `flush` then raises `FailedStateWrites` for the ones still failing.
+    """
+
+    def __init__(self, pool, max_pending=kDefaultMaxPendingWrites,
+                 retries=kDefaultProxyRetries):
+        """
+        :param pool: The pool to check a connection out of.
+        :type pool: ProxyClientPool.
+        :param max_pending: Number of unacknowledged writes after which
+            replies are read before sending more, so that neither side
+            blocks on a full socket buffer.
+        :type max_pending: int.
+        :param retries: Number of times a rejected write is sent again.
+        :type retries: int.
+        """
+        self.pool = pool
+        self.max_pending = max_pending
+        self.retries = retries
+        self.client = None
+        self.pending = deque()
+        # The sequence number of the last write of every pending key.
+        self.latest = {}
+        self.failed = OrderedDict()
+        self.sequence = 0
+        self.lock = threading.RLock()
+        self.stats = {'writes': 0, 'flushes': 0, 'replays': 0, 'rejected': 0,
+                      'retries': 0}
+
+    def setState(self, key, value):
+        with self.lock:
+            self.stats['writes'] += 1
+            self.failed.pop(key, None)
+            self.send(key, value)
+
+    def send(self, key, value):
+        if self.client is None:
+            self.client = self.pool.checkout()
+        if len(self.pending) >= self.max_pending:
+            self.drain(len(self.pending) // 2)
+        self.sequence += 1
+        self.pending.append((self.sequence, key, value))
+        self.latest[key] = self.sequence
+        try:
+            self.client.send('setState', key, value)
+        except (TTransport.TTransportException, socket.error):
+            self.replay()
+
+    def getState(self, key):
+        with self.lock:
+            self.flush()
+            return self.pool.getState(key)
+
+    def acknowledge(self, error=None):
+        """Pop the oldest pending write, keeping it for a retry if the proxy
+        rejected it with `error` and no later write superseded it.
+        """
+        sequence, key, value = self.pending.popleft()
+        if self.latest.get(key) != sequence:
+            return
+        del self.latest[key]
+        if error is not None:
+            self.stats['rejected'] += 1
+            self.failed[key] = (value, error)
+
+    def drain(self, count):
+        try:
+            for _ in xrange(count):
+                try:
+                    self.client.recv('setState')
+                except BoltError as e:
+                    self.acknowledge(e)
+                else:
+                    self.acknowledge()
+        except (TTransport.TTransportException, socket.error):
+            self.replay()
+
+    def replay(self):
+        """Re-send the unacknowledged writes, in order, on a new connection.
+        """
+        self.stats['replays'] += 1
+        ccord_logger.warning("Replaying %d pipelined state writes",
+                             len(self.pending))
+        self.client.close()
+        while self.pending:
+            _, key, value = self.pending[0]
+            try:
+                self.client.setState(key, value)
+            except BoltError as e:
+                self.acknowledge(e)
+            else:
+                self.acknowledge()
+
+    def flush(self):
+        """Wait until every write sent so far has been acknowledged.
+        :raises: FailedStateWrites.
+        """
+        with self.lock:
+            if self.client is None:
+                return
+            self.stats['flushes'] += 1
+            self.drain(len(self.pending))
+            for _ in xrange(self.retries):
+                if not self.failed:
+                    break
+                self.stats['retries'] += 1
+                failed, self.failed = self.failed, OrderedDict()
+                for key, (value, _) in failed.iteritems():
+                    self.send(key, value)
+                self.drain(len(self.pending))
+            self.pool.checkin(self.client)
+            self.client = None
+            if self.failed:
+                failed, self.failed = self.failed, OrderedDict()
+                raise FailedStateWrites([(key, value, error) for key,
+                                         (value, error) in failed.iteritems()])
@@ -0,0 +1,286 @@
+"""Approximate aggregations for Concord
+.. module:: sketches
+    :synopsis: Mergeable count-min sketch, HyperLogLog and t-digest
+
+All sketches can be merged with a sketch of the same shape and serialized
+with `dumps` into a compact string, suitable for `set_state` checkpoints or
+for `produce_record` so that a downstream computation can merge them.
+Requires NumPy (`pip install concord-py[sketches]`).
+"""
+
+import hashlib
+import heapq
+import math
+import struct
+import numpy as np
+
+def hash64(key):
+    """Two independent 64-bit hashes of `key`.
+    :returns: (int, int).
+    """
+    if isinstance(key, unicode):
+        key = key.encode('utf-8')
+    return struct.unpack('<QQ', hashlib.md5(key).digest())
+
+class CountMinSketch:
+    """Frequency estimates over a stream of keys, never under-estimated.
+    With `width = e / epsilon` and `depth = ln(1 / delta)`, estimates exceed
+    the true count by more than `epsilon * total` with probability `delta`.
+    """
+    tag = 'CMS1'
+    _header = struct.Struct('<4sIIq')
+
+    def __init__(self, width=2048, depth=5):
+        self.width = width
+        self.depth = depth
+        self.table = np.zeros((depth, width), dtype=np.int64)
+        self.total = 0
+
+    def indexes(self, key):
+        h1, h2 = hash64(key)
+        return [(h1 + i * h2) % self.width for i in xrange(self.depth)]
+
+    def add(self, key, count=1):
+        self.table[np.arange(self.depth), self.indexes(key)] += count
+        self.total += count
+
+    def estimate(self, key):
+        return int(self.table[np.arange(self.depth), self.indexes(key)].min())
+
+    def merge(self, other):
+        if (self.width, self.depth) != (other.width, other.depth):
+            raise Exception("Cannot merge count-min sketches of different shapes")
+        self.table += other.table
+        self.total += other.total
+        return self
+
+    def dumps(self):
+        return (self._header.pack(self.tag, self.width, self.depth, self.total)
+                + self.table.astype('<i8').tostring())
+
+    @classmethod
+    def loads(cls, data):
+        _, width, depth, total = cls._header.unpack_from(data)
+        sketch = cls(width, depth)
+        sketch.total = total
+        sketch.table = np.frombuffer(
+            data, dtype='<i8', offset=cls._header.size).astype(np.int64)
+        sketch.table = sketch.table.reshape((depth, width))
+        return sketch
+
+class HeavyHitters:
+    """Tracks the `k` most frequent keys of a stream in bounded memory, using
+    a `CountMinSketch` to estimate counts.
+    """
+    tag = 'HHK1'
+    _header = struct.Struct('<4sI')
+
+    def __init__(self, k=100, width=2048, depth=5):
+        self.k = k
+        self.sketch = CountMinSketch(width, depth)
+        self.candidates = {}
+
+    def add(self, key, count=1):
+        self.sketch.add(key, count)
+        self.offer(key, self.sketch.estimate(key))
+
+    def offer(self, key, estimate):
+        if key in self.candidates or len(self.candidates) < self.k:
+            self.candidates[key] = estimate
+            return
+        smallest = min(self.candidates, key=self.candidates.get)
+        if estimate > self.candidates[smallest]:
+            del self.candidates[smallest]
+            self.candidates[key] = estimate
+
+    def top(self, n=None):
+        """The heaviest keys and their estimated counts, heaviest first.
+        :returns: list((str, int)).
+        """
+        return heapq.nlargest(n or self.k, self.candidates.iteritems(),
+                              key=lambda candidate: candidate[1])
+
+    def merge(self, other):
+        self.sketch.merge(other.sketch)
+        keys = set(self.candidates) | set(other.candidates)
+        self.candidates = {}
+        for key in keys:
+            self.offer(key, self.sketch.estimate(key))
+        return self
+
+    def dumps(self):
+        parts = [self._header.pack(self.tag, self.k),
+                 struct.pack('<I', len(self.candidates))]
+        for key in self.candidates:
+            parts.append(struct.pack('<I', len(key)))
+            parts.append(key)
+        parts.append(self.sketch.dumps())
+        return ''.join(parts)
+
+    @classmethod
+    def loads(cls, data):
+        _, k = cls._header.unpack_from(data)
+        offset = cls._header.size
+        (count,) = struct.unpack_from('<I', data, offset)
+        offset += 4
+        keys = []
+        for _ in xrange(count):
+            (size,) = struct.unpack_from('<I', data, offset)
+            offset += 4
+            keys.append(data[offset:offset + size])
+            offset += size
+        sketch = CountMinSketch.loads(data[offset:])
+        hitters = cls(k, sketch.width, sketch.depth)
+        hitters.sketch = sketch
+        for key in keys:
+            hitters.candidates[key] = sketch.estimate(key)
+        return hitters
+
+class HyperLogLog:
+    """Distinct count estimates with a relative error of about
+    `1.04 / sqrt(2 ** precision)`, in `2 ** precision` bytes.
+    """
+    tag = 'HLL1'
+    _header = struct.Struct('<4sB')
+
+    def __init__(self, precision=14):
+        if not 4 <= precision <= 18:
+            raise Exception("HyperLogLog precision must be within [4, 18]")
+        self.precision = precision
+        self.registers = np.zeros(1 << precision, dtype=np.uint8)
+
+    def add(self, key):
+        h, _ = hash64(key)
+        index = h >> (64 - self.precision)
+        bits = 64 - self.precision
+        rank = bits - (h & ((1 << bits) - 1)).bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def count(self):
+        m = float(len(self.registers))
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / np.power(2.0, -self.registers.astype(np.float64)).sum()
+        zeros = int((self.registers == 0).sum())
+        if estimate <= 2.5 * m and zeros:
+            estimate = m * math.log(m / zeros)
+        return int(round(estimate))
+
+    def merge(self, other):
+        if self.precision != other.precision:
+            raise Exception("Cannot merge HyperLogLogs of different precisions")
+        np.maximum(self.registers, other.registers, out=self.registers)
+        return self
+
+    def dumps(self):
+        return self._header.pack(self.tag, self.precision) + self.registers.tostring()
+
+    @classmethod
+    def loads(cls, data):
+        _, precision = cls._header.unpack_from(data)
+        sketch = cls(precision)
+        sketch.registers = np.frombuffer(
+            data, dtype=np.uint8, offset=cls._header.size).copy()
+        return sketch
+
+class TDigest:
+    """Quantile estimates, most accurate towards the tails, in
+    `O(compression)` memory.
+    """
+    tag = 'TDG1'
+    _header = struct.Struct('<4sdI')
+
+    def __init__(self, compression=100.0):
+        self.compression = compression
+        self.means = np.zeros(0)
+        self.weights = np.zeros(0)
+        self.buffer = []
+        self.buffer_size = int(compression) * 5
+
+    def add(self, value, weight=1):
+        self.buffer.append((value, weight))
+        if len(self.buffer) >= self.buffer_size:
+            self.compress()
+
+    def scale(self, q):
+        return self.compression / (2 * math.pi) * math.asin(2 * q - 1)
+
+    def scale_inverse(self, k):
+        if k >= self.compression / 4:
+            return 1.0
+        return (math.sin(k * 2 * math.pi / self.compression) + 1) / 2
+
+    def compress(self):
+        """Fold buffered values into the centroids."""
+        if self.buffer:
+            values, weights = zip(*self.buffer)
+            self.buffer = []
+            means = np.concatenate((self.means, values))
+            weights = np.concatenate((self.weights, weights))
+        elif len(self.means):
+            means, weights = self.means, self.weights
+        else:
+            return
+        order = np.argsort(means, kind='mergesort')
+        means, weights = means[order], weights[order]
+        total = weights.sum()
+
+        merged_means, merged_weights = [means[0]], [weights[0]]
+        cumulative = 0.0
+        limit = total * self.scale_inverse(self.scale(0) + 1)
+        for mean, weight in zip(means[1:], weights[1:]):
+            if cumulative + merged_weights[-1] + weight <= limit:
+                w = merged_weights[-1] + weight
+                merged_means[-1] += (mean - merged_means[-1]) * weight / w
+                merged_weights[-1] = w
+            else:
+                cumulative += merged_weights[-1]
+                limit = total * self.scale_inverse(
+                    self.scale(min(cumulative / total, 1.0)) + 1)
+                merged_means.append(mean)
+                merged_weights.append(weight)
+        self.means = np.array(merged_means)
+        self.weights = np.array(merged_weights, dtype=np.float64)
+
+    def count(self):
+        return self.weights.sum() + sum(w for _, w in self.buffer)
+
+    def quantile(self, q):
+        """The estimated value at quantile `q` (within [0, 1])."""
+        self.compress()
+        if not len(self.means):
+            return None
+        cumulative = np.cumsum(self.weights) - self.weights / 2
+        return float(np.interp(q * self.weights.sum(), cumulative, self.means))
+
+    def merge(self, other):
+        other.compress()
+        self.buffer.extend(zip(other.means, other.weights))
+        self.compress()
+        return self
+
+    def dumps(self):
+        self.compress()
+        centroids = np.column_stack((self.means, self.weights)).astype('<f8')
+        return (self._header.pack(self.tag, self.compression, len(self.means))
+                + centroids.tostring())
+
+    @classmethod
+    def loads(cls, data):
+        _, compression, size = cls._header.unpack_from(data)
+        digest = cls(compression)
+        centroids = np.frombuffer(data, dtype='<f8', offset=cls._header.size)
+        centroids = centroids.reshape((size, 2))
+        digest.means = centroids[:, 0].copy()
+        digest.weights = centroids[:, 1].copy()
+        return digest
+
+_sketches = dict((cls.tag, cls) for cls in
+                 (CountMinSketch, HeavyHitters, HyperLogLog, TDigest))
+
+def loads(data):
+    """Deserialize any sketch produced by `dumps`."""
+    cls = _sketches.get(data[:4])
+    if cls is None:
+        raise Exception("Unknown sketch type: %r" % data[:4])
+    return cls.loads(data)
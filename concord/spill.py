@@ -0,0 +1,280 @@
+"""Spilling of large transactions for Concord
+.. module:: spill
+    :synopsis: Keep the records of oversized transactions in temporary files
+"""
+
+import mmap
+import struct
+import tempfile
+from thrift.Thrift import TType, TMessageType
+from thrift.transport import TTransport
+from thrift.protocol import TBinaryProtocol
+from concord.internal.thrift.ttypes import Record
+
+# Size of the chunks spilled records are streamed into the reply in.
+kDefaultSpillChunkBytes = 1 << 20
+
+class SpillFile:
+    """Records encoded with the binary protocol, appended to a temporary
+    file and read back through `mmap` when the reply is written.
+    """
+
+    def __init__(self):
+        self.file = tempfile.TemporaryFile(prefix='concord-spill-')
+        self.count = 0
+        self.size = 0
+
+    def write(self, records):
+        buf = TTransport.TMemoryBuffer()
+        protocol = TBinaryProtocol.TBinaryProtocolAccelerated(buf)
+        for record in records:
+            record.write(protocol)
+        data = buf.getvalue()
+        self.file.write(data)
+        self.count += len(records)
+        self.size += len(data)
+
+    def chunks(self, chunk_bytes=kDefaultSpillChunkBytes):
+        """Iterate over the encoded records, `chunk_bytes` at a time."""
+        if self.size == 0:
+            return
+        self.file.flush()
+        data = mmap.mmap(self.file.fileno(), self.size, access=mmap.ACCESS_READ)
+        try:
+            for offset in xrange(0, self.size, chunk_bytes):
+                yield data[offset:offset + chunk_bytes]
+        finally:
+            data.close()
+
+    def records(self):
+        """Decode the spilled records.
+        :returns: list(Record).
+        """
+        buf = TTransport.TMemoryBuffer(''.join(self.chunks()))
+        protocol = TBinaryProtocol.TBinaryProtocolAccelerated(buf)
+        records = []
+        for _ in xrange(self.count):
+            record = Record()
+            record.read(protocol)
+            records.append(record)
+        return records
+
+    def extend(self, other):
+        """Append the records spilled to `other`."""
+        for chunk in other.chunks():
+            self.file.write(chunk)
+        self.count += other.count
+        self.size += other.size
+
+    def close(self):
+        self.file.close()
+
+class Spiller:
+    """Moves the records of a transaction to a `SpillFile` once `threshold`
+    of them are held in memory.
+
+    Spilled records are final: they are not packed into envelopes, and their
+    stream ids are compacted at the time they are spilled. Records which a
+    `BackPressure.DROP_HEAD` limit may still drop, at most `max_records` per
+    stream, are held back in memory, and returned after the spilled ones.
+    Transactions holding spilled records must be written with `write_reply`,
+    see `ComputationProcessor`.
+    """
+
+    def __init__(self, threshold, streams=None, output=None):
+        """
+        :param threshold: The number of records a transaction holds in memory.
+        :type threshold: int.
+        :param streams: When set, the table compacting the stream of spilled
+            records.
+        :type streams: StreamTable.
+        :param output: When set, the buffer enforcing the output limits of
+            the records.
+        :type output: OutputBuffer.
+        """
+        self.threshold = threshold
+        self.streams = streams
+        self.output = output
+        self.stats = {'spills': 0, 'records': 0, 'bytes': 0}
+
+    def check(self, transaction):
+        held = getattr(transaction, 'spill_held', 0)
+        if len(transaction.records) >= self.threshold + held:
+            self.spill(transaction)
+
+    def spill(self, transaction):
+        records, kept = transaction.records, []
+        if self.output is not None:
+            buffered = self.output.held(transaction)
+            if buffered:
+                records = []
+                for record in transaction.records:
+                    if id(record) in buffered:
+                        kept.append(record)
+                    else:
+                        records.append(record)
+        transaction.records = kept
+        transaction.spill_held = len(kept)
+        if not records:
+            return
+        spill_file = getattr(transaction, 'spill', None)
+        if spill_file is None:
+            spill_file = transaction.spill = SpillFile()
+        if self.streams is not None:
+            self.streams.compact(records)
+        size = spill_file.size
+        spill_file.write(records)
+        self.stats['spills'] += 1
+        self.stats['records'] += len(records)
+        self.stats['bytes'] += spill_file.size - size
+
+    def merge(self, transaction, other):
+        """Move the spilled records of `other` to `transaction`, after the
+        records `transaction` already holds.
+        """
+        other_file = getattr(other, 'spill', None)
+        if other_file is None:
+            return
+        self.spill(transaction)
+        spill_file = getattr(transaction, 'spill', None)
+        if spill_file is None:
+            transaction.spill = other_file
+        else:
+            spill_file.extend(other_file)
+            other_file.close()
+        other.spill = None
+
+def spilled(transaction):
+    """The number of records of `transaction` held in a `SpillFile`."""
+    spill_file = getattr(transaction, 'spill', None)
+    return spill_file.count if spill_file is not None else 0
+
+def discard(transaction):
+    """Delete the records spilled by a transaction which is not returned to
+    the framework.
+    """
+    spill_file = getattr(transaction, 'spill', None)
+    if spill_file is not None:
+        spill_file.close()
+        transaction.spill = None
+
+class SpillingFramedTransport(TTransport.TFramedTransport):
+    """A `TFramedTransport` which keeps the transport it wraps, so that a
+    `ReplyBuffer` can stream spilled records straight to it.
+    """
+
+    def __init__(self, trans):
+        TTransport.TFramedTransport.__init__(self, trans)
+        self.wrapped = trans
+
+class SpillingFramedTransportFactory:
+    """Factory of the `SpillingFramedTransport` of a server."""
+
+    def getTransport(self, trans):
+        return SpillingFramedTransport(trans)
+
+class ReplyBuffer(TTransport.TTransportBase):
+    """Collects a reply as encoded parts and spill files, so that its frame
+    size is known without copying the spilled records in memory.
+    """
+
+    def __init__(self):
+        self.parts = []
+        self.size = 0
+
+    def write(self, buf):
+        self.parts.append(buf)
+        self.size += len(buf)
+
+    def write_spill(self, spill_file):
+        self.parts.append(spill_file)
+        self.size += spill_file.size
+
+    def send(self, trans):
+        """Write the reply to `trans`, streaming the spilled records straight
+        to the socket of a `SpillingFramedTransport`. Other transports,
+        including a plain `TFramedTransport`, get a copy of the records.
+        """
+        if isinstance(trans, SpillingFramedTransport):
+            out = trans.wrapped
+            out.write(struct.pack('!i', self.size))
+        else:
+            out = trans
+        for part in self.parts:
+            if isinstance(part, SpillFile):
+                for chunk in part.chunks():
+                    out.write(chunk)
+            else:
+                out.write(part)
+        out.flush()
+
+def write_transaction(transaction, oprot):
+    """Write a `ComputationTx`, including its spilled records, to a protocol
+    over a `ReplyBuffer`.
+    """
+    spill_file = getattr(transaction, 'spill', None)
+    if spill_file is None:
+        transaction.write(oprot)
+        return
+    records = transaction.records or []
+    oprot.writeStructBegin('ComputationTx')
+    if transaction.id is not None:
+        oprot.writeFieldBegin('id', TType.I64, 1)
+        oprot.writeI64(transaction.id)
+        oprot.writeFieldEnd()
+    oprot.writeFieldBegin('records', TType.LIST, 2)
+    oprot.writeListBegin(TType.STRUCT, spill_file.count + len(records))
+    oprot.trans.write_spill(spill_file)
+    for record in records:
+        record.write(oprot)
+    oprot.writeListEnd()
+    oprot.writeFieldEnd()
+    if transaction.timers is not None:
+        oprot.writeFieldBegin('timers', TType.MAP, 3)
+        oprot.writeMapBegin(TType.STRING, TType.I64, len(transaction.timers))
+        for key, time in transaction.timers.iteritems():
+            oprot.writeString(key)
+            oprot.writeI64(time)
+        oprot.writeMapEnd()
+        oprot.writeFieldEnd()
+    oprot.writeFieldStop()
+    oprot.writeStructEnd()
+
+def write_reply(name, seqid, result, trans):
+    """Write the reply of a `ComputationService` call returning one or a list
+    of transactions, then delete their spill files.
+    :param name: The name of the call, e.g. 'boltProcessRecords'.
+    :type name: str.
+    :param result: The `<name>_result` struct of the call.
+    :param trans: The transport of the output protocol.
+    :type trans: TTransport.
+    """
+    buf = ReplyBuffer()
+    oprot = TBinaryProtocol.TBinaryProtocolAccelerated(buf)
+    oprot.writeMessageBegin(name, TMessageType.REPLY, seqid)
+    oprot.writeStructBegin(name + '_result')
+    transactions = result.success
+    if isinstance(transactions, list):
+        oprot.writeFieldBegin('success', TType.LIST, 0)
+        oprot.writeListBegin(TType.STRUCT, len(transactions))
+        for transaction in transactions:
+            write_transaction(transaction, oprot)
+        oprot.writeListEnd()
+        oprot.writeFieldEnd()
+    elif transactions is not None:
+        oprot.writeFieldBegin('success', TType.STRUCT, 0)
+        write_transaction(transactions, oprot)
+        oprot.writeFieldEnd()
+        transactions = [transactions]
+    if result.e is not None:
+        oprot.writeFieldBegin('e', TType.STRUCT, 1)
+        result.e.write(oprot)
+        oprot.writeFieldEnd()
+    oprot.writeFieldStop()
+    oprot.writeStructEnd()
+    oprot.writeMessageEnd()
+    try:
+        buf.send(trans)
+    finally:
+        for transaction in transactions or []:
+            discard(transaction)
@@ -0,0 +1,82 @@
+"""Stream name table for Concord
+.. module:: streams
+    :synopsis: Stream name interning and stream id lookups
+"""
+
+from concord.internal.thrift.ttypes import RecordMetadata
+
+class StreamTable:
+    """Interns stream names and tracks the numeric id the framework assigned
+    to each of them.
+
+    Ids are registered explicitly via `register`, or learned from incoming
+    records carrying both a `userStream` and a `RecordMetadata.stream`.
+    Learned ids never replace registered ones.
+    """
+
+    def __init__(self):
+        self.names = {}
+        self.ids = {}
+        self.names_by_id = {}
+
+    def intern(self, name):
+        """Return the canonical instance of a stream name.
+        :param name: The stream name.
+        :type name: str.
+        :returns: str.
+        """
+        if name is None:
+            return None
+        return self.names.setdefault(name, name)
+
+    def register(self, name, stream_id):
+        """Record the numeric id of a stream.
+        :param name: The stream name.
+        :type name: str.
+        :param stream_id: The id used in `RecordMetadata.stream`.
+        :type stream_id: int.
+        """
+        name = self.intern(name)
+        self.ids[name] = stream_id
+        self.names_by_id[stream_id] = name
+
+    def stream_id(self, name):
+        """The numeric id of a stream, or None if it is not known yet.
+        """
+        return self.ids.get(name)
+
+    def stream_name(self, stream_id):
+        """The name of a stream id, or None if it is not known yet.
+        """
+        return self.names_by_id.get(stream_id)
+
+    def resolve(self, records):
+        """Intern the stream names of incoming records, learning stream ids
+        along the way and filling in names for records that only carry an id.
+        :param records: Records received from the proxy.
+        :type records: list(Record).
+        """
+        for record in records:
+            stream_id = record.meta.stream if record.meta else 0
+            if record.userStream is not None:
+                record.userStream = self.intern(record.userStream)
+                if (stream_id and stream_id not in self.names_by_id
+                        and record.userStream not in self.ids):
+                    self.register(record.userStream, stream_id)
+            elif stream_id:
+                record.userStream = self.names_by_id.get(stream_id)
+
+    def compact(self, records):
+        """Replace the stream name of outgoing records with their numeric id
+        wherever the id is known.
+        :param records: Records produced by the computation.
+        :type records: list(Record).
+        """
+        for record in records:
+            stream_id = self.ids.get(record.userStream)
+            if stream_id is None:
+                continue
+            if record.meta is None:
+                record.meta = RecordMetadata()
+            record.meta.stream = stream_id
+            record.userStream = None
@@ -0,0 +1,163 @@
+"""Timer wheel for Concord
+.. module:: timers
+    :synopsis: Coalesce many logical timers into few framework timers
+"""
+
+import time
+
+# Name of the framework timer used to drive the wheel.
+kTimerWheelKey = '__concord_timer_wheel'
+kDefaultTimerTickMs = 10
+kDefaultTimerWheelSlots = 64
+kDefaultTimerWheelLevels = 4
+
+def now_ms():
+    return int(time.time() * 1000)
+
+class TimerWheel:
+    """Hierarchical timer wheel keyed by timer name.
+
+    Level `L` holds timers due within the current block of `slots ** (L + 1)`
+    ticks, one slot per `slots ** L` ticks. Timers further away than the top
+    level are kept in an overflow set. Slots are cascaded to the level below
+    as the wheel turns, so adding and expiring a timer is O(1) amortized.
+
+    Timers never fire early: a deadline is rounded up to the next tick.
+    Setting a timer that already exists replaces it, matching
+    `ComputationTx.timers`.
+    """
+
+    def __init__(self, tick_ms=kDefaultTimerTickMs,
+                 slots=kDefaultTimerWheelSlots,
+                 levels=kDefaultTimerWheelLevels):
+        self.tick_ms = tick_ms
+        self.slots = slots
+        self.levels = levels
+        self.wheels = [[set() for _ in xrange(slots)] for _ in xrange(levels)]
+        self.counts = [0] * levels
+        self.overflow = set()
+        self.timers = {}
+        self.locations = {}
+        self.current = None
+
+    def __len__(self):
+        return len(self.timers)
+
+    def width(self, level):
+        """Number of ticks covered by one slot of `level`."""
+        return self.slots ** level
+
+    def add(self, key, time):
+        """Schedule (or reschedule) timer `key` at `time` (in ms).
+        """
+        if self.current is None:
+            self.current = now_ms() // self.tick_ms
+        self.remove(key)
+        tick = -(-time // self.tick_ms)
+        self.timers[key] = (time, tick)
+        self.place(key, tick)
+
+    def remove(self, key):
+        """Cancel timer `key` if it is pending."""
+        location = self.locations.pop(key, None)
+        if location is None:
+            return
+        del self.timers[key]
+        if location == -1:
+            self.overflow.discard(key)
+        else:
+            level, index = location
+            self.wheels[level][index].discard(key)
+            self.counts[level] -= 1
+
+    def place(self, key, tick):
+        tick = max(tick, self.current)
+        for level in xrange(self.levels):
+            block = self.width(level + 1)
+            if tick // block == self.current // block:
+                index = (tick // self.width(level)) % self.slots
+                self.wheels[level][index].add(key)
+                self.counts[level] += 1
+                self.locations[key] = (level, index)
+                return
+        self.overflow.add(key)
+        self.locations[key] = -1
+
+    def cascade(self):
+        """Move the timers of every slot starting at `current` one level down.
+        """
+        if self.current % self.width(self.levels) == 0 and self.overflow:
+            keys, self.overflow = self.overflow, set()
+            for key in keys:
+                self.place(key, self.timers[key][1])
+        for level in xrange(self.levels - 1, 0, -1):
+            if self.current % self.width(level) != 0:
+                continue
+            index = (self.current // self.width(level)) % self.slots
+            keys = self.wheels[level][index]
+            if not keys:
+                continue
+            self.wheels[level][index] = set()
+            self.counts[level] -= len(keys)
+            for key in keys:
+                self.place(key, self.timers[key][1])
+
+    def advance(self, time):
+        """Turn the wheel up to `time` (in ms).
+        :returns: list((str, int)). The expired (key, time) pairs, in
+            deadline order.
+        """
+        expired = []
+        if self.current is None:
+            return expired
+        target = time // self.tick_ms
+        while self.current <= target:
+            if not self.timers:
+                self.current = target + 1
+                break
+            empty = 0
+            while empty < self.levels and self.counts[empty] == 0:
+                empty += 1
+            if empty == 0:
+                index = self.current % self.slots
+                keys = self.wheels[0][index]
+                if keys:
+                    self.wheels[0][index] = set()
+                    self.counts[0] -= len(keys)
+                    due = sorted((self.timers[k][0], k) for k in keys)
+                    for deadline, key in due:
+                        del self.timers[key]
+                        del self.locations[key]
+                        expired.append((key, deadline))
+                self.current += 1
+            else:
+                # Nothing is due before the next slot boundary of level
+                # `empty`, skip straight to it.
+                width = self.width(empty)
+                boundary = (self.current // width + 1) * width
+                self.current = min(boundary, target + 1)
+            self.cascade()
+        return expired
+
+    def next_deadline(self):
+        """The time (in ms) at which the wheel next needs to turn, or None if
+        no timer is pending. Never later than the earliest pending timer.
+        """
+        if not self.timers:
+            return None
+        candidates = []
+        for level in xrange(self.levels):
+            if self.counts[level] == 0:
+                continue
+            width = self.width(level)
+            start = (self.current // width) % self.slots
+            for index in xrange(start, self.slots):
+                if self.wheels[level][index]:
+                    base = self.current // (width * self.slots)
+                    tick = (base * self.slots + index) * width
+                    candidates.append(max(tick, self.current))
+                    break
+        if self.overflow:
+            width = self.width(self.levels)
+            candidates.append((self.current // width + 1) * width)
+        return min(candidates) * self.tick_ms
@@ -0,0 +1,85 @@
+"""Topology view for Concord
+.. module:: topology
+    :synopsis: Cached view of the `TopologyMetadata` pushed by the framework
+"""
+
+import logging
+
+ccord_logger = logging.getLogger('concord.computation')
+
+class TopologyView:
+    """The latest known layout of the topology.
+
+    Each update replaces the layouts of the computations it contains and
+    keeps the other ones, so that partial updates can be applied; a layout
+    without nodes removes its computation. Updates with an older version
+    than the current one are ignored. Listeners registered with `listen` are
+    called with the view after every applied update.
+    """
+
+    def __init__(self):
+        self.version = None
+        self.framework_id = None
+        self.computations = {}
+        self.listeners = []
+
+    def update(self, topology):
+        """Apply a `TopologyMetadata`.
+        :returns: bool. Whether the update was applied.
+        """
+        if self.version is not None and topology.version < self.version:
+            ccord_logger.info("Ignoring topology version %d, at %d",
+                              topology.version, self.version)
+            return False
+        self.version = topology.version
+        if topology.frameworkID is not None:
+            self.framework_id = topology.frameworkID
+        for name, layout in (topology.computations or {}).iteritems():
+            if layout.nodes:
+                self.computations[name] = layout
+            else:
+                self.computations.pop(name, None)
+        for listener in self.listeners:
+            listener(self)
+        return True
+
+    def listen(self, fn):
+        """Call `fn(view)` after every applied update."""
+        self.listeners.append(fn)
+
+    def known(self):
+        return self.version is not None
+
+    def computation(self, name):
+        """The `PhysicalComputationLayout` of a computation, or None."""
+        return self.computations.get(name)
+
+    def instances(self, name):
+        """The number of running instances of a computation."""
+        layout = self.computations.get(name)
+        if layout is None or not layout.nodes:
+            return 0
+        return len([node for node in layout.nodes if not node.killed])
+
+    def consumers(self, stream):
+        """The names of the computations subscribed to `stream`."""
+        return sorted(name for name, layout in self.computations.iteritems()
+                      if any(s.name == stream for s in layout.istreams or []))
+
+    def parallelism(self, stream):
+        """The number of instances of the computation consuming `stream`,
+        the largest one if several do, or 0 if unknown.
+        """
+        return max([self.instances(name)
+                    for name in self.consumers(stream)] or [0])
+
+    def endpoints(self, name):
+        """The client endpoints of the running instances of a computation.
+        :returns: list((PhysicalComputationMetadata, Endpoint)).
+        """
+        layout = self.computations.get(name)
+        if layout is None:
+            return []
+        return [(node, node.taskHelper.client) for node in layout.nodes or []
+                if not node.killed and node.taskHelper is not None
+                and node.taskHelper.client is not None]
@@ -0,0 +1,75 @@
+"""Watermark tracking for Concord
+.. module:: watermarks
+    :synopsis: Event-time progress of a computation's input streams
+"""
+
+from concord.internal.thrift.ttypes import RecordFlags
+from concord.internal.thrift.constants import kMessageQueueWatermarkTopic
+
+def event_time(record):
+    """The event time of a record, in ms: `Record.time`, falling back to
+    `RecordMetadata.timestamp`.
+    """
+    if record.time:
+        return record.time
+    return record.meta.timestamp if record.meta else 0
+
+def is_watermark_record(record):
+    """Whether `record` is a framework record announcing a watermark. Those
+    carry `kMessageQueueWatermarkTopic` as key and the watermark as event
+    time.
+    """
+    return (record.meta is not None
+            and record.meta.flags & RecordFlags.FRAMEWORK_RECORD
+            and record.key == kMessageQueueWatermarkTopic)
+
+class WatermarkTracker:
+    """Tracks the low watermark of each input stream.
+
+    The watermark of a stream is the highest event time observed on it minus
+    `max_out_of_orderness`, or the watermark announced by the framework if
+    that is higher. The watermark of the computation is the lowest watermark
+    across its input streams, and is None until every stream has been seen.
+    """
+
+    def __init__(self, istreams=[], max_out_of_orderness=0):
+        """
+        :param istreams: The names of the streams to track.
+        :type istreams: list(str).
+        :param max_out_of_orderness: How far behind the latest event time
+            records of a stream may arrive, in ms.
+        :type max_out_of_orderness: int.
+        """
+        self.max_out_of_orderness = max_out_of_orderness
+        self.streams = dict((stream, None) for stream in istreams)
+        self.current = None
+
+    def observe(self, record):
+        """Update the watermark of the stream `record` arrived on.
+        :returns: bool. Whether the watermark of the computation advanced.
+        """
+        stream = record.userStream
+        if stream is None:
+            return False
+        if is_watermark_record(record):
+            watermark = event_time(record)
+        else:
+            watermark = event_time(record) - self.max_out_of_orderness
+        previous = self.streams.get(stream)
+        if previous is not None and watermark <= previous:
+            return False
+        self.streams[stream] = watermark
+        return self.update()
+
+    def update(self):
+        if None in self.streams.itervalues():
+            return False
+        watermark = min(self.streams.itervalues())
+        if self.current is not None and watermark <= self.current:
+            return False
+        self.current = watermark
+        return True
+
+    def watermark(self):
+        """The current low watermark, in ms, or None if unknown."""
+        return self.current
@@ -0,0 +1,428 @@
+"""Event-time windowing for Concord
+.. module:: windowing
+    :synopsis: Tumbling, sliding and session windows with incremental
+        aggregation
+"""
+
+import heapq
+from concord.watermarks import event_time
+from concord.timers import now_ms
+
+# Key of the timer used to close windows without a watermark.
+kWindowTimerKey = '__concord_window'
+# Number of (window, key) aggregates held before the oldest window is closed
+# early.
+kDefaultMaxPanes = 100000
+
+class Aggregator:
+    """Incremental aggregation function applied to the records of a window.
+    Only the running aggregate is kept, never the records themselves.
+    """
+
+    def zero(self):
+        """The aggregate of an empty window."""
+        return None
+
+    def add(self, acc, record):
+        """Fold `record` into the aggregate `acc` and return the result."""
+        raise Exception('add not implemented')
+
+    def merge(self, acc, other):
+        """Combine two aggregates. Needed by session windows only."""
+        raise Exception('merge not implemented')
+
+    def result(self, acc):
+        """Turn an aggregate into the value handed to `process_window`."""
+        return acc
+
+class Count(Aggregator):
+    """Counts the records of a window."""
+
+    def zero(self):
+        return 0
+
+    def add(self, acc, record):
+        return acc + 1
+
+    def merge(self, acc, other):
+        return acc + other
+
+class Reduce(Aggregator):
+    """Reduces the values extracted from the records of a window with a
+    binary function, e.g. `Reduce(operator.add, lambda r: int(r.data))`.
+    """
+
+    def __init__(self, fn, value=lambda record: record.data, initial=None):
+        self.fn = fn
+        self.value = value
+        self.initial = initial
+
+    def zero(self):
+        return self.initial
+
+    def add(self, acc, record):
+        value = self.value(record)
+        return value if acc is None else self.fn(acc, value)
+
+    def merge(self, acc, other):
+        if acc is None:
+            return other
+        if other is None:
+            return acc
+        return self.fn(acc, other)
+
+class TumblingWindows:
+    """Fixed-size, non-overlapping windows."""
+    merging = False
+
+    def __init__(self, size):
+        """
+        :param size: The window length, in ms.
+        :type size: int.
+        """
+        self.size = size
+
+    def assign(self, timestamp):
+        start = timestamp - timestamp % self.size
+        return [(start, start + self.size)]
+
+    def timeout(self, window):
+        return self.size
+
+class SlidingWindows:
+    """Fixed-size windows starting every `slide` ms."""
+    merging = False
+
+    def __init__(self, size, slide):
+        """
+        :param size: The window length, in ms.
+        :type size: int.
+        :param slide: The interval between window starts, in ms.
+        :type slide: int.
+        """
+        self.size = size
+        self.slide = slide
+
+    def assign(self, timestamp):
+        windows = []
+        start = timestamp - timestamp % self.slide
+        while start > timestamp - self.size:
+            windows.append((start, start + self.size))
+            start -= self.slide
+        return windows
+
+    def timeout(self, window):
+        return self.size
+
+class SessionWindows:
+    """Per-key windows closed after `gap` ms without records."""
+    merging = True
+
+    def __init__(self, gap):
+        """
+        :param gap: The inactivity gap closing a session, in ms.
+        :type gap: int.
+        """
+        self.gap = gap
+
+    def assign(self, timestamp):
+        return [(timestamp, timestamp + self.gap)]
+
+    def timeout(self, window):
+        return self.gap
+
+class WindowOperator:
+    """Keeps one aggregate per (window, key) and closes windows as the
+    watermark advances.
+
+    Windows are (start, end) pairs of event times in ms, `end` excluded. A
+    window fires as soon as the watermark reaches `end`, and is kept for
+    `allowed_lateness` ms afterwards: late records folded into a window that
+    already fired emit an updated result right away. A window is closed when
+    the watermark reaches `end + allowed_lateness`. As a fallback for inputs
+    without a watermark, or whose watermark stalls because an istream went
+    idle, every window is also given a processing-time deadline, its length
+    (the gap for sessions) plus `allowed_lateness` ms after it opened. A
+    single timer, set for the earliest deadline, stands for all of them.
+    When it fires, the windows past their deadline are closed if the
+    watermark is unknown or did not advance since the timer was set;
+    otherwise their deadlines are pushed back by as much.
+    Records for a closed window are counted in `late_records` and handed to
+    `process_late`. When more than `max_panes` aggregates are open, the
+    windows ending first are closed early.
+    """
+
+    def __init__(self, windows, aggregator, process_window,
+                 allowed_lateness=0, max_panes=kDefaultMaxPanes,
+                 process_late=None):
+        """
+        :param windows: The window assigner.
+        :type windows: TumblingWindows, SlidingWindows, SessionWindows.
+        :param aggregator: The aggregation function.
+        :type aggregator: Aggregator.
+        :param process_window: Called as `process_window(ctx, key, window,
+            result)` for every key of a closed window.
+        :type process_window: function.
+        :param process_late: Called as `process_late(ctx, key, record)` for
+            records arriving after their windows were closed.
+        :type process_late: function.
+        """
+        self.windows = windows
+        self.aggregator = aggregator
+        self.process_window = process_window
+        self.allowed_lateness = allowed_lateness
+        self.max_panes = max_panes
+        self.process_late = process_late
+        self.panes = {}
+        self.ends = []
+        self.unfired = []
+        self.deadlines = []
+        self.armed = None
+        self.armed_watermark = None
+        self.fired = set()
+        self.sessions = {}
+        self.pane_count = 0
+        self.closed_until = None
+        self.late_records = 0
+        self.late_updates = 0
+        self.evicted_windows = 0
+
+    def add(self, ctx, key, timestamp, record):
+        """Fold `record` into the windows `timestamp` belongs to."""
+        for window in self.windows.assign(timestamp):
+            if self.closed_until is not None and window[1] <= self.closed_until:
+                self.late_records += 1
+                if self.process_late:
+                    self.process_late(ctx, key, record)
+                continue
+            if self.windows.merging:
+                window = self.merge_sessions(ctx, key, window)
+            pane = self.open_window(ctx, window)
+            if key not in pane:
+                pane[key] = self.aggregator.zero()
+                self.pane_count += 1
+            pane[key] = self.aggregator.add(pane[key], record)
+            if window in self.fired:
+                self.late_updates += 1
+                self.process_window(ctx, key, window,
+                                    self.aggregator.result(pane[key]))
+        while self.pane_count > self.max_panes and self.ends:
+            self.evicted_windows += 1
+            self.close_next(ctx)
+
+    def open_window(self, ctx, window):
+        pane = self.panes.get(window)
+        if pane is None:
+            pane = self.panes[window] = {}
+            heapq.heappush(self.ends, (window[1], window[0]))
+            heapq.heappush(self.unfired, (window[1], window[0]))
+            deadline = (now_ms() + self.windows.timeout(window) +
+                        self.allowed_lateness)
+            heapq.heappush(self.deadlines, (deadline, window[1], window[0]))
+            self.arm(ctx, deadline)
+        return pane
+
+    def arm(self, ctx, deadline):
+        """Make sure the window timer fires no later than `deadline`."""
+        if self.armed is None or deadline < self.armed:
+            ctx.set_timer(kWindowTimerKey, deadline)
+            self.armed = deadline
+            self.armed_watermark = ctx.watermark()
+
+    def remove_window(self, window):
+        pane = self.panes.pop(window, None)
+        if pane is not None:
+            self.prune()
+        return pane
+
+    def prune(self):
+        """Rebuild the heaps once most of their entries belong to windows
+        which were removed, or once no window is left.
+        """
+        if self.panes and len(self.ends) + len(self.unfired) + \
+                len(self.deadlines) <= 6 * len(self.panes) + 64:
+            return
+        self.ends = [(end, start) for start, end in self.panes]
+        self.unfired = [(end, start) for start, end in self.panes
+                        if (start, end) not in self.fired]
+        self.deadlines = [entry for entry in self.deadlines
+                          if (entry[2], entry[1]) in self.panes]
+        for heap in (self.ends, self.unfired, self.deadlines):
+            heapq.heapify(heap)
+
+    def merge_sessions(self, ctx, key, window):
+        """Merge `window` with the sessions of `key` it overlaps, carrying
+        their aggregates over to the merged window.
+        """
+        start, end = window
+        kept, merged = [], []
+        for session in self.sessions.get(key, []):
+            if session[0] <= end and start <= session[1]:
+                merged.append(session)
+                start, end = min(start, session[0]), max(end, session[1])
+            else:
+                kept.append(session)
+        window = (start, end)
+        acc = None
+        for session in merged:
+            pane = self.panes[session]
+            other = pane.pop(key)
+            self.pane_count -= 1
+            if not pane:
+                self.remove_window(session)
+                self.fired.discard(session)
+            acc = other if acc is None else self.aggregator.merge(acc, other)
+        if acc is not None:
+            self.open_window(ctx, window)[key] = acc
+            self.pane_count += 1
+        kept.append(window)
+        self.sessions[key] = kept
+        return window
+
+    def close_next(self, ctx):
+        end, start = heapq.heappop(self.ends)
+        self.close_window(ctx, (start, end))
+
+    def close_window(self, ctx, window):
+        start, end = window
+        pane = self.remove_window(window)
+        if pane is None:
+            return
+        if self.closed_until is None or end > self.closed_until:
+            self.closed_until = end
+        self.pane_count -= len(pane)
+        fired = window in self.fired
+        self.fired.discard(window)
+        for key, acc in pane.iteritems():
+            if self.windows.merging:
+                self.forget_session(key, window)
+            if not fired:
+                self.process_window(ctx, key, window,
+                                    self.aggregator.result(acc))
+
+    def forget_session(self, key, window):
+        sessions = self.sessions.get(key)
+        if sessions is None:
+            return
+        sessions.remove(window)
+        if not sessions:
+            del self.sessions[key]
+
+    def fire(self, ctx, watermark):
+        """Close every window whose end plus allowed lateness is <=
+        `watermark`.
+        """
+        while self.ends and self.ends[0][0] + self.allowed_lateness <= \
+                watermark:
+            self.close_next(ctx)
+
+    def expire(self, ctx):
+        """Handle the window timer: close the windows past their deadline,
+        and the ones ending before them, unless the watermark advanced since
+        the timer was set, and set the timer for the next deadline.
+        """
+        watermark = ctx.watermark()
+        stalled = watermark is None or watermark == self.armed_watermark
+        self.armed = None
+        now = now_ms()
+        due = []
+        while self.deadlines and self.deadlines[0][0] <= now:
+            _, end, start = heapq.heappop(self.deadlines)
+            if (start, end) in self.panes:
+                due.append((end, start))
+        if stalled and due:
+            # Windows close in the order they end, even the ones whose
+            # deadline was pushed back.
+            last = max(due)[0]
+            for start, end in sorted(self.panes, key=lambda w: (w[1], w[0])):
+                if end <= last:
+                    self.close_window(ctx, (start, end))
+        else:
+            for end, start in sorted(due):
+                deadline = (now + self.windows.timeout((start, end)) +
+                            self.allowed_lateness)
+                heapq.heappush(self.deadlines, (deadline, end, start))
+        while self.deadlines and (self.deadlines[0][2],
+                                  self.deadlines[0][1]) not in self.panes:
+            heapq.heappop(self.deadlines)
+        if self.deadlines:
+            self.arm(ctx, self.deadlines[0][0])
+
+    def advance_watermark(self, ctx, watermark):
+        """Fire every window ending at or before `watermark`, and close those
+        past their allowed lateness.
+        """
+        while self.unfired and self.unfired[0][0] <= watermark:
+            end, start = heapq.heappop(self.unfired)
+            window = (start, end)
+            pane = self.panes.get(window)
+            if pane is None or window in self.fired:
+                continue
+            self.fired.add(window)
+            for key, acc in pane.iteritems():
+                self.process_window(ctx, key, window,
+                                    self.aggregator.result(acc))
+        self.fire(ctx, watermark)
+
+    def stats(self):
+        return {'open_windows': len(self.panes),
+                'open_panes': self.pane_count,
+                'late_records': self.late_records,
+                'late_updates': self.late_updates,
+                'evicted_windows': self.evicted_windows}
+
+class WindowedComputation:
+    """Mixin turning a `Computation` into a windowed aggregation, e.g.
+    `class Counts(WindowedComputation, Computation)`.
+
+    Subclasses set `windows` and `aggregator` and implement `process_window`.
+    Timers which do not close windows are handed to `process_user_timer`.
+    """
+    windows = None
+    aggregator = None
+    allowed_lateness = 0
+    max_panes = kDefaultMaxPanes
+
+    def window_operator(self):
+        if getattr(self, '_window_operator', None) is None:
+            self._window_operator = WindowOperator(
+                self.windows, self.aggregator, self.process_window,
+                allowed_lateness=self.allowed_lateness,
+                max_panes=self.max_panes,
+                process_late=self.process_late_record)
+        return self._window_operator
+
+    def event_time(self, record):
+        """The event time of a record, in ms."""
+        return event_time(record)
+
+    def window_key(self, record):
+        """The key windows are aggregated by."""
+        return record.key
+
+    def process_record(self, ctx, record):
+        self.window_operator().add(ctx, self.window_key(record),
+                                   self.event_time(record), record)
+
+    def process_timer(self, ctx, key, time):
+        if key == kWindowTimerKey:
+            self.window_operator().expire(ctx)
+        else:
+            self.process_user_timer(ctx, key, time)
+
+    def process_watermark(self, ctx, watermark):
+        self.window_operator().advance_watermark(ctx, watermark)
+
+    def process_window(self, ctx, key, window, result):
+        """Handle the final aggregate of `key` in a closed window.
+        :param window: The (start, end) event times of the window, in ms.
+        :type window: (int, int).
+        """
+        raise Exception('process_window not implemented')
+
+    def process_late_record(self, ctx, key, record):
+        """Handle a record whose windows were all closed already."""
+        pass
+
+    def process_user_timer(self, ctx, key, time):
+        raise Exception('process_timer not implemented')
@@ -24,5 +24,6 @@ setup(version='0.3.6',
       packages=find_packages(),
       url='http://concord.io',
       install_requires=reqs,
+      extras_require={'sketches': ['numpy']},
       test_suite="tests",
 )
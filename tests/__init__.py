@@ -0,0 +1,4 @@
+"""Tests for Concord
+.. module:: tests
+    :synopsis: End-to-end tests driving computations over real sockets
+"""
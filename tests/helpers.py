@@ -0,0 +1,76 @@
+"""Test helpers for Concord
+.. module:: helpers
+    :synopsis: Serve computations in process and drive them over sockets
+"""
+
+import time
+import unittest
+from concord.harness import (
+    Faults,
+    LocalProxy,
+    LocalProxyServer,
+    ComputationDriver,
+    serve_thread
+)
+from concord.timers import now_ms
+
+# How long to wait for a served computation to register, in seconds.
+kRegisterTimeout = 10
+
+class ComputationTestCase(unittest.TestCase):
+    """Serves computations in threads of the test process, behind a
+    `LocalProxyServer`, so that tests can drive them with a
+    `ComputationDriver` and inspect their handlers.
+    """
+
+    def setUp(self):
+        self.servers = []
+        self.drivers = []
+
+    def tearDown(self):
+        for driver in self.drivers:
+            driver.close()
+        for server in self.servers:
+            server.stop()
+
+    def serve(self, handler, faults=None):
+        """Serve `handler` and connect a driver to it.
+        :returns: (ComputationDriver, LocalProxy).
+        """
+        server = LocalProxyServer(LocalProxy(faults or Faults()))
+        self.servers.append(server)
+        address = server.start()
+        _, port = serve_thread(handler, address)
+        # serve_thread passes the addresses through the environment: wait
+        # until they were read before serving another computation.
+        self.assertTrue(server.proxy.registered.wait(kRegisterTimeout))
+        driver = ComputationDriver('127.0.0.1', port)
+        self.drivers.append(driver)
+        return driver, server.proxy
+
+def records_of(transactions):
+    """The records of a transaction or list of transactions, in order."""
+    if not isinstance(transactions, list):
+        transactions = [transactions]
+    return [record for transaction in transactions
+            for record in transaction.records or []]
+
+def fire_timers(driver, timers, until=None):
+    """Fire the framework timers returned by a computation as they come due,
+    until none is left or `until` (in ms) is reached, like the proxy would.
+    :param timers: The pending timers, by key.
+    :type timers: dict(str, int).
+    :returns: list(ComputationTx). The transactions of the fired timers.
+    """
+    timers = dict(timers)
+    transactions = []
+    while timers:
+        key, deadline = min(timers.iteritems(), key=lambda timer: timer[1])
+        if until is not None and deadline > until:
+            break
+        del timers[key]
+        time.sleep(max(0, deadline - now_ms()) / 1000.0)
+        transaction = driver.process_timer(key, deadline)
+        transactions.append(transaction)
+        timers.update(transaction.timers or {})
+    return transactions
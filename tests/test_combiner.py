@@ -0,0 +1,59 @@
+import operator
+import unittest
+from concord.computation import Computation, Metadata
+from concord.errors import ErrorPolicy, ErrorAction
+from concord.output import OutputLimit
+from concord.partition import HashRing, split
+from concord.internal.thrift.ttypes import Record, BackPressure
+from tests.helpers import ComputationTestCase, records_of
+
+class WordCount(Computation):
+    """Counts words per batch, partitioned over 'counts', failing on the
+    first attempt of every word in `flaky`.
+    """
+
+    def __init__(self, limits=None, flaky=(), retries=0):
+        self.limits = limits
+        self.flaky = set(flaky)
+        self.retries = retries
+
+    def metadata(self):
+        return Metadata(name='wordcount', istreams=['in'],
+                        ostreams=[('counts', HashRing(range(4)))],
+                        output_limits=self.limits,
+                        error_policy=ErrorPolicy(ErrorAction.SKIP,
+                                                 retries=self.retries))
+
+    def process_record(self, ctx, record):
+        ctx.combine('counts', record.data, 1, operator.add)
+        if record.data in self.flaky:
+            self.flaky.discard(record.data)
+            raise Exception("Injected failure")
+
+def words(*values):
+    return [Record(key='', data=value, userStream='in') for value in values]
+
+class CombinerTest(ComputationTestCase):
+
+    def test_flushed_records_are_partitioned(self):
+        driver, _ = self.serve(WordCount())
+        records = records_of(driver.process_records(words('a', 'b', 'a')))
+        ring = HashRing(range(4))
+        self.assertEqual([((ring.node('a'), 'a'), '2'),
+                          ((ring.node('b'), 'b'), '1')],
+                         [(split(r.key), r.data) for r in records])
+
+    def test_flushed_records_respect_output_limits(self):
+        limits = {'counts': OutputLimit(2, BackPressure.DROP_TAIL)}
+        driver, _ = self.serve(WordCount(limits=limits))
+        records = records_of(driver.process_records(words('a', 'b', 'c')))
+        self.assertEqual(['a', 'b'], [split(r.key)[1] for r in records])
+
+    def test_retried_records_are_combined_once(self):
+        driver, _ = self.serve(WordCount(flaky=['a'], retries=1))
+        records = records_of(driver.process_records(words('a', 'b', 'a')))
+        self.assertEqual([('a', '2'), ('b', '1')],
+                         [(split(r.key)[1], r.data) for r in records])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+import unittest
+from concord.computation import Computation, Metadata
+from concord.dedupe import Deduplicator, timer_id
+from concord import envelope
+from concord.internal.thrift.ttypes import Record, RecordMetadata
+from tests.helpers import ComputationTestCase, records_of
+
+class Echo(Computation):
+    """Echoes the payload of every new record."""
+
+    def metadata(self):
+        return Metadata(name='echo', istreams=['in'], ostreams=['out'],
+                        dedupe=Deduplicator())
+
+    def process_record(self, ctx, record):
+        ctx.produce_record('out', record.key, record.data)
+
+def traced(key, data):
+    """A record sharing its trace, span and time with its siblings."""
+    return Record(key=key, data=data, userStream='in', time=1000,
+                  meta=RecordMetadata(traceId=11, sourceSpanId=22))
+
+class DedupeTest(ComputationTestCase):
+
+    def test_sibling_records_are_not_duplicates(self):
+        driver, _ = self.serve(Echo())
+        records = [traced('a', '1'), traced('b', '1'), traced('a', '2')]
+        transactions = driver.process_records(records)
+        self.assertEqual(['1', '1', '2'],
+                         [r.data for r in records_of(transactions)])
+        self.assertEqual(3, len(set(t.id for t in transactions)))
+
+    def test_envelope_records_are_not_duplicates(self):
+        driver, _ = self.serve(Echo())
+        packed = traced('a', envelope.pack(['x', 'x', 'y']))
+        transactions = driver.process_records([packed])
+        self.assertEqual(1, len(transactions))
+        self.assertEqual(['x', 'x', 'y'],
+                         [r.data for r in records_of(transactions)])
+
+    def test_redelivered_records_are_skipped(self):
+        driver, _ = self.serve(Echo())
+        records = [traced('a', '1'), traced('b', '1')]
+        driver.process_records(records)
+        transactions = driver.process_records(records)
+        self.assertEqual([], records_of(transactions))
+
+    def test_identical_records_of_a_span_are_not_duplicates(self):
+        driver, _ = self.serve(Echo())
+        transactions = driver.process_records([traced('word', '1')] * 3)
+        self.assertEqual(['1', '1', '1'],
+                         [r.data for r in records_of(transactions)])
+        self.assertEqual(3, len(set(t.id for t in transactions)))
+
+    def test_untraced_records_are_never_skipped(self):
+        driver, _ = self.serve(Echo())
+        records = [Record(key='a', data='1', userStream='in')]
+        driver.process_records(records)
+        transactions = driver.process_records(records)
+        self.assertEqual(['1'], [r.data for r in records_of(transactions)])
+
+    def test_exact_by_default(self):
+        dedupe = Deduplicator(lru_size=1)
+        self.assertTrue(dedupe.exact)
+        self.assertIsNone(dedupe.filter)
+        self.assertFalse(dedupe.seen(1))
+        self.assertFalse(dedupe.seen(2))
+        self.assertFalse(dedupe.seen(1))
+        self.assertTrue(dedupe.seen(1))
+
+    def test_unicode_ids(self):
+        self.assertEqual(timer_id('caf\xc3\xa9', 5), timer_id(u'caf\xe9', 5))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+import unittest
+from concord.computation import Computation, Metadata
+from concord import envelope
+from concord.internal.thrift.ttypes import Record
+from tests.helpers import ComputationTestCase
+
+class Split(Computation):
+    """Produces every character of its input on its own record, in
+    envelopes.
+    """
+
+    def metadata(self):
+        return Metadata(name='split', istreams=['in'], ostreams=['out'],
+                        envelopes=True)
+
+    def process_record(self, ctx, record):
+        for char in record.data:
+            ctx.produce_record('out', record.key, char)
+
+class EnvelopeTest(ComputationTestCase):
+
+    def test_transactions_keep_their_records(self):
+        driver, _ = self.serve(Split())
+        transactions = driver.process_records(
+            [Record(key='k', data=data, userStream='in')
+             for data in ['ab', 'cde', 'f']])
+        self.assertEqual([1, 1, 1], [len(t.records) for t in transactions])
+        self.assertEqual([['a', 'b'], ['c', 'd', 'e'], ['f']],
+                         [[r.data for r in envelope.unpack_records(t.records)]
+                          for t in transactions])
+
+    def test_one_transaction_per_wire_record(self):
+        driver, _ = self.serve(Split())
+        transactions = driver.process_records(
+            [Record(key='k', data=envelope.pack(['ab', 'c', 'de']),
+                    userStream='in'),
+             Record(key='k', data='fg', userStream='in')])
+        self.assertEqual(2, len(transactions))
+        self.assertEqual([['a', 'b', 'c', 'd', 'e'], ['f', 'g']],
+                         [[r.data for r in envelope.unpack_records(t.records)]
+                          for t in transactions])
+        self.assertNotEqual(transactions[0].id, transactions[1].id)
+
+    def test_malformed_envelopes_pass_through(self):
+        driver, _ = self.serve(Split())
+        truncated = envelope.pack(['xy', 'z'])[:-2]
+        transactions = driver.process_records(
+            [Record(key='k', data=truncated, userStream='in'),
+             Record(key='k', data='ok', userStream='in')])
+        self.assertEqual(2, len(transactions))
+        unpacked = envelope.unpack_records(transactions[0].records)
+        self.assertEqual(list(truncated), [r.data for r in unpacked])
+        unpacked = envelope.unpack_records(transactions[1].records)
+        self.assertEqual(['o', 'k'], [r.data for r in unpacked])
+
+if __name__ == '__main__':
+    unittest.main()
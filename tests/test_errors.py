@@ -0,0 +1,84 @@
+import unittest
+from concord.computation import Computation, Metadata
+from concord.errors import ErrorPolicy, ErrorAction, parse_dead_letter
+from concord.internal.thrift.ttypes import Record
+from tests.helpers import ComputationTestCase, records_of
+
+def broken_partitioner(key, data):
+    raise Exception("Broken partitioner")
+
+class Poisoned(Computation):
+    """Echoes its records, failing on the ones whose payload is 'bad' and
+    on watermarks past `bad_watermark`.
+    """
+
+    def __init__(self, policy, dead_stream='dead', bad_watermark=None):
+        self.policy = policy
+        self.dead_stream = dead_stream
+        self.bad_watermark = bad_watermark
+
+    def metadata(self):
+        return Metadata(name='poisoned', istreams=['in'],
+                        ostreams=['out', self.dead_stream],
+                        error_policy=self.policy)
+
+    def process_record(self, ctx, record):
+        if record.data == 'bad':
+            raise Exception("Poison record")
+        ctx.produce_record('out', record.key, record.data)
+
+    def process_watermark(self, ctx, watermark):
+        if self.bad_watermark is not None and watermark > self.bad_watermark:
+            raise Exception("Poison watermark")
+
+def inputs(*payloads):
+    return [Record(key='k', data=data, userStream='in', time=100 + i)
+            for i, data in enumerate(payloads)]
+
+class ErrorPolicyTest(ComputationTestCase):
+
+    def dead_letter_policy(self):
+        return ErrorPolicy(ErrorAction.DEAD_LETTER, retries=1,
+                           dead_letter_stream='dead')
+
+    def test_skip(self):
+        driver, _ = self.serve(Poisoned(ErrorPolicy(ErrorAction.SKIP)))
+        transactions = driver.process_records(inputs('a', 'bad', 'b'))
+        self.assertEqual(3, len(transactions))
+        self.assertEqual(['a', 'b'],
+                         [r.data for r in records_of(transactions)])
+
+    def test_dead_letter(self):
+        driver, _ = self.serve(Poisoned(self.dead_letter_policy()))
+        transactions = driver.process_records(inputs('a', 'bad', 'b'))
+        self.assertEqual([['out'], ['dead'], ['out']],
+                         [[r.userStream for r in t.records]
+                          for t in transactions])
+        letter = parse_dead_letter(transactions[1].records[0].data)
+        self.assertEqual(('process_record', 'in', 'k', 'bad'),
+                         (letter['handler'], letter['stream'], letter['key'],
+                          letter['data']))
+        self.assertIn('Poison record', letter['error'])
+
+    def test_dead_letter_failing_watermark(self):
+        driver, _ = self.serve(Poisoned(self.dead_letter_policy(),
+                                        bad_watermark=100))
+        transactions = driver.process_records(inputs('a', 'b'))
+        self.assertEqual(['out'], [r.userStream for r in
+                                   transactions[0].records])
+        self.assertEqual(['out', 'dead'], [r.userStream for r in
+                                           transactions[1].records])
+        letter = parse_dead_letter(transactions[1].records[1].data)
+        self.assertEqual(('process_watermark', '101'),
+                         (letter['handler'], letter['data']))
+
+    def test_inputs_which_cannot_be_dead_lettered_are_skipped(self):
+        driver, _ = self.serve(Poisoned(
+            self.dead_letter_policy(),
+            dead_stream=('dead', broken_partitioner)))
+        transactions = driver.process_records(inputs('bad', 'a'))
+        self.assertEqual([[], ['a']], [[r.data for r in t.records]
+                                       for t in transactions])
+
+if __name__ == '__main__':
+    unittest.main()
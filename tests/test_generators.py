@@ -0,0 +1,67 @@
+import unittest
+from concord.computation import Computation, Metadata
+from concord.errors import ErrorPolicy, ErrorAction
+from concord.internal.thrift.ttypes import Record
+from tests.helpers import ComputationTestCase, records_of
+
+class Yielding(Computation):
+    """Yields `int(data)` records per input, failing after the first one
+    if the key is 'bad', and one record per timer.
+    """
+
+    def __init__(self, spill_threshold=None):
+        self.spill_threshold = spill_threshold
+        self.closed = 0
+
+    def metadata(self):
+        return Metadata(name='yielding', istreams=['in'], ostreams=['out'],
+                        spill_threshold=self.spill_threshold,
+                        error_policy=ErrorPolicy(ErrorAction.SKIP))
+
+    def process_record(self, ctx, record):
+        try:
+            for i in xrange(int(record.data)):
+                yield ('out', record.key, str(i))
+                if record.key == 'bad':
+                    raise Exception("Injected failure")
+        finally:
+            self.closed += 1
+
+    def process_timer(self, ctx, key, time):
+        yield ('out', key, str(time))
+
+class GeneratorHandlerTest(ComputationTestCase):
+
+    def test_yielded_records_are_produced(self):
+        driver, _ = self.serve(Yielding())
+        transactions = driver.process_records(
+            [Record(key='k', data='3', userStream='in')])
+        self.assertEqual([('out', 'k', str(i)) for i in xrange(3)],
+                         [(r.userStream, r.key, r.data)
+                          for r in records_of(transactions)])
+
+    def test_yielded_timer_records_are_produced(self):
+        driver, _ = self.serve(Yielding())
+        transaction = driver.process_timer('t', 5)
+        self.assertEqual([('t', '5')],
+                         [(r.key, r.data) for r in transaction.records])
+
+    def test_yielded_records_are_spilled(self):
+        driver, _ = self.serve(Yielding(spill_threshold=4))
+        transactions = driver.process_records(
+            [Record(key='k', data='50', userStream='in')])
+        self.assertEqual([str(i) for i in xrange(50)],
+                         [r.data for r in records_of(transactions)])
+
+    def test_failing_generators_are_closed_and_rolled_back(self):
+        handler = Yielding()
+        driver, _ = self.serve(handler)
+        transactions = driver.process_records(
+            [Record(key='bad', data='3', userStream='in'),
+             Record(key='k', data='1', userStream='in')])
+        self.assertEqual([[], ['k']], [[r.key for r in t.records]
+                                       for t in transactions])
+        self.assertEqual(2, handler.closed)
+
+if __name__ == '__main__':
+    unittest.main()
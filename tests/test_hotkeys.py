@@ -0,0 +1,85 @@
+import random
+import unittest
+from concord.computation import Computation, Metadata
+from concord.hotkeys import SpaceSaving, HotKeys, salt, unsalt
+from concord.internal.thrift.ttypes import Record
+from tests.helpers import ComputationTestCase, records_of
+
+class SpaceSavingTest(unittest.TestCase):
+
+    def test_bounds_match_exact_counts(self):
+        rng = random.Random(45)
+        keys = ['key-%d' % int(rng.paretovariate(1.1)) for _ in xrange(20000)]
+        sketch = SpaceSaving(capacity=32)
+        counts = {}
+        for key in keys:
+            sketch.add(key)
+            counts[key] = counts.get(key, 0) + 1
+        self.assertEqual(32, len(sketch.counts))
+        for key, count in counts.iteritems():
+            if count > len(keys) / 32:
+                estimate = sketch.estimate(key)
+                self.assertGreaterEqual(estimate, count)
+                self.assertLessEqual(estimate - sketch.error(key), count)
+        heaviest = max(counts, key=counts.get)
+        self.assertEqual(heaviest, sketch.top(1)[0][0])
+
+class HotKeysTest(unittest.TestCase):
+
+    def route(self, hot_keys, stream='s'):
+        return [hot_keys.route(stream, 'hot' if i % 2 else 'cold-%d' % i)
+                for i in xrange(400)]
+
+    def test_hot_keys_are_reported_not_salted_by_default(self):
+        hot_keys = HotKeys(threshold=0.1, min_records=100)
+        routed = self.route(hot_keys)
+        self.assertEqual(200, routed.count('hot'))
+        self.assertTrue(hot_keys.is_hot('s', 'hot'))
+        self.assertFalse(hot_keys.is_hot('s', 'cold-0'))
+        self.assertEqual([('hot', 200)], hot_keys.top('s', 1))
+
+    def test_hot_keys_are_salted_once_hot(self):
+        hot_keys = HotKeys(threshold=0.1, salts=4, min_records=100)
+        routed = [key for key in self.route(hot_keys)
+                  if unsalt(key) == 'hot']
+        self.assertEqual(200, len(routed))
+        self.assertTrue(all(key == 'hot' for key in routed[:49]))
+        self.assertEqual(set(salt('hot', i) for i in xrange(4)),
+                         set(routed[50:]))
+
+    def test_salt_streams(self):
+        hot_keys = HotKeys(threshold=0.1, salts=4, salt_streams=['a'],
+                           min_records=100)
+        self.assertEqual(200, self.route(hot_keys, 'b').count('hot'))
+        self.assertLess(self.route(hot_keys, 'a').count('hot'), 200)
+
+    def test_unsalt(self):
+        self.assertEqual('k', unsalt(salt('k', 3)))
+        self.assertEqual('k', unsalt('k'))
+        self.assertIsNone(unsalt(None))
+
+class Skewed(Computation):
+    """Forwards its records to 'out', salting hot keys."""
+
+    def metadata(self):
+        return Metadata(name='skewed', istreams=['in'], ostreams=['out'],
+                        hot_keys=HotKeys(threshold=0.2, salts=2,
+                                         min_records=10))
+
+    def process_record(self, ctx, record):
+        ctx.produce_record('out', record.key, record.data)
+
+class HotKeysComputationTest(ComputationTestCase):
+
+    def test_produced_hot_keys_are_salted(self):
+        driver, _ = self.serve(Skewed())
+        transactions = driver.process_records(
+            [Record(key='hot' if i % 2 else str(i), data='', userStream='in')
+             for i in xrange(40)])
+        keys = [r.key for r in records_of(transactions)]
+        self.assertEqual(20, len([k for k in keys if unsalt(k) == 'hot']))
+        self.assertEqual(set(['hot', salt('hot', 0), salt('hot', 1)]),
+                         set(k for k in keys if unsalt(k) == 'hot'))
+
+if __name__ == '__main__':
+    unittest.main()
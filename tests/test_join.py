@@ -0,0 +1,68 @@
+import unittest
+from concord.computation import Computation, Metadata
+from concord.join import WindowedJoinComputation
+from concord.timers import now_ms
+from concord.internal.thrift.ttypes import Record
+from tests.helpers import ComputationTestCase, records_of, fire_timers
+
+kHourMs = 3600 * 1000
+
+class Enrich(WindowedJoinComputation, Computation):
+    """Joins 'clicks' with the 'views' of the same key."""
+    left_stream = 'views'
+    right_stream = 'clicks'
+    join_window = 100
+
+    def __init__(self, istreams=['views', 'clicks']):
+        self.istreams = istreams
+
+    def metadata(self):
+        return Metadata(name='enrich', istreams=self.istreams,
+                        ostreams=['out'])
+
+    def process_join(self, ctx, key, left, right):
+        ctx.produce_record('out', key, left.data + right.data)
+
+class JoinTest(ComputationTestCase):
+
+    def test_old_in_order_records(self):
+        handler = Enrich()
+        driver, _ = self.serve(handler)
+        start = now_ms() - kHourMs
+        outputs = []
+        for i in xrange(10):
+            key = 'k%d' % i
+            for stream, data, offset in [('views', 'v', 0), ('clicks', 'c', 5)]:
+                transactions = driver.process_records(
+                    [Record(key=key, data=data, userStream=stream,
+                            time=start + i * 10 + offset)])
+                timers = {}
+                for transaction in transactions:
+                    outputs.extend(records_of(transaction))
+                    timers.update(transaction.timers)
+                outputs.extend(records_of(fire_timers(driver, timers,
+                                                      until=now_ms())))
+        self.assertEqual(['k%d' % i for i in xrange(10)],
+                         [r.key for r in outputs])
+        self.assertEqual(set(['vc']), set(r.data for r in outputs))
+        stats = handler.stream_join().stats()
+        self.assertEqual(0, stats['late_records'])
+        self.assertEqual(10, stats['joined'])
+
+    def test_buffers_evicted_without_watermark(self):
+        handler = Enrich(istreams=['views', 'clicks', 'idle'])
+        driver, _ = self.serve(handler)
+        start = now_ms() - kHourMs
+        transactions = driver.process_records(
+            [Record(key='k', data='v', userStream='views', time=start + i)
+             for i in xrange(5)])
+        timers = {}
+        for transaction in transactions:
+            timers.update(transaction.timers)
+        fire_timers(driver, timers)
+        stats = handler.stream_join().stats()
+        self.assertEqual(0, stats['left_buffered'])
+        self.assertEqual(5, stats['evicted'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,118 @@
+import unittest
+from concord.computation import Computation, Metadata
+from concord.local import LocalTopology
+from concord.partition import HashRing
+from concord.timers import now_ms
+from concord.internal.thrift.ttypes import StreamGrouping
+
+class Split(Computation):
+    """Splits sentences into words, spilling large sentences."""
+
+    def metadata(self):
+        return Metadata(name='split', istreams=['sentences'],
+                        ostreams=['words'], spill_threshold=4)
+
+    def process_record(self, ctx, record):
+        for word in record.data.split():
+            ctx.produce_record('words', word, '')
+
+class Count(Computation):
+    """Counts words in state, producing each new count."""
+
+    def metadata(self):
+        return Metadata(name='count',
+                        istreams=[('words', StreamGrouping.GROUP_BY)],
+                        ostreams=['counts'])
+
+    def process_record(self, ctx, record):
+        count = int(ctx.get_state(record.key) or 0) + 1
+        ctx.set_state(record.key, str(count))
+        ctx.produce_record('counts', record.key, str(count))
+
+class Delay(Computation):
+    """Forwards its records once a timer 20ms later fires."""
+
+    def metadata(self):
+        return Metadata(name='delay', istreams=['in'], ostreams=['delayed'])
+
+    def process_record(self, ctx, record):
+        ctx.set_timer(record.data, now_ms() + 20)
+
+    def process_timer(self, ctx, key, time):
+        ctx.produce_record('delayed', key, '')
+
+class Partitioner(Computation):
+    """Forwards 'in' to 'parts', partitioned over 3 instances."""
+
+    def metadata(self):
+        return Metadata(name='partitioner', istreams=['in'],
+                        ostreams=[('parts', HashRing(range(3)))])
+
+    def process_record(self, ctx, record):
+        ctx.produce_record('parts', record.key, '')
+
+class Part(Computation):
+    """Keeps and produces the key of its records."""
+
+    def __init__(self):
+        self.seen = []
+
+    def metadata(self):
+        return Metadata(name='part',
+                        istreams=[('parts', StreamGrouping.CUSTOM)],
+                        ostreams=['seen'])
+
+    def process_record(self, ctx, record):
+        self.seen.append(record.key)
+        ctx.produce_record('seen', record.key, '')
+
+class LocalTopologyTest(unittest.TestCase):
+
+    def test_word_count(self):
+        topology = LocalTopology([Split(), Count()], instances={'count': 3},
+                                 seed=49)
+        self.addCleanup(topology.destroy)
+        for sentence in ['a b c a', 'b a d e f g', 'a']:
+            topology.push('sentences', None, sentence)
+        topology.run()
+        counts = {}
+        for record in topology.sinks['counts']:
+            counts[record.key] = max(counts.get(record.key, 0),
+                                     int(record.data))
+        self.assertEqual({'a': 4, 'b': 2, 'c': 1, 'd': 1, 'e': 1, 'f': 1,
+                          'g': 1}, counts)
+        # Each word is counted by a single instance.
+        owners = [set(i.state.values) for i in topology.instances['count']]
+        self.assertEqual(7, sum(len(keys) for keys in owners))
+        stats = topology.stats()
+        self.assertEqual((3, 11), (stats['count']['instances'],
+                                   stats['count']['records']))
+
+    def test_timers_fire(self):
+        topology = LocalTopology([Delay()])
+        self.addCleanup(topology.destroy)
+        topology.push('in', 'k', 'later')
+        topology.run()
+        self.assertNotIn('delayed', topology.sinks)
+        topology.run(duration_ms=200)
+        self.assertEqual(['later'],
+                         [r.key for r in topology.sinks['delayed']])
+
+    def test_custom_grouping_follows_partitions(self):
+        topology = LocalTopology([Partitioner(), Part()],
+                                 instances={'part': 3})
+        self.addCleanup(topology.destroy)
+        keys = ['key-%d' % i for i in xrange(30)]
+        for key in keys:
+            topology.push('in', key, '')
+        topology.run()
+        ring = HashRing(range(3))
+        for instance in topology.instances['part']:
+            seen = instance.wrapper.handler.seen
+            self.assertEqual([instance.index] * len(seen),
+                             [ring.node(key) for key in seen])
+        self.assertEqual(sorted(keys),
+                         sorted(r.key for r in topology.sinks['seen']))
+
+if __name__ == '__main__':
+    unittest.main()
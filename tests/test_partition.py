@@ -0,0 +1,92 @@
+import unittest
+from concord.computation import Computation, Metadata
+from concord.partition import HashRing, stamp, split
+from concord.internal.thrift.ttypes import (
+    Record,
+    StreamGrouping,
+    StreamMetadata,
+    TopologyMetadata,
+    PhysicalComputationLayout,
+    PhysicalComputationMetadata
+)
+from tests.helpers import ComputationTestCase, records_of
+
+def keys(count):
+    return ['key-%d' % i for i in xrange(count)]
+
+class HashRingTest(unittest.TestCase):
+
+    def test_needs_nodes(self):
+        self.assertRaises(Exception, HashRing, [])
+
+    def test_adding_a_node_only_moves_keys_to_it(self):
+        ring = HashRing(range(4))
+        before = dict((key, ring.node(key)) for key in keys(1000))
+        ring.add(4)
+        moved = [key for key in before if ring.node(key) != before[key]]
+        self.assertTrue(moved)
+        self.assertEqual(set([4]), set(ring.node(key) for key in moved))
+
+    def test_share_follows_weight(self):
+        ring = HashRing(['a', 'b'], replicas=256)
+        ring.set_weight('b', 3)
+        owners = [ring.node(key) for key in keys(4000)]
+        self.assertGreater(owners.count('b'), 2 * owners.count('a'))
+
+    def test_stamp_and_split(self):
+        self.assertEqual((3, 'k'), split(stamp(3, 'k')))
+        self.assertEqual((None, 'k'), split('k'))
+        self.assertEqual((None, None), split(None))
+
+def consumer(instances):
+    return PhysicalComputationLayout(
+        name='sink',
+        nodes=[PhysicalComputationMetadata(taskId='sink-%d' % i, killed=False)
+               for i in xrange(instances)],
+        istreams=[StreamMetadata(name='out', grouping=StreamGrouping.CUSTOM)])
+
+class Partitioned(Computation):
+    """Forwards 'in' to 'out', partitioned by `ring`, and 'custom' to
+    'plain', stripping the partition of its keys.
+    """
+
+    def __init__(self, ring):
+        self.ring = ring
+
+    def metadata(self):
+        return Metadata(name='partitioned',
+                        istreams=['in', ('custom', StreamGrouping.CUSTOM)],
+                        ostreams=[('out', self.ring), 'plain'])
+
+    def process_record(self, ctx, record):
+        stream = 'out' if record.userStream == 'in' else 'plain'
+        ctx.produce_record(stream, record.key, record.data)
+
+class PartitionTest(ComputationTestCase):
+
+    def partitions(self, driver):
+        transactions = driver.process_records(
+            [Record(key=key, data='', userStream='in') for key in keys(200)])
+        return set(split(r.key)[0] for r in records_of(transactions))
+
+    def test_fixed_ring_ignores_the_topology(self):
+        driver, _ = self.serve(Partitioned(HashRing(range(2))))
+        driver.update_topology(TopologyMetadata(
+            version=1, computations={'sink': consumer(5)}))
+        self.assertEqual(set([0, 1]), self.partitions(driver))
+
+    def test_auto_sized_ring_follows_the_topology(self):
+        driver, _ = self.serve(Partitioned(HashRing(range(2), auto_size=True)))
+        self.assertEqual(set([0, 1]), self.partitions(driver))
+        driver.update_topology(TopologyMetadata(
+            version=1, computations={'sink': consumer(5)}))
+        self.assertEqual(set(range(5)), self.partitions(driver))
+
+    def test_custom_istreams_are_stripped(self):
+        driver, _ = self.serve(Partitioned(HashRing(range(2))))
+        transactions = driver.process_records(
+            [Record(key=stamp(1, 'k'), data='', userStream='custom')])
+        self.assertEqual(['k'], [r.key for r in records_of(transactions)])
+
+if __name__ == '__main__':
+    unittest.main()
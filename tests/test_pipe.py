@@ -0,0 +1,98 @@
+import threading
+import unittest
+from thrift.transport import TSocket, TTransport
+from thrift.server import TServer
+from thrift.protocol import TBinaryProtocol
+from concord.computation import Computation, Metadata
+from concord.harness import free_port, LocalProxyServer
+from concord.pipe import DirectDispatch
+from concord.timers import now_ms
+from concord.internal.thrift import BoltPipeService
+from concord.internal.thrift.ttypes import (
+    Record,
+    Endpoint,
+    StreamGrouping,
+    StreamMetadata,
+    TopologyMetadata,
+    ExecutorTaskInfoHelper,
+    PhysicalComputationLayout,
+    PhysicalComputationMetadata
+)
+from tests.helpers import ComputationTestCase, records_of
+
+class Pipe(BoltPipeService.Iface):
+    """Collects the records dispatched to it."""
+
+    def __init__(self):
+        self.records = []
+
+    def dispatchRecords(self, records):
+        self.records.extend(records)
+
+def serve_pipe(pipe, port):
+    transport = TSocket.TServerSocket(host='127.0.0.1', port=port)
+    server = TServer.TThreadedServer(
+        BoltPipeService.Processor(pipe), transport,
+        TTransport.TFramedTransportFactory(),
+        TBinaryProtocol.TBinaryProtocolAcceleratedFactory(), daemon=True)
+    transport.listen()
+    thread = threading.Thread(target=server.serve)
+    thread.daemon = True
+    thread.start()
+    return transport
+
+class Forward(Computation):
+    """Forwards its input to 'out', dispatched directly."""
+
+    def metadata(self):
+        return Metadata(name='forward', istreams=['in'], ostreams=['out'],
+                        direct_dispatch=DirectDispatch(['out']))
+
+    def process_record(self, ctx, record):
+        ctx.produce_record('out', record.key, record.data)
+
+class DirectDispatchTest(ComputationTestCase):
+
+    def serve_sink(self, port):
+        """Serve `Forward`, with 'out' consumed by a 'sink' listening on
+        `port`.
+        """
+        driver, _ = self.serve(Forward())
+        node = PhysicalComputationMetadata(
+            taskId='sink-0', killed=False,
+            taskHelper=ExecutorTaskInfoHelper(
+                proxy=Endpoint(ip='127.0.0.1', port=port)))
+        driver.update_topology(TopologyMetadata(version=1, computations={
+            'sink': PhysicalComputationLayout(
+                name='sink', nodes=[node],
+                istreams=[StreamMetadata(name='out',
+                                         grouping=StreamGrouping.SHUFFLE)])}))
+        return driver
+
+    def test_dispatched_records_are_stamped(self):
+        pipe = Pipe()
+        port = free_port()
+        transport = serve_pipe(pipe, port)
+        self.addCleanup(transport.close)
+        driver = self.serve_sink(port)
+        start = now_ms()
+        transactions = driver.process_records(
+            [Record(key='k', data=str(i), userStream='in') for i in xrange(3)])
+        self.assertEqual([], records_of(transactions))
+        self.assertEqual(['0', '1', '2'], [r.data for r in pipe.records])
+        self.assertTrue(all(r.time >= start for r in pipe.records))
+
+    def test_endpoints_without_pipe_service_fall_back_to_the_proxy(self):
+        server = LocalProxyServer()
+        _, port = server.start()
+        self.addCleanup(server.stop)
+        driver = self.serve_sink(port)
+        for _ in xrange(2):
+            transactions = driver.process_records(
+                [Record(key='k', data=str(i), userStream='in')
+                 for i in xrange(3)])
+            self.assertEqual(['0', '1', '2'],
+                             [r.data for r in records_of(transactions)])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+import unittest
+from concord.computation import Computation, Metadata
+from concord.pipeline import Pipeline, PipelineComputation
+from concord.internal.thrift.ttypes import Record
+from tests.helpers import ComputationTestCase, records_of
+
+class Words(PipelineComputation, Computation):
+    """Emits the words of each line longer than three letters, keyed by
+    the word.
+    """
+    pipeline = Pipeline().map(lambda r: r.data.lower()) \
+                         .flat_map(lambda line: line.split()) \
+                         .filter(lambda word: len(word) > 3) \
+                         .key_by(lambda word: word) \
+                         .to('words')
+
+    def metadata(self):
+        return Metadata(name='words', istreams=['in'], ostreams=['words'])
+
+class Collector:
+    """A context collecting the records produced on it."""
+
+    def __init__(self):
+        self.records = []
+
+    def produce_record(self, stream, key, data):
+        self.records.append((stream, key, data))
+
+class PipelineTest(unittest.TestCase):
+
+    def test_stages_run_in_order(self):
+        pipeline = Pipeline().filter(lambda r: r.data) \
+                             .map(lambda r: len(r.data)) \
+                             .to('lengths')
+        ctx = Collector()
+        for data in ['abc', '', 'de']:
+            pipeline.run(ctx, Record(key='k', data=data))
+        self.assertEqual([('lengths', 'k', '3'), ('lengths', 'k', '2')],
+                         ctx.records)
+
+    def test_stages_added_after_running_apply(self):
+        pipeline = Pipeline().to('out')
+        ctx = Collector()
+        pipeline.run(ctx, Record(key='k', data='a'))
+        pipeline.map(lambda r: r.data * 2)
+        pipeline.run(ctx, Record(key='k', data='b'))
+        self.assertEqual('bb', ctx.records[-1][2])
+
+    def test_needs_an_output_stream(self):
+        self.assertRaises(Exception, Pipeline().run, Collector(),
+                          Record(key='k', data=''))
+
+class PipelineComputationTest(ComputationTestCase):
+
+    def test_fused_pipeline(self):
+        driver, _ = self.serve(Words())
+        transactions = driver.process_records(
+            [Record(key='l1', data='The quick brown Fox', userStream='in'),
+             Record(key='l2', data='a b c', userStream='in')])
+        self.assertEqual(2, len(transactions))
+        self.assertEqual([('quick', 'quick'), ('brown', 'brown')],
+                         [(r.key, r.data) for r in records_of(transactions)])
+
+if __name__ == '__main__':
+    unittest.main()
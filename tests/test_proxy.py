@@ -0,0 +1,64 @@
+import threading
+import time
+import unittest
+from concord.harness import LocalProxyServer
+from concord.proxy import ProxyClientPool
+
+class ExclusiveClient:
+    """A client failing when two threads use it at once."""
+
+    def __init__(self, host, port):
+        self.busy = threading.Lock()
+        self.stats = {'calls': 0}
+
+    def getState(self, key):
+        if not self.busy.acquire(False):
+            raise Exception("Client used concurrently")
+        try:
+            self.stats['calls'] += 1
+            time.sleep(0.001)
+            return key
+        finally:
+            self.busy.release()
+
+def run_threads(count, target):
+    threads = [threading.Thread(target=target, args=(i,))
+               for i in xrange(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+class ProxyClientPoolTest(unittest.TestCase):
+
+    def test_clients_are_used_by_one_thread_at_a_time(self):
+        pool = ProxyClientPool('127.0.0.1', 0, size=3, factory=ExclusiveClient)
+        results = []
+        def work(i):
+            for j in xrange(20):
+                results.append(pool.getState('%d-%d' % (i, j)))
+        run_threads(8, work)
+        self.assertEqual(160, len(set(results)))
+        usage = pool.usage()
+        self.assertEqual((3, 160, 160), (usage['open'], usage['checkouts'],
+                                         usage['calls']))
+        self.assertGreater(usage['waits'], 0)
+
+    def test_concurrent_state_calls(self):
+        server = LocalProxyServer()
+        host, port = server.start()
+        self.addCleanup(server.stop)
+        pool = ProxyClientPool(host, port, size=2)
+        read = []
+        def work(i):
+            for j in xrange(10):
+                key = '%d-%d' % (i, j)
+                pool.setState(key, str(j))
+                read.append(pool.getState(key) == str(j))
+        run_threads(4, work)
+        self.assertEqual([True] * 40, read)
+        self.assertEqual(40, len(server.proxy.state))
+        self.assertLessEqual(pool.usage()['open'], 2)
+
+if __name__ == '__main__':
+    unittest.main()
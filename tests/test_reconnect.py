@@ -0,0 +1,72 @@
+import unittest
+from concord.computation import Computation, Metadata
+from concord.errors import ErrorPolicy, ErrorAction, parse_dead_letter
+from concord.harness import Faults
+from concord.internal.thrift.ttypes import Record
+from tests.helpers import ComputationTestCase, records_of
+
+class Counter(Computation):
+    """Counts the records of every key in the state of the proxy."""
+
+    def __init__(self, async_state=False, error_policy=None):
+        self.async_state = async_state
+        self.error_policy = error_policy
+
+    def metadata(self):
+        return Metadata(name='counter', istreams=['in'],
+                        ostreams=['out', 'dead'], async_state=self.async_state,
+                        error_policy=self.error_policy)
+
+    def process_record(self, ctx, record):
+        count = int(ctx.get_state(record.key) or 0) + 1
+        ctx.set_state(record.key, str(count))
+        ctx.produce_record('out', record.key, str(count))
+
+class ReconnectTest(ComputationTestCase):
+
+    def faults(self):
+        return Faults(failure_rate=0.2, disconnect=True,
+                      methods=['setState', 'getState'], seed=37)
+
+    def run_counter(self, handler, faults=None):
+        driver, proxy = self.serve(handler, faults=faults or self.faults())
+        outputs = []
+        for _ in xrange(20):
+            transactions = driver.process_records(
+                [Record(key=key, data='', userStream='in') for key in 'ab'])
+            outputs.extend((r.key, r.data) for r in records_of(transactions))
+        self.assertGreater(proxy.faults.injected, 0)
+        self.assertEqual({'a': '20', 'b': '20'}, proxy.state)
+        self.assertEqual([(key, str(i)) for i in xrange(1, 21)
+                          for key in 'ab'], outputs)
+
+    def test_state_calls_reconnect(self):
+        self.run_counter(Counter())
+
+    def test_pipelined_state_writes_reconnect(self):
+        self.run_counter(Counter(async_state=True))
+
+    def test_rejected_pipelined_writes_are_retried(self):
+        self.run_counter(Counter(async_state=True),
+                         Faults(failure_rate=0.3, methods=['setState'],
+                                seed=39))
+
+    def test_rejected_pipelined_writes_follow_the_error_policy(self):
+        policy = ErrorPolicy(ErrorAction.DEAD_LETTER, dead_letter_stream='dead')
+        driver, proxy = self.serve(
+            Counter(async_state=True, error_policy=policy),
+            faults=Faults(failure_rate=1.0, methods=['setState']))
+        for _ in xrange(3):
+            transactions = driver.process_records(
+                [Record(key='a', data='', userStream='in')])
+            records = records_of(transactions)
+            self.assertEqual(['out', 'dead'], [r.userStream for r in records])
+            self.assertEqual('1', records[0].data)
+            letter = parse_dead_letter(records[1].data)
+            self.assertEqual(('set_state', 'a', '1'),
+                             (letter['handler'], letter['key'],
+                              letter['data']))
+        self.assertEqual({}, proxy.state)
+
+if __name__ == '__main__':
+    unittest.main()
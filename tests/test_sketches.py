@@ -0,0 +1,90 @@
+import random
+import unittest
+from concord import sketches
+from concord.sketches import CountMinSketch, HeavyHitters, HyperLogLog, TDigest
+
+def zipf_keys(count, seed):
+    rng = random.Random(seed)
+    return ['key-%d' % int(rng.paretovariate(1.2)) for _ in xrange(count)]
+
+class CountMinSketchTest(unittest.TestCase):
+
+    def test_estimates_are_bounded(self):
+        keys = zipf_keys(20000, 33)
+        sketch = CountMinSketch(width=512, depth=5)
+        for key in keys:
+            sketch.add(key)
+        for key in set(keys):
+            count = keys.count(key)
+            self.assertGreaterEqual(sketch.estimate(key), count)
+            self.assertLessEqual(sketch.estimate(key),
+                                 count + 0.01 * len(keys))
+
+    def test_merge_and_roundtrip(self):
+        left, right = CountMinSketch(64, 3), CountMinSketch(64, 3)
+        left.add('a', 3)
+        right.add('a', 2)
+        right.add(u'caf\xe9')
+        merged = sketches.loads(left.merge(right).dumps())
+        self.assertEqual((5, 1, 6), (merged.estimate('a'),
+                                     merged.estimate(u'caf\xe9'),
+                                     merged.total))
+        merged.add('a')
+        self.assertEqual(6, merged.estimate('a'))
+        self.assertRaises(Exception, left.merge, CountMinSketch(32, 3))
+
+class HeavyHittersTest(unittest.TestCase):
+
+    def test_top_keys_survive_merge_and_roundtrip(self):
+        keys = zipf_keys(20000, 35)
+        left, right = HeavyHitters(k=10), HeavyHitters(k=10)
+        for i, key in enumerate(keys):
+            (left if i % 2 else right).add(key)
+        hitters = sketches.loads(left.merge(right).dumps())
+        expected = sorted(set(keys), key=keys.count, reverse=True)[:3]
+        self.assertEqual(expected, [key for key, _ in hitters.top(3)])
+
+class HyperLogLogTest(unittest.TestCase):
+
+    def test_counts_within_error(self):
+        left, right = HyperLogLog(12), HyperLogLog(12)
+        for i in xrange(30000):
+            (left if i % 3 else right).add('key-%d' % (i % 20000))
+        merged = sketches.loads(left.merge(right).dumps())
+        self.assertLess(abs(merged.count() - 20000), 20000 * 0.05)
+
+    def test_small_counts(self):
+        sketch = HyperLogLog()
+        for key in 'abcde' * 10:
+            sketch.add(key)
+        self.assertEqual(5, sketch.count())
+
+    def test_precision_is_checked(self):
+        self.assertRaises(Exception, HyperLogLog, 3)
+        self.assertRaises(Exception, HyperLogLog(10).merge, HyperLogLog(11))
+
+class TDigestTest(unittest.TestCase):
+
+    def test_quantiles_of_merged_digests(self):
+        rng = random.Random(37)
+        values = [rng.random() for _ in xrange(20000)]
+        left, right = TDigest(), TDigest()
+        for i, value in enumerate(values):
+            (left if i % 2 else right).add(value)
+        digest = sketches.loads(left.merge(right).dumps())
+        values.sort()
+        for q in (0.01, 0.5, 0.99):
+            self.assertAlmostEqual(values[int(q * len(values))],
+                                   digest.quantile(q), delta=0.01)
+        self.assertEqual(20000, digest.count())
+
+    def test_empty_digest(self):
+        self.assertIsNone(TDigest().quantile(0.5))
+
+class LoadsTest(unittest.TestCase):
+
+    def test_unknown_sketch(self):
+        self.assertRaises(Exception, sketches.loads, 'XXXX')
+
+if __name__ == '__main__':
+    unittest.main()
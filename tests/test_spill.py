@@ -0,0 +1,167 @@
+import unittest
+from thrift.transport import TTransport
+from concord.computation import Computation, Metadata
+from concord.output import OutputLimit, OutputBuffer
+from concord.spill import SpillFile, ReplyBuffer, SpillingFramedTransport
+from concord.internal.thrift.ttypes import (
+    Record,
+    RecordMetadata,
+    ComputationTx,
+    BackPressure
+)
+from tests.helpers import ComputationTestCase, records_of
+
+class Fanout(Computation):
+    """Produces `count` records on 'out' per input, and as many on 'limited'
+    if `limits` are set, and sets a timer on `timer_key` if it is set.
+    """
+
+    def __init__(self, count, limits=None, stream_ids=False, timer_key=None):
+        self.count = count
+        self.limits = limits
+        self.stream_ids = stream_ids
+        self.timer_key = timer_key
+
+    def metadata(self):
+        return Metadata(name='fanout', istreams=['in'],
+                        ostreams=['out', 'limited'], spill_threshold=4,
+                        output_limits=self.limits, stream_ids=self.stream_ids)
+
+    def process_record(self, ctx, record):
+        for i in xrange(self.count):
+            ctx.produce_record('out', record.key, '%s-%d' % (record.data, i))
+            if self.limits:
+                ctx.produce_record('limited', record.key, str(i))
+        if self.timer_key is not None:
+            ctx.set_timer(self.timer_key, 1)
+
+    def process_timer(self, ctx, key, time):
+        for i in xrange(self.count):
+            ctx.produce_record('out', key, str(i))
+
+class SpillReplyTest(ComputationTestCase):
+
+    def test_spilled_records_are_sent_in_order(self):
+        driver, _ = self.serve(Fanout(10))
+        transactions = driver.process_records(
+            [Record(key='k', data=str(i), userStream='in') for i in xrange(3)])
+        self.assertEqual(3, len(transactions))
+        for i, transaction in enumerate(transactions):
+            self.assertIsNotNone(transaction.id)
+            self.assertEqual(['%d-%d' % (i, j) for j in xrange(10)],
+                             [r.data for r in transaction.records])
+            self.assertEqual(set(['out']),
+                             set(r.userStream for r in transaction.records))
+
+    def test_spilled_timer_reply(self):
+        driver, _ = self.serve(Fanout(9))
+        transaction = driver.process_timer('t', 1)
+        self.assertEqual([str(i) for i in xrange(9)],
+                         [r.data for r in transaction.records])
+        self.assertEqual({}, transaction.timers)
+
+    def test_spilled_reply_with_byte_timer_key(self):
+        driver, _ = self.serve(Fanout(6, timer_key='caf\xc3\xa9\xff'))
+        transactions = driver.process_records(
+            [Record(key='k', data='a', userStream='in')])
+        self.assertEqual(6, len(transactions[0].records))
+        self.assertEqual({'caf\xc3\xa9\xff': 1}, transactions[0].timers)
+
+    def test_spilled_records_with_stream_ids(self):
+        driver, _ = self.serve(Fanout(6, stream_ids={'out': 7}))
+        transactions = driver.process_records(
+            [Record(key='k', data='a', userStream='in',
+                    meta=RecordMetadata(stream=3))])
+        records = records_of(transactions)
+        self.assertEqual(6, len(records))
+        self.assertEqual([(None, 7)] * 6,
+                         [(r.userStream, r.meta.stream) for r in records])
+
+    def test_drop_head_limit_applies_to_spilled_records(self):
+        limits = {'limited': OutputLimit(3, BackPressure.DROP_HEAD)}
+        driver, _ = self.serve(Fanout(10, limits=limits))
+        transactions = driver.process_records(
+            [Record(key='k', data='a', userStream='in')])
+        records = records_of(transactions)
+        self.assertEqual(['7', '8', '9'], [r.data for r in records
+                                           if r.userStream == 'limited'])
+        self.assertEqual(10, len([r for r in records
+                                  if r.userStream == 'out']))
+
+    def test_block_sender_limit_spills_instead_of_dropping(self):
+        limits = {'limited': OutputLimit(3, BackPressure.BLOCK_SENDER)}
+        driver, _ = self.serve(Fanout(10, limits=limits))
+        transactions = driver.process_records(
+            [Record(key='k', data=str(i), userStream='in') for i in xrange(2)])
+        for transaction in transactions:
+            self.assertEqual([str(i) for i in xrange(10)],
+                             [r.data for r in transaction.records
+                              if r.userStream == 'limited'])
+
+class ReplyBufferTest(unittest.TestCase):
+
+    def send(self, framed):
+        spill_file = SpillFile()
+        spill_file.write([Record(key='k', data=str(i)) for i in xrange(3)])
+        buf = ReplyBuffer()
+        buf.write('head')
+        buf.write_spill(spill_file)
+        buf.write('tail')
+        out = TTransport.TMemoryBuffer()
+        buf.send(framed(out))
+        spill_file.close()
+        return out.getvalue()
+
+    def test_frames_match_a_framed_transport(self):
+        self.assertEqual(self.send(TTransport.TFramedTransport),
+                         self.send(SpillingFramedTransport))
+
+class OutputBufferTest(unittest.TestCase):
+
+    def produce(self, policy, count, release=None):
+        output = OutputBuffer({'s': OutputLimit(3, policy)}, release=release)
+        transaction = ComputationTx(records=[], timers={})
+        added = [output.append(transaction, Record(userStream='s', data=str(i)))
+                 for i in xrange(count)]
+        return output, transaction, added
+
+    def test_drop_tail(self):
+        output, transaction, added = self.produce(BackPressure.DROP_TAIL, 5)
+        self.assertEqual(['0', '1', '2'], [r.data for r in transaction.records])
+        self.assertEqual([True] * 3 + [False] * 2, added)
+        self.assertEqual((5, 2), (output.stats['s']['produced'],
+                                  output.stats['s']['dropped']))
+        self.assertEqual(2, output.end_batch())
+
+    def test_drop_head_removes_records_right_away(self):
+        output, transaction, _ = self.produce(BackPressure.DROP_HEAD, 5)
+        self.assertEqual(['2', '3', '4'], [r.data for r in transaction.records])
+        self.assertEqual((5, 2), (output.stats['s']['produced'],
+                                  output.stats['s']['dropped']))
+        self.assertEqual(2, output.end_batch())
+
+    def test_enqueue_keeps_every_record(self):
+        output, transaction, _ = self.produce(BackPressure.ENQUEUE, 5)
+        self.assertEqual(5, len(transaction.records))
+        self.assertEqual((2, 0), (output.stats['s']['overflow'],
+                                  output.stats['s']['dropped']))
+        self.assertEqual(0, output.end_batch())
+
+    def test_block_sender_releases_buffered_records(self):
+        released = []
+        def release(transactions):
+            released.append(sum(len(t.records) for t in transactions))
+        output, transaction, _ = self.produce(BackPressure.BLOCK_SENDER, 7,
+                                              release)
+        self.assertEqual([3, 6], released)
+        self.assertEqual(7, len(transaction.records))
+        self.assertEqual(2, output.stats['s']['blocked'])
+        self.assertGreaterEqual(output.stats['s']['blocked_ms'], 0)
+
+    def test_block_sender_needs_a_spill_threshold(self):
+        limits = {'s': OutputLimit(3, BackPressure.BLOCK_SENDER)}
+        self.assertRaises(Exception, Metadata, name='c', istreams=['in'],
+                          ostreams=['s'], output_limits=limits)
+
+if __name__ == '__main__':
+    unittest.main()
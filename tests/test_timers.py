@@ -0,0 +1,163 @@
+import random
+import unittest
+from concord.computation import Computation, Metadata
+from concord.errors import ErrorPolicy, ErrorAction
+from concord.timers import TimerWheel, kTimerWheelKey, now_ms
+from concord.internal.thrift.ttypes import Record
+from tests.helpers import ComputationTestCase, records_of, fire_timers
+
+class ReferenceScheduler:
+    """Timers kept in a dict and scanned on every advance.
+
+    Like the wheel, deadlines are rounded up to the next tick, and timers
+    due on a tick that was already advanced past fire on the next one.
+    """
+
+    def __init__(self, tick_ms):
+        self.tick_ms = tick_ms
+        self.current = 0
+        self.timers = {}
+
+    def add(self, key, time):
+        tick = max(-(-time // self.tick_ms), self.current)
+        self.timers[key] = (tick, time)
+
+    def remove(self, key):
+        self.timers.pop(key, None)
+
+    def advance(self, time):
+        target = time // self.tick_ms
+        due = sorted((tick, deadline, key)
+                     for key, (tick, deadline) in self.timers.iteritems()
+                     if tick <= target)
+        for _, _, key in due:
+            del self.timers[key]
+        self.current = max(self.current, target + 1)
+        return [(key, deadline) for _, deadline, key in due]
+
+    def next_deadline(self):
+        if not self.timers:
+            return None
+        return min(tick for tick, _ in self.timers.itervalues()) * self.tick_ms
+
+class TimerWheelTest(unittest.TestCase):
+
+    def test_matches_reference_scheduler(self):
+        rng = random.Random(29)
+        wheel = TimerWheel(tick_ms=10, slots=8, levels=3)
+        wheel.current = 0
+        reference = ReferenceScheduler(10)
+        now = 0
+        for _ in xrange(5000):
+            op = rng.random()
+            key = 'timer-%d' % rng.randrange(200)
+            if op < 0.5:
+                # Spans every level of the wheel and its overflow.
+                deadline = now + rng.choice([rng.randrange(100),
+                                             rng.randrange(10000),
+                                             rng.randrange(100000)])
+                wheel.add(key, deadline)
+                reference.add(key, deadline)
+            elif op < 0.6:
+                wheel.remove(key)
+                reference.remove(key)
+            else:
+                now += rng.choice([0, 1, 9, 10, 55, 640, 5000])
+                self.assertEqual(reference.advance(now), wheel.advance(now))
+            # The wheel may need to turn before its next timer is due, to
+            # cascade it, but never after.
+            next_deadline = wheel.next_deadline()
+            if reference.timers:
+                self.assertLessEqual(next_deadline, reference.next_deadline())
+            else:
+                self.assertIsNone(next_deadline)
+        self.assertEqual(len(reference.timers), len(wheel))
+
+class Scheduled(Computation):
+    """Sets one timer per input, at the time given by its data, and records
+    when timers fire.
+    """
+
+    def __init__(self, timer_wheel=True):
+        self.timer_wheel = timer_wheel
+        self.fired = []
+
+    def metadata(self):
+        return Metadata(name='scheduled', istreams=['in'], ostreams=['out'],
+                        timer_wheel=self.timer_wheel)
+
+    def process_record(self, ctx, record):
+        ctx.set_timer(record.key, int(record.data))
+
+    def process_timer(self, ctx, key, time):
+        self.fired.append((key, time, now_ms()))
+        ctx.produce_record('out', key, str(time))
+
+class TimerWheelDriverTest(ComputationTestCase):
+
+    def test_wheel_timers_fire_like_reference(self):
+        handler = Scheduled()
+        driver, _ = self.serve(handler)
+        start = now_ms()
+        rng = random.Random(7)
+        deadlines = dict(('t%d' % i, start + rng.randrange(20, 400))
+                         for i in xrange(30))
+        transactions = driver.process_records(
+            [Record(key=key, data=str(deadline), userStream='in')
+             for key, deadline in sorted(deadlines.iteritems())])
+        framework_timers = {}
+        for transaction in transactions:
+            framework_timers.update(transaction.timers)
+        self.assertEqual([kTimerWheelKey], framework_timers.keys())
+        fired = records_of(fire_timers(driver, framework_timers))
+        expected = sorted((deadline, key)
+                          for key, deadline in deadlines.iteritems())
+        self.assertEqual([(key, str(deadline)) for deadline, key in expected],
+                         [(r.key, r.data) for r in fired])
+        for key, deadline, fired_at in handler.fired:
+            self.assertGreaterEqual(fired_at, deadline)
+
+    def test_process_timers_batch(self):
+        handler = Scheduled(timer_wheel=False)
+        driver, _ = self.serve(handler)
+        timers = [('b', 20), ('a', 10), ('caf\xc3\xa9', 30), ('\xff', 30)]
+        transactions = driver.process_timers(timers)
+        self.assertEqual(timers, [(t.records[0].key, int(t.records[0].data))
+                                  for t in transactions])
+        self.assertEqual(str, type(transactions[2].records[0].key))
+        self.assertEqual(4, len(set(t.id for t in transactions)))
+        self.assertEqual(1, driver.stats['boltProcessTimers']['calls'])
+
+class Flaky(Computation):
+    """Sets a timer then fails, on the first `failures` attempts."""
+
+    def __init__(self, failures):
+        self.failures = failures
+        self.attempts = 0
+
+    def metadata(self):
+        return Metadata(name='flaky', istreams=['in'], ostreams=['out'],
+                        timer_wheel=True,
+                        error_policy=ErrorPolicy(ErrorAction.SKIP,
+                                                 retries=self.failures))
+
+    def process_record(self, ctx, record):
+        self.attempts += 1
+        ctx.set_timer('attempt-%d' % self.attempts, now_ms() + 50)
+        if self.attempts <= self.failures:
+            raise Exception("Injected failure")
+
+    def process_timer(self, ctx, key, time):
+        ctx.produce_record('out', key, '')
+
+class RetryTimerTest(ComputationTestCase):
+
+    def test_failed_attempts_leave_no_wheel_timers(self):
+        driver, _ = self.serve(Flaky(2))
+        transactions = driver.process_records(
+            [Record(key='k', data='', userStream='in')])
+        fired = records_of(fire_timers(driver, transactions[-1].timers))
+        self.assertEqual(['attempt-3'], [r.key for r in fired])
+
+if __name__ == '__main__':
+    unittest.main()
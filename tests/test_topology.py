@@ -0,0 +1,83 @@
+import unittest
+from concord.computation import Computation, Metadata
+from concord.topology import TopologyView
+from concord.internal.thrift.ttypes import (
+    Record,
+    Endpoint,
+    StreamMetadata,
+    TopologyMetadata,
+    ExecutorTaskInfoHelper,
+    PhysicalComputationLayout,
+    PhysicalComputationMetadata
+)
+from tests.helpers import ComputationTestCase, records_of
+
+def layout(name, istreams, instances, killed=0):
+    nodes = [PhysicalComputationMetadata(
+        taskId='%s-%d' % (name, i), killed=i < killed,
+        taskHelper=ExecutorTaskInfoHelper(
+            client=Endpoint(ip='127.0.0.1', port=9000 + i)))
+        for i in xrange(instances)]
+    return PhysicalComputationLayout(
+        name=name, nodes=nodes,
+        istreams=[StreamMetadata(name=stream) for stream in istreams])
+
+def topology(version, **computations):
+    return TopologyMetadata(version=version, computations=computations)
+
+class TopologyViewTest(unittest.TestCase):
+
+    def test_partial_updates(self):
+        view = TopologyView()
+        self.assertFalse(view.known())
+        self.assertTrue(view.update(topology(
+            1, a=layout('a', ['s'], 2), b=layout('b', ['s', 't'], 4, 1))))
+        self.assertEqual(['a', 'b'], view.consumers('s'))
+        self.assertEqual((2, 3, 3), (view.instances('a'), view.instances('b'),
+                                     view.parallelism('s')))
+        self.assertEqual([9001, 9002, 9003],
+                         [e.port for _, e in view.endpoints('b')])
+        view.update(topology(2, a=layout('a', ['s'], 5),
+                             b=PhysicalComputationLayout(name='b', nodes=[])))
+        self.assertEqual(['a'], view.consumers('s'))
+        self.assertEqual((5, 0), (view.parallelism('s'),
+                                  view.parallelism('t')))
+        self.assertIsNone(view.computation('b'))
+
+    def test_older_versions_are_ignored(self):
+        view = TopologyView()
+        updates = []
+        view.listen(lambda v: updates.append(v.version))
+        view.update(topology(3, a=layout('a', ['s'], 2)))
+        self.assertFalse(view.update(topology(2, a=layout('a', ['s'], 7))))
+        self.assertTrue(view.update(topology(3, a=layout('a', ['s'], 4))))
+        self.assertEqual(([3, 3], 4), (updates, view.parallelism('s')))
+
+class Parallelism(Computation):
+    """Produces the parallelism of 'out' as known to the computation."""
+
+    def metadata(self):
+        return Metadata(name='parallelism', istreams=['in'], ostreams=['out'])
+
+    def process_record(self, ctx, record):
+        view = ctx.topology()
+        ctx.produce_record('out', str(view.version),
+                           str(view.parallelism('out')))
+
+class TopologyUpdateTest(ComputationTestCase):
+
+    def parallelism(self, driver):
+        transactions = driver.process_records(
+            [Record(key='k', data='', userStream='in')])
+        return [(r.key, r.data) for r in records_of(transactions)]
+
+    def test_pushed_topology_is_visible_to_handlers(self):
+        driver, _ = self.serve(Parallelism())
+        self.assertEqual([('None', '0')], self.parallelism(driver))
+        driver.update_topology(topology(1, sink=layout('sink', ['out'], 3)))
+        self.assertEqual([('1', '3')], self.parallelism(driver))
+        driver.update_topology(topology(0, sink=layout('sink', ['out'], 9)))
+        self.assertEqual([('1', '3')], self.parallelism(driver))
+
+if __name__ == '__main__':
+    unittest.main()
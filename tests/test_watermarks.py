@@ -0,0 +1,62 @@
+import unittest
+from concord.computation import Computation, Metadata
+from concord.watermarks import WatermarkTracker
+from concord.internal.thrift.ttypes import Record, RecordMetadata, RecordFlags
+from concord.internal.thrift.constants import kMessageQueueWatermarkTopic
+from tests.helpers import ComputationTestCase, records_of
+
+def watermark_record(stream, time):
+    """A framework record announcing the watermark of `stream`."""
+    return Record(key=kMessageQueueWatermarkTopic, data='', userStream=stream,
+                  time=time,
+                  meta=RecordMetadata(flags=RecordFlags.FRAMEWORK_RECORD))
+
+class WatermarkTrackerTest(unittest.TestCase):
+
+    def test_lowest_watermark_once_every_stream_was_seen(self):
+        tracker = WatermarkTracker(['a', 'b'], max_out_of_orderness=10)
+        self.assertFalse(tracker.observe(Record(userStream='a', time=100)))
+        self.assertIsNone(tracker.watermark())
+        self.assertTrue(tracker.observe(Record(userStream='b', time=200)))
+        self.assertEqual(90, tracker.watermark())
+        # Out of order records never move a watermark back.
+        self.assertFalse(tracker.observe(Record(userStream='a', time=50)))
+        self.assertTrue(tracker.observe(Record(userStream='a', time=300)))
+        self.assertEqual(190, tracker.watermark())
+
+    def test_framework_watermarks(self):
+        tracker = WatermarkTracker(['a'], max_out_of_orderness=10)
+        tracker.observe(Record(userStream='a', time=100))
+        self.assertTrue(tracker.observe(watermark_record('a', 150)))
+        self.assertEqual(150, tracker.watermark())
+
+class Progress(Computation):
+    """Produces the watermark it is told about, and the one it sees."""
+
+    def metadata(self):
+        return Metadata(name='progress', istreams=['in'], ostreams=['out'],
+                        max_out_of_orderness=10)
+
+    def process_record(self, ctx, record):
+        ctx.produce_record('out', 'seen', str(ctx.watermark()))
+
+    def process_watermark(self, ctx, watermark):
+        ctx.produce_record('out', 'advanced', str(watermark))
+
+class WatermarkTest(ComputationTestCase):
+
+    def test_process_watermark(self):
+        driver, _ = self.serve(Progress())
+        transactions = driver.process_records(
+            [Record(key='k', data='', userStream='in', time=100),
+             Record(key='k', data='', userStream='in', time=50),
+             watermark_record('in', 120)])
+        self.assertEqual(3, len(transactions))
+        self.assertEqual([[('seen', 'None'), ('advanced', '90')],
+                          [('seen', '90')],
+                          [('advanced', '120')]],
+                         [[(r.key, r.data) for r in records_of(t)]
+                          for t in transactions])
+
+if __name__ == '__main__':
+    unittest.main()
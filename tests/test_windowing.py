@@ -0,0 +1,110 @@
+import unittest
+from concord.computation import Computation, Metadata
+from concord.windowing import (
+    WindowedComputation,
+    TumblingWindows,
+    SessionWindows,
+    Count,
+    kWindowTimerKey
+)
+from concord.timers import now_ms
+from concord.internal.thrift.ttypes import Record
+from tests.helpers import ComputationTestCase, records_of, fire_timers
+
+kHourMs = 3600 * 1000
+
+class Counts(WindowedComputation, Computation):
+    """Counts the records of every key in tumbling windows."""
+    windows = TumblingWindows(200)
+    aggregator = Count()
+
+    def __init__(self, istreams=['in']):
+        self.istreams = istreams
+
+    def metadata(self):
+        return Metadata(name='counts', istreams=self.istreams,
+                        ostreams=['out'])
+
+    def process_window(self, ctx, key, window, result):
+        ctx.produce_record('out', key, '%d:%d' % (window[0], result))
+
+class Sessions(Counts):
+    """Counts the records of every key in sessions."""
+    windows = SessionWindows(100)
+
+class WindowingTest(ComputationTestCase):
+
+    def test_old_in_order_records(self):
+        handler = Counts()
+        driver, _ = self.serve(handler)
+        start = now_ms() - kHourMs
+        start -= start % 200
+        outputs = []
+        for i in xrange(10):
+            transactions = driver.process_records(
+                [Record(key='k', data='', userStream='in', time=start + i)])
+            timers = {}
+            for transaction in transactions:
+                outputs.extend(records_of(transaction))
+                timers.update(transaction.timers)
+            outputs.extend(records_of(fire_timers(driver, timers,
+                                                  until=now_ms())))
+        outputs.extend(records_of(driver.process_records(
+            [Record(key='k', data='', userStream='in', time=start + 500)])))
+        self.assertEqual(['%d:10' % start], [r.data for r in outputs])
+        self.assertEqual(0, handler.window_operator().late_records)
+
+    def test_windows_close_without_watermark(self):
+        # No watermark is known until every istream was seen.
+        driver, _ = self.serve(Counts(istreams=['in', 'idle']))
+        start = now_ms() - kHourMs
+        start -= start % 200
+        transactions = driver.process_records(
+            [Record(key='k', data='', userStream='in', time=start + i)
+             for i in xrange(3)])
+        self.assertEqual([], records_of(transactions))
+        timers = transactions[0].timers
+        self.assertTrue(all(deadline > now_ms() - kHourMs
+                            for deadline in timers.itervalues()))
+        outputs = records_of(fire_timers(driver, timers))
+        self.assertEqual(['%d:3' % start], [r.data for r in outputs])
+
+    def test_windows_close_when_an_istream_is_idle(self):
+        driver, _ = self.serve(Counts(istreams=['in', 'idle']))
+        start = now_ms() - kHourMs
+        start -= start % 200
+        transactions = driver.process_records(
+            [Record(key='k', data='', userStream='idle', time=start - 1000)])
+        transactions.extend(driver.process_records(
+            [Record(key='k', data='', userStream='in', time=start + i)
+             for i in xrange(3)]))
+        timers = {}
+        for transaction in transactions:
+            timers.update(transaction.timers)
+        # The watermark is known, but held back by the idle istream.
+        outputs = records_of(fire_timers(driver, timers))
+        self.assertEqual(['%d:1' % (start - 1000), '%d:3' % start],
+                         [r.data for r in outputs])
+
+    def test_sessions_share_one_timer(self):
+        handler = Sessions(istreams=['in', 'idle'])
+        driver, _ = self.serve(handler)
+        start = now_ms() - kHourMs
+        transactions = []
+        for i in xrange(0, 1000, 100):
+            transactions.extend(driver.process_records(
+                [Record(key='k', data='', userStream='in', time=start + j)
+                 for j in xrange(i, i + 100)]))
+        timers = [t.timers for t in transactions if t.timers]
+        self.assertEqual([kWindowTimerKey], [key for t in timers for key in t])
+        operator = handler.window_operator()
+        self.assertEqual(1, len(operator.panes))
+        self.assertLess(len(operator.ends) + len(operator.unfired) +
+                        len(operator.deadlines), 100)
+        outputs = records_of(fire_timers(driver, timers[0]))
+        self.assertEqual(['%d:1000' % start], [r.data for r in outputs])
+        self.assertEqual(([], [], []), (operator.ends, operator.unfired,
+                                        operator.deadlines))
+
+if __name__ == '__main__':
+    unittest.main()